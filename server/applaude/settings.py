@@ -99,12 +99,178 @@ CELERY_RESULT_BACKEND = CELERY_BROKER_URL
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+# Pipeline phases go to queues sized for their workload: git/network I/O, LLM waits, CPU-bound tests
+CELERY_TASK_ROUTES = {
+    'worker.tasks.run_autonomous_test': {'queue': 'io'},
+    'worker.tasks.clone_phase': {'queue': 'io'},
+    'worker.tasks.plan_phase': {'queue': 'llm'},
+    'worker.tasks.execute_phase': {'queue': 'cpu'},
+    'worker.tasks.fix_phase': {'queue': 'llm'},
+    'worker.tasks.report_phase': {'queue': 'llm'},
+    'worker.tasks.deliver_phase': {'queue': 'io'},
+    'worker.tasks.refund_unqueued_runs': {'queue': 'io'},
+    'worker.tasks.collect_artifact_garbage': {'queue': 'io'},
+    'worker.tasks.render_report_pdf': {'queue': 'render'},
+    'worker.tasks.submit_message_batches': {'queue': 'io'},
+    'worker.tasks.poll_message_batches': {'queue': 'io'},
+    'worker.tasks.generate_report_directly': {'queue': 'llm'},
+    'billing.tasks.apply_paystack_events': {'queue': 'io'},
+}
+CELERY_BEAT_SCHEDULE = {
+    'refund-unqueued-runs': {'task': 'worker.tasks.refund_unqueued_runs', 'schedule': 60.0},
+    'collect-artifact-garbage': {'task': 'worker.tasks.collect_artifact_garbage', 'schedule': 3600.0},
+    'apply-paystack-events': {'task': 'billing.tasks.apply_paystack_events', 'schedule': 30.0},
+    'submit-message-batches': {'task': 'worker.tasks.submit_message_batches', 'schedule': 60.0},
+    'poll-message-batches': {'task': 'worker.tasks.poll_message_batches', 'schedule': 60.0},
+}
+# A QUEUED run with no Celery task id after this long never reached the broker and is refunded
+RUN_ENQUEUE_GRACE_SECONDS = config('RUN_ENQUEUE_GRACE_SECONDS', default=300, cast=int)
+# A phase is only acknowledged once it finishes, so a worker crash re-delivers it instead of losing it
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# --- AI Integration (Anthropic Claude) ---
+CLAUDE_API_KEY = config('CLAUDE_API_KEY', default='')
+# Upstream endpoints; point both at `manage.py mock_upstreams` for offline load tests
+CLAUDE_API_BASE_URL = config('CLAUDE_API_BASE_URL', default='https://api.anthropic.com')
+GITHUB_API_URL = config('GITHUB_API_URL', default='https://api.github.com')
+# Model routing (worker/routing.py): a fast model for short fixes and summaries, the strong one for
+# planning, reports, long prompts and fixes escalated after a failed verification
+CLAUDE_MODEL_FAST = config('CLAUDE_MODEL_FAST', default='claude-3-5-haiku-latest')
+CLAUDE_MODEL_STRONG = config('CLAUDE_MODEL_STRONG', default='claude-3-sonnet')
+CLAUDE_ROUTING_ENABLED = config('CLAUDE_ROUTING_ENABLED', default=True, cast=bool) # False = strong model for everything
+CLAUDE_ROUTE_FAST_MAX_TOKENS = config('CLAUDE_ROUTE_FAST_MAX_TOKENS', default=3000, cast=int) # Fixer prompt size
+# Plans whose fixes always start on the strong model (comma-separated Subscription plans)
+CLAUDE_ROUTE_STRONG_PLANS = config('CLAUDE_ROUTE_STRONG_PLANS', default='YEARLY', cast=lambda v: [s.strip() for s in v.split(',') if s.strip()])
+# Overloaded (529) responses or timeouts on one model before the call switches to the other
+CLAUDE_FALLBACK_AFTER_FAILURES = config('CLAUDE_FALLBACK_AFTER_FAILURES', default=1, cast=int)
+# Message Batches mode (worker/batches.py): run reports are generated offline at a discount and
+# attached when their batch ends; the run completes and its PR opens without waiting for them
+CLAUDE_BATCH_REPORTS = config('CLAUDE_BATCH_REPORTS', default=False, cast=bool)
+CLAUDE_BATCH_MAX_REQUESTS = config('CLAUDE_BATCH_MAX_REQUESTS', default=1000, cast=int) # per submitted batch
+# Batch submissions per request before the report is generated directly instead
+CLAUDE_BATCH_MAX_ATTEMPTS = config('CLAUDE_BATCH_MAX_ATTEMPTS', default=2, cast=int)
+CLAUDE_BATCH_COST_FACTOR = config('CLAUDE_BATCH_COST_FACTOR', default=0.5, cast=float) # share of the list price
+# An unconfirmed submission (the create call's outcome is unknown) is reconciled against the API's
+# batch list after this long: adopted if a batch holds it, re-queued once no unknown batch could
+CLAUDE_BATCH_RECONCILE_SECONDS = config('CLAUDE_BATCH_RECONCILE_SECONDS', default=3600, cast=int)
+# Upper bound on concurrent in-flight Claude requests from a single task (e.g. the Fixer fan-out)
+CLAUDE_MAX_CONCURRENCY = config('CLAUDE_MAX_CONCURRENCY', default=8, cast=int)
+
+# Cluster-wide rate limiting (shared token buckets on Redis) and retry policy for transient errors
+CLAUDE_RATE_LIMIT_ENABLED = config('CLAUDE_RATE_LIMIT_ENABLED', default=True, cast=bool)
+CLAUDE_REQUESTS_PER_MINUTE = config('CLAUDE_REQUESTS_PER_MINUTE', default=50, cast=int)
+CLAUDE_TOKENS_PER_MINUTE = config('CLAUDE_TOKENS_PER_MINUTE', default=80000, cast=int)
+CLAUDE_MAX_RETRIES = config('CLAUDE_MAX_RETRIES', default=6, cast=int)
+CLAUDE_RETRY_BASE_DELAY = config('CLAUDE_RETRY_BASE_DELAY', default=1.0, cast=float) # seconds
+CLAUDE_RETRY_MAX_DELAY = config('CLAUDE_RETRY_MAX_DELAY', default=60.0, cast=float) # seconds
+
+# Prompt budgets (estimated tokens). Reports over budget are map-reduced; Fixer inputs are trimmed
+REPORT_PROMPT_TOKEN_BUDGET = config('REPORT_PROMPT_TOKEN_BUDGET', default=24000, cast=int)
+REPORT_CHUNK_TOKENS = config('REPORT_CHUNK_TOKENS', default=8000, cast=int)
+REPORT_SUMMARY_MAX_TOKENS = config('REPORT_SUMMARY_MAX_TOKENS', default=800, cast=int)
+FIXER_FILE_TOKEN_BUDGET = config('FIXER_FILE_TOKEN_BUDGET', default=6000, cast=int)
+FIXER_LOG_TOKEN_BUDGET = config('FIXER_LOG_TOKEN_BUDGET', default=2000, cast=int)
+FIXER_REPO_CONTEXT_TOKEN_BUDGET = config('FIXER_REPO_CONTEXT_TOKEN_BUDGET', default=4000, cast=int) # cached prefix
+# Shortest system prefix worth a prompt-cache breakpoint: the API's minimum (2048 on Haiku models,
+# where shorter marked prefixes just go uncached)
+CLAUDE_PROMPT_CACHE_MIN_TOKENS = config('CLAUDE_PROMPT_CACHE_MIN_TOKENS', default=1024, cast=int)
+
+# Minimum seconds between progress writes to a TestRun while an agent streams its output
+RUN_PROGRESS_MIN_INTERVAL = config('RUN_PROGRESS_MIN_INTERVAL', default=2.0, cast=float)
+
+# Run event stream (SSE over a Redis stream per run). Each open stream holds an API thread, so
+# connections are short and clients resume with Last-Event-ID; nothing is lost in between
+RUN_EVENTS_HEARTBEAT_SECONDS = config('RUN_EVENTS_HEARTBEAT_SECONDS', default=15, cast=int)
+RUN_EVENTS_MAX_SECONDS = config('RUN_EVENTS_MAX_SECONDS', default=30, cast=int) # Client reconnects after this
+RUN_EVENTS_RETRY_MS = config('RUN_EVENTS_RETRY_MS', default=2000, cast=int)
+RUN_EVENTS_BACKLOG = config('RUN_EVENTS_BACKLOG', default=500, cast=int) # events kept per run for replay
+RUN_EVENTS_RETENTION_SECONDS = config('RUN_EVENTS_RETENTION_SECONDS', default=24 * 3600, cast=int)
+# Single-use stream tickets (EventSource can't send an Authorization header; a JWT in the URL would be logged)
+RUN_EVENTS_TICKET_TTL = config('RUN_EVENTS_TICKET_TTL', default=30, cast=int) # seconds
+
+# Metrics (Redis-backed, exported at /api/v1/metrics/prometheus/ for scrapers holding METRICS_TOKEN)
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+METRICS_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300) # seconds
+# USD per million tokens, for the cost estimates
+CLAUDE_INPUT_COST_PER_MTOK = config('CLAUDE_INPUT_COST_PER_MTOK', default=3.0, cast=float)
+CLAUDE_OUTPUT_COST_PER_MTOK = config('CLAUDE_OUTPUT_COST_PER_MTOK', default=15.0, cast=float)
+# Prompt caching: writing a prefix costs 1.25x the input price, reading it back 0.1x
+CLAUDE_CACHE_WRITE_COST_PER_MTOK = config('CLAUDE_CACHE_WRITE_COST_PER_MTOK', default=3.75, cast=float)
+CLAUDE_CACHE_READ_COST_PER_MTOK = config('CLAUDE_CACHE_READ_COST_PER_MTOK', default=0.30, cast=float)
+# Trace spans per phase and per Claude/GitHub call (needs opentelemetry-sdk), one JSON span per line
+TRACING_ENABLED = config('TRACING_ENABLED', default=False, cast=bool)
+TRACING_SERVICE_NAME = config('TRACING_SERVICE_NAME', default='applaude-worker')
+TRACING_EXPORT_DIR = config('TRACING_EXPORT_DIR', default=os.path.join('/tmp', 'applaude', 'traces'))
+# Window of the per-phase percentiles at /api/v1/metrics/phases/
+PHASE_STATS_DEFAULT_DAYS = config('PHASE_STATS_DEFAULT_DAYS', default=7, cast=int)
+PHASE_STATS_MAX_DAYS = config('PHASE_STATS_MAX_DAYS', default=365, cast=int)
+
+# Response cache: in-process LRU in front of a shared tier on the Celery Redis
+CLAUDE_CACHE_ENABLED = config('CLAUDE_CACHE_ENABLED', default=True, cast=bool)
+CLAUDE_CACHE_TTL = config('CLAUDE_CACHE_TTL', default=7 * 24 * 3600, cast=int) # seconds
+CLAUDE_CACHE_LOCAL_MAX_ENTRIES = config('CLAUDE_CACHE_LOCAL_MAX_ENTRIES', default=256, cast=int)
+CLAUDE_CACHE_LOCAL_MAX_BYTES = config('CLAUDE_CACHE_LOCAL_MAX_BYTES', default=32 * 1024 * 1024, cast=int)
+CLAUDE_CACHE_SHARED_MAX_ENTRIES = config('CLAUDE_CACHE_SHARED_MAX_ENTRIES', default=20000, cast=int)
+# Comma-separated agents that must always hit the API (planner, fixer, scribe)
+CLAUDE_CACHE_DISABLED_AGENTS = config('CLAUDE_CACHE_DISABLED_AGENTS', default='', cast=lambda v: [s.strip() for s in v.split(',') if s.strip()])
+
+# --- Worker Repository Cache ---
+# Bare mirrors per project plus a git worktree per run; mirrors are LRU-evicted past the size cap
+REPO_CACHE_DIR = config('REPO_CACHE_DIR', default=os.path.join('/tmp', 'applaude', 'repos'))
+REPO_CACHE_MAX_BYTES = config('REPO_CACHE_MAX_BYTES', default=20 * 1024 ** 3, cast=int)
+GIT_COMMAND_TIMEOUT = config('GIT_COMMAND_TIMEOUT', default=600, cast=int) # seconds
+# Structural index per commit (file hashes/sizes/languages + detected stacks), built incrementally
+REPO_INDEX_DIR = config('REPO_INDEX_DIR', default=os.path.join('/tmp', 'applaude', 'index'))
+REPO_INDEX_THREADS = config('REPO_INDEX_THREADS', default=8, cast=int)
+REPO_INDEX_KEEP = config('REPO_INDEX_KEEP', default=5, cast=int) # indexes kept per project, newest first
+
+# --- Generated Test Execution ---
+GENERATED_TESTS_DIR = 'applaude_tests' # Written inside the run worktree, never over the repo's own tests
+TEST_EXECUTOR_WORKERS = config('TEST_EXECUTOR_WORKERS', default=0, cast=int) # 0 = one shard per CPU core
+TEST_TIMEOUT_SECONDS = config('TEST_TIMEOUT_SECONDS', default=60, cast=int) # per test
+TEST_SHARD_TIMEOUT_SECONDS = config('TEST_SHARD_TIMEOUT_SECONDS', default=900, cast=int) # hard cap per shard
+# Start each generated test file as soon as the Planner's stream completes it, instead of waiting for
+# the whole suite; execute_phase runs the rest. Runs customer tests inside the 'llm' queue worker, so
+# only enable it where that worker is sized and isolated like the 'cpu' one
+TEST_EXECUTE_WHILE_PLANNING = config('TEST_EXECUTE_WHILE_PLANNING', default=False, cast=bool)
+# The only worker environment variables test runners see; customer code must never read the worker's secrets.
+# HOME and TMPDIR are always the shard's own scratch directory (set PLAYWRIGHT_BROWSERS_PATH to find browsers)
+TEST_ENV_PASSTHROUGH = config(
+    'TEST_ENV_PASSTHROUGH', default='PATH,LANG,LC_ALL,TZ,PLAYWRIGHT_BROWSERS_PATH',
+    cast=lambda v: [s.strip() for s in v.split(',') if s.strip()],
+)
+# Fix verification: each candidate diff is applied in its own worktree and its failing test re-run
+FIX_VERIFY_MAX_ATTEMPTS = config('FIX_VERIFY_MAX_ATTEMPTS', default=3, cast=int)
+FIX_VERIFY_CONCURRENCY = config('FIX_VERIFY_CONCURRENCY', default=4, cast=int)
+
+# --- Run Artifacts ---
+# Content-addressed store for run outputs (tests, logs, diffs, reports); shared by the API and workers
+ARTIFACT_STORE_DIR = config('ARTIFACT_STORE_DIR', default=os.path.join('/tmp', 'applaude', 'artifacts'))
+ARTIFACT_CHUNK_SIZE = config('ARTIFACT_CHUNK_SIZE', default=1024 * 1024, cast=int) # Compression frame size
+ARTIFACT_COMPRESSION = config('ARTIFACT_COMPRESSION', default='auto') # auto (zstd if installed), zstd or gzip
+ARTIFACT_RENDER_CACHE_DAYS = config('ARTIFACT_RENDER_CACHE_DAYS', default=30, cast=int) # cached PDFs re-render after this
+ARTIFACT_GC_GRACE_SECONDS = config('ARTIFACT_GC_GRACE_SECONDS', default=3600, cast=int) # unreferenced blobs younger than this are kept
+
+# --- Run Archival ---
+# Finished runs older than this move from TestRun into ArchivedRun (manage.py archive_runs)
+RUN_ARCHIVE_RETENTION_DAYS = config('RUN_ARCHIVE_RETENTION_DAYS', default=180, cast=int)
+RUN_ARCHIVE_BATCH_SIZE = config('RUN_ARCHIVE_BATCH_SIZE', default=1000, cast=int)
 
 # --- Payments (Paystack) Configuration ---
 PAYSTACK_SECRET_KEY = config('PAYSTACK_SECRET_KEY')
 PAYSTACK_PUBLIC_KEY = config('PAYSTACK_PUBLIC_KEY')
 # Paystack uses Naira (NGN) primarily, but we will assume USD for simplicity
 PAYSTACK_CURRENCY = 'USD'
+# Webhook events are recorded by the view and applied by billing.tasks.apply_paystack_events
+PAYSTACK_EVENT_BATCH_SIZE = config('PAYSTACK_EVENT_BATCH_SIZE', default=100, cast=int)
+# Transient failures are retried with exponential backoff and never dropped; past MAX_ATTEMPTS
+# each failure is alerted on (applaude_paystack_event_failures_total{final="true"})
+PAYSTACK_EVENT_MAX_ATTEMPTS = config('PAYSTACK_EVENT_MAX_ATTEMPTS', default=5, cast=int)
+PAYSTACK_EVENT_RETRY_BASE_SECONDS = config('PAYSTACK_EVENT_RETRY_BASE_SECONDS', default=30, cast=int)
+PAYSTACK_EVENT_RETRY_MAX_SECONDS = config('PAYSTACK_EVENT_RETRY_MAX_SECONDS', default=3600, cast=int)
 
 # Import environment-specific settings
 ENVIRONMENT = config('ENVIRONMENT', default='development') # Default to 'development'
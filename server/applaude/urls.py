@@ -2,9 +2,10 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from projects.views import ProjectViewSet, TestRunViewSet
+from projects.views import ProjectViewSet, TestRunViewSet, RunArtifactView, RunEventsView
 from billing.views import PaystackWebhookView, PlanList, CreateCheckoutView
 from contact.views import ContactSubmitView
+from worker.views import ClaudeCacheStatsView, ModelRoutingStatsView, PhaseTimingStatsView, PrometheusMetricsView
 
 # Set up DRF Router
 router = DefaultRouter()
@@ -32,6 +33,19 @@ urlpatterns = [
         # Contact Form
         path('contact/submit/', ContactSubmitView.as_view(), name='contact-submit'),
 
+        # Worker Metrics (staff / scraper token)
+        path('metrics/claude-cache/', ClaudeCacheStatsView.as_view(), name='claude-cache-stats'),
+        path('metrics/prometheus/', PrometheusMetricsView.as_view(), name='prometheus-metrics'),
+        path('metrics/phases/', PhaseTimingStatsView.as_view(), name='phase-timing-stats'),
+        path('metrics/routing/', ModelRoutingStatsView.as_view(), name='model-routing-stats'),
+
+        # Live run status stream (Server-Sent Events)
+        path('runs/<uuid:pk>/events/', RunEventsView.as_view(), name='testrun-events'),
+
+        # Run artifacts (range-readable downloads)
+        path('runs/<uuid:pk>/report.pdf', RunArtifactView.as_view(), {'name': 'report.pdf'}, name='testrun-report'),
+        path('runs/<uuid:pk>/artifacts/<path:name>', RunArtifactView.as_view(), name='testrun-artifact'),
+
         # Projects and Runs (DRF Viewsets)
         path('', include(router.urls)), 
     ])),
@@ -0,0 +1,32 @@
+from django.db import models
+
+
+class PaystackEvent(models.Model):
+    """
+    Raw Paystack webhook events, recorded by PaystackWebhookView before it acknowledges them.
+    Append-only: the payload is never modified, only the processing markers are set by the
+    billing.tasks.apply_paystack_events consumer. Paystack retries are absorbed by the
+    unique (event, reference) key.
+    """
+    event = models.CharField(max_length=100)
+    reference = models.CharField(max_length=255)
+    payload = models.JSONField()
+    
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True) # Backoff after a transient failure
+    error = models.TextField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'reference'], name='paystack_event_reference_uniq'),
+        ]
+        indexes = [
+            # The consumer's queue: only unprocessed rows
+            models.Index(fields=['id'], name='paystack_event_pending_idx', condition=models.Q(processed_at__isnull=True)),
+        ]
+
+    def __str__(self):
+        return f"{self.event} {self.reference}"
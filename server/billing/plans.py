@@ -0,0 +1,6 @@
+# Mock plan data for pricing logic [cite: 80]
+PAYMENT_PLANS = {
+    'WEEKLY': {'name': 'Weekly Sprint', 'price_usd': 15, 'runs': 20, 'duration_days': 7},
+    'MONTHLY': {'name': 'Monthly Startup', 'price_usd': 47, 'runs': 50, 'duration_days': 30},
+    'YEARLY': {'name': 'Yearly Scale-Up', 'price_usd': 495, 'runs': 600, 'duration_days': 365},
+}
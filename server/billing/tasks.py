@@ -0,0 +1,114 @@
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from users.models import Subscription
+from worker.metrics import increment
+from worker.redis_conn import get_redis
+from .models import PaystackEvent
+from .plans import PAYMENT_PLANS
+
+# At most one consumer nudge is queued per window, however many events a burst delivers
+NUDGE_KEY = 'billing:paystack:nudge'
+NUDGE_WINDOW_SECONDS = 2
+
+
+class EventError(Exception):
+    """An event that can never be applied (bad metadata, unknown user or plan)."""
+
+
+def schedule_event_processing():
+    """
+    Called by the webhook after recording an event. Debounced through Redis so a burst of
+    webhooks costs one consumer run; if Redis or the broker is down the periodic run
+    (CELERY_BEAT_SCHEDULE) still picks the events up.
+    """
+    try:
+        if get_redis().set(NUDGE_KEY, 1, nx=True, ex=NUDGE_WINDOW_SECONDS):
+            apply_paystack_events.apply_async(countdown=NUDGE_WINDOW_SECONDS)
+    except Exception as e:
+        print(f"Paystack: could not schedule event processing ({e}); leaving it to the periodic run.")
+
+
+@shared_task
+def apply_paystack_events():
+    """
+    Applies recorded Paystack events to subscriptions, PAYSTACK_EVENT_BATCH_SIZE at a time.
+    Batches are claimed with SKIP LOCKED, so concurrent consumers never block each other or
+    apply an event twice; an event is marked processed in the same transaction that applied it.
+    Events backing off after a transient failure are skipped until their next_attempt_at.
+    """
+    applied = 0
+    while True:
+        with transaction.atomic():
+            events = list(
+                PaystackEvent.objects.filter(processed_at__isnull=True)
+                .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=timezone.now()))
+                .select_for_update(skip_locked=True)[:settings.PAYSTACK_EVENT_BATCH_SIZE]
+            )
+            if not events:
+                break
+            for event in events:
+                _apply(event)
+            PaystackEvent.objects.bulk_update(events, ['processed_at', 'attempts', 'next_attempt_at', 'error'])
+        applied += len(events)
+    return applied
+
+
+def _apply(event):
+    event.attempts += 1
+    try:
+        with transaction.atomic(): # Savepoint: one bad event doesn't roll back the batch
+            if event.event == 'charge.success':
+                _apply_charge_success(event.reference, event.payload.get('data') or {})
+            # For recurring plans, 'subscription.create' and 'subscription.notif' events are also crucial
+    except EventError as e:
+        event.error = str(e)
+        increment('applaude_paystack_event_failures_total', event=event.event, final='true')
+        print(f"Paystack: ALERT event {event.id} ({event}) can't be applied: {e}")
+    except Exception as e:
+        # Transient (e.g. a database hiccup): back off and retry; a paid charge is never dropped.
+        # The backoff keeps this invocation's loop from picking the event straight back up.
+        event.error = f"{type(e).__name__}: {e}"
+        delay = min(
+            settings.PAYSTACK_EVENT_RETRY_BASE_SECONDS * 2 ** (event.attempts - 1), settings.PAYSTACK_EVENT_RETRY_MAX_SECONDS,
+        )
+        event.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        final = event.attempts >= settings.PAYSTACK_EVENT_MAX_ATTEMPTS
+        increment('applaude_paystack_event_failures_total', event=event.event, final=str(final).lower())
+        if final:
+            print(f"Paystack: ALERT event {event.id} ({event}) still failing after {event.attempts} attempts: {event.error}")
+        return
+    event.processed_at = timezone.now()
+
+
+def _apply_charge_success(reference, data):
+    metadata = (data.get('metadata') or {}).get('custom_fields') or {}
+    user_id = metadata.get('user_id')
+    plan_data = PAYMENT_PLANS.get(metadata.get('plan_key'))
+    if not user_id or not plan_data:
+        raise EventError("charge.success without a valid user_id/plan_key in its metadata")
+    if not get_user_model().objects.filter(pk=user_id).exists():
+        raise EventError(f"Unknown user {user_id}")
+
+    subscription, _ = Subscription.objects.select_for_update().get_or_create(
+        user_id=user_id, defaults={'plan': metadata['plan_key']},
+    )
+    if subscription.paystack_reference == reference:
+        return # Already applied (e.g. the event was replayed under another type)
+
+    subscription.plan = metadata['plan_key']
+    subscription.runs_remaining = plan_data['runs']
+    subscription.paystack_reference = reference
+    subscription.status = 'ACTIVE'
+    
+    # Set end date based on plan duration
+    subscription.end_date = timezone.now() + timedelta(days=plan_data['duration_days'])
+    
+    subscription.save()
+    print(f"Subscription for User {user_id} updated to {metadata['plan_key']}.")
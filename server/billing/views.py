@@ -5,18 +5,16 @@ from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.http import HttpResponse
+from django.utils import timezone
 
-from users.models import Subscription
-from paystack.api import Transaction, Subscription as PaystackSubscription
+from paystack.api import Transaction
+import hashlib
+import hmac
 import json
-from datetime import datetime, timedelta
 
-# Mock plan data for pricing logic [cite: 80]
-PAYMENT_PLANS = {
-    'WEEKLY': {'name': 'Weekly Sprint', 'price_usd': 15, 'runs': 20, 'duration_days': 7},
-    'MONTHLY': {'name': 'Monthly Startup', 'price_usd': 47, 'runs': 50, 'duration_days': 30},
-    'YEARLY': {'name': 'Yearly Scale-Up', 'price_usd': 495, 'runs': 600, 'duration_days': 365},
-}
+from .models import PaystackEvent
+from .plans import PAYMENT_PLANS
+from .tasks import schedule_event_processing
 
 class PlanList(APIView):
     """
@@ -42,7 +40,7 @@ class CreateCheckoutView(APIView):
         
         # Prepare transaction details
         email = request.user.email
-        reference = f"{request.user.id}-{plan_key}-{datetime.now().timestamp()}"
+        reference = f"{request.user.id}-{plan_key}-{timezone.now().timestamp()}"
 
         try:
             # Initialize Paystack Transaction
@@ -75,10 +73,10 @@ class PaystackWebhookView(APIView):
     permission_classes = () # Must be public for Paystack to access
 
     def post(self, request, *args, **kwargs):
-        # 1. Verify Paystack Signature (Crucial Security Step - not implemented for brevity)
-        # signature = request.headers.get('x-paystack-signature')
-        # if not verify_signature(request.body, signature, settings.PAYSTACK_SECRET_KEY):
-        #     return HttpResponse(status=400) 
+        # 1. Verify Paystack Signature: HMAC-SHA512 of the raw body with our secret key
+        signature = request.headers.get('x-paystack-signature', '')
+        if not verify_signature(request.body, signature, settings.PAYSTACK_SECRET_KEY):
+            return HttpResponse(status=400)
         
         try:
             payload = json.loads(request.body.decode('utf-8'))
@@ -86,39 +84,21 @@ class PaystackWebhookView(APIView):
             return HttpResponse(status=400)
 
         event = payload.get('event')
-        data = payload.get('data', {})
-
-        if event == 'charge.success':
-            # This is the most common successful payment event
-            # 2. Extract necessary data
-            reference = data.get('reference')
-            metadata = data.get('metadata', {}).get('custom_fields', {})
-            user_id = metadata.get('user_id')
-            plan_key = metadata.get('plan_key')
-            
-            if not user_id or not plan_key:
-                return HttpResponse(status=400)
+        reference = (payload.get('data') or {}).get('reference')
+        if not event or not reference:
+            return HttpResponse(status=200) # Nothing we could apply; don't make Paystack retry it
 
-            user = get_object_or_404(settings.AUTH_USER_MODEL, pk=user_id)
-            plan_data = PAYMENT_PLANS.get(plan_key)
-            
-            if not plan_data:
-                return HttpResponse(status=400)
-
-            # 3. Update the user's Subscription model 
-            subscription, created = Subscription.objects.get_or_create(user=user)
-            
-            subscription.plan = plan_key
-            subscription.runs_remaining = plan_data['runs']
-            subscription.paystack_reference = reference
-            subscription.status = 'ACTIVE'
-            
-            # Set end date based on plan duration
-            subscription.end_date = datetime.now() + timedelta(days=plan_data['duration_days'])
-            
-            subscription.save()
-            print(f"Subscription for User {user_id} updated to {plan_key}.")
-
-        # For recurring plans, 'subscription.create' and 'subscription.notif' events are also crucial
+        # 2. Record the raw event (a single INSERT; retries of the same event are ignored) and
+        # leave applying it to billing.tasks.apply_paystack_events, so acknowledging stays cheap
+        PaystackEvent.objects.bulk_create(
+            [PaystackEvent(event=event, reference=reference, payload=payload)],
+            ignore_conflicts=True,
+        )
+        schedule_event_processing()
         
         return HttpResponse(status=200) # Always return 200 OK to Paystack
+
+
+def verify_signature(body, signature, secret_key):
+    expected = hmac.new(secret_key.encode('utf-8'), body, hashlib.sha512).hexdigest()
+    return hmac.compare_digest(expected, signature)
@@ -0,0 +1,61 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified validators for the read endpoints of a viewset.
+
+    Dashboards poll these endpoints constantly; the validators come from a cheap aggregate
+    (max updated_at + row count) so an unchanged list or run is answered with a 304
+    before anything is serialised. Subclasses implement `list_version(queryset)` and
+    `object_version(obj)`, returning a dict that includes a `last_modified` datetime.
+
+    Only the ETag is validated. Last-Modified is sent for information, but If-Modified-Since
+    alone is never answered with a 304: at one-second resolution it would hide an update made
+    within the same second as the cached response.
+    """
+
+    def conditional_response(self, request, version, render):
+        etag, last_modified = self._validators(request, version)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = render()
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        # Per-user data: browsers may keep it but must revalidate, shared caches must not
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def _validators(self, request, version):
+        last_modified = version.get('last_modified')
+        # The full path covers cursor/page_size, the user id keeps users' lists apart
+        parts = [str(request.user.pk), request.get_full_path()]
+        parts += [f"{key}={version[key]}" for key in sorted(version)]
+        etag = '"%s"' % hashlib.md5('|'.join(parts).encode()).hexdigest()
+        return etag, int(last_modified.timestamp()) if last_modified else None
+
+    def list(self, request, *args, **kwargs):
+        version = self.list_version(self.filter_queryset(self.get_queryset()))
+        render = super().list
+        return self.conditional_response(request, version, lambda: render(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return self.conditional_response(
+            request, self.object_version(instance),
+            lambda: self.render_object(instance),
+        )
+
+    def render_object(self, instance):
+        return Response(self.get_serializer(instance).data)
+
+    def list_version(self, queryset):
+        raise NotImplementedError
+
+    def object_version(self, obj):
+        raise NotImplementedError
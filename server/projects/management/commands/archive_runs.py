@@ -0,0 +1,110 @@
+"""
+Moves finished runs older than the retention window out of the hot TestRun table.
+
+    python manage.py archive_runs [--days 180] [--batch-size 1000] [--jsonl runs.jsonl.gz] [--dry-run]
+
+Runs become ArchivedRun rows (optionally also appended to a gzip JSONL file) and are deleted from
+TestRun together with their checkpoints and artifacts. Archived reports and logs are dropped: their
+keys are deleted from the artifact store once the batch commits, so an archived run has no report_url.
+A project's latest test map is pinned, so change-aware selection keeps working for projects that
+haven't run in a while. Safe to run while workers are busy: each batch locks its rows with SKIP LOCKED.
+"""
+import gzip
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from projects.models import ArchivedRun, RunArtifact, TestDependencyMap, TestRun
+from worker.artifacts import delete_artifact_keys
+
+# Columns folded into ArchivedRun.data (not report_url: the report is deleted with the run)
+ARCHIVED_FIELDS = (
+    'run_type', 'commit_sha', 'full_run', 'bugs_fixed', 'pr_url', 'tokens_received',
+)
+
+
+def archive_row(run):
+    data = {field: getattr(run, field) for field in ARCHIVED_FIELDS}
+    # Phase timings only; checkpoint payloads (suites, diffs, reports) are what makes the table heavy
+    data['phases'] = {
+        checkpoint.phase: {
+            'attempts': checkpoint.attempts,
+            'started_at': checkpoint.started_at,
+            'completed_at': checkpoint.completed_at,
+        }
+        for checkpoint in run.checkpoints.all()
+    }
+    return ArchivedRun(
+        id=run.id,
+        project_id=run.project_id,
+        status=run.status,
+        started_at=run.started_at,
+        completed_at=run.completed_at,
+        data=json.loads(json.dumps(data, cls=DjangoJSONEncoder)),
+    )
+
+
+class Command(BaseCommand):
+    help = "Archives finished runs older than RUN_ARCHIVE_RETENTION_DAYS."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.RUN_ARCHIVE_RETENTION_DAYS)
+        parser.add_argument('--batch-size', type=int, default=settings.RUN_ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--jsonl', help="Also append the archived runs to this gzip JSONL file.")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # The newest test map of each project (PostgreSQL DISTINCT ON)
+        pinned = (
+            TestDependencyMap.objects.order_by('project_id', '-created_at')
+            .distinct('project_id').values('run_id')
+        )
+        candidates = (
+            TestRun.objects.filter(started_at__lt=cutoff)
+            .exclude(status__in=TestRun.ACTIVE_STATUSES)
+            .exclude(pk__in=pinned)
+        )
+
+        if options['dry_run']:
+            self.stdout.write(f"{candidates.count()} runs started before {cutoff:%Y-%m-%d} would be archived.")
+            return
+
+        archived = 0
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    candidates.order_by('started_at')
+                    .select_for_update(skip_locked=True, of=('self',))
+                    .prefetch_related('checkpoints')[:options['batch_size']]
+                )
+                if not batch:
+                    break
+                rows = [archive_row(run) for run in batch]
+                ArchivedRun.objects.bulk_create(rows, ignore_conflicts=True)
+                if options['jsonl']:
+                    self._append_jsonl(options['jsonl'], rows)
+                run_ids = [run.pk for run in batch]
+                keys = list(RunArtifact.objects.filter(run_id__in=run_ids).values_list('key', flat=True))
+                TestRun.objects.filter(pk__in=run_ids).delete()
+            # Only once the rows are gone for good; keys missed by a crash here are swept by collect_artifact_garbage
+            delete_artifact_keys(keys)
+            archived += len(batch)
+            self.stdout.write(f"Archived {archived} runs...")
+
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} runs started before {cutoff:%Y-%m-%d}."))
+
+    def _append_jsonl(self, path, rows):
+        # Appending a gzip member per batch keeps the file a valid (multi-member) gzip stream
+        with gzip.open(path, 'at', encoding='utf-8') as handle:
+            for row in rows:
+                record = {
+                    'id': row.id, 'project_id': row.project_id, 'status': row.status,
+                    'started_at': row.started_at, 'completed_at': row.completed_at, **row.data,
+                }
+                handle.write(json.dumps(record, cls=DjangoJSONEncoder) + "\n")
@@ -0,0 +1,119 @@
+"""
+Benchmarks the hot TestRun access paths, with and without the table's indexes.
+
+    python manage.py bench_run_queries --seed 1000000 --projects 2000
+    python manage.py bench_run_queries [--repeat 20] [--explain]
+    python manage.py bench_run_queries --cleanup
+
+--seed bulk-inserts synthetic runs spread over two years for a dedicated benchmark user. The
+"without indexes" pass drops the indexes inside a transaction that is rolled back (PostgreSQL DDL
+is transactional), which takes an exclusive lock on the table: run this against a benchmark
+database, never production.
+"""
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from projects.models import Project, TestRun
+
+BENCH_USERNAME = 'bench-run-queries'
+INDEXES = ('testrun_project_started_idx', 'testrun_active_status_idx')
+TERMINAL_MIX = ('COMPLETE',) * 8 + ('FAILED',) * 2
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Seeds synthetic runs and times the run list / status polling queries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help="Number of runs to insert first.")
+        parser.add_argument('--projects', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--explain', action='store_true', help="Print EXPLAIN ANALYZE plans.")
+        parser.add_argument('--cleanup', action='store_true', help="Delete the benchmark user and its data.")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        if options['cleanup']:
+            User.objects.filter(username=BENCH_USERNAME).delete()
+            self.stdout.write(self.style.SUCCESS("Benchmark data removed."))
+            return
+
+        user, _ = User.objects.get_or_create(username=BENCH_USERNAME, defaults={'email': f"{BENCH_USERNAME}@example.com"})
+        if options['seed']:
+            self._seed(user, options['seed'], options['projects'])
+
+        project = Project.objects.filter(user=user).first()
+        if project is None:
+            self.stderr.write("Nothing to benchmark; seed some runs first (--seed N).")
+            return
+
+        queries = {
+            'user runs, first page': TestRun.objects.filter(project__user=user).order_by('-started_at')[:25],
+            'project runs, first page': TestRun.objects.filter(project=project).order_by('-started_at')[:25],
+            'active runs (worker polling)': TestRun.objects.filter(status__in=TestRun.ACTIVE_STATUSES).order_by('started_at')[:100],
+        }
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE projects_testrun")
+
+        with_indexes = self._time(queries, options)
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    for name in INDEXES:
+                        cursor.execute(f'DROP INDEX IF EXISTS "{name}"')
+                without_indexes = self._time(queries, options)
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+        self.stdout.write(f"\n{'query':<32}{'no indexes':>14}{'indexed':>14}{'speed-up':>10}")
+        for label in queries:
+            before, after = without_indexes[label], with_indexes[label]
+            self.stdout.write(f"{label:<32}{before:>11.2f} ms{after:>11.2f} ms{before / max(after, 1e-6):>9.1f}x")
+
+    def _time(self, queries, options):
+        medians = {}
+        for label, queryset in queries.items():
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                list(queryset)
+                timings.append((time.perf_counter() - started) * 1000)
+            medians[label] = statistics.median(timings)
+            if options['explain']:
+                self.stdout.write(f"-- {label}\n{queryset.explain(analyze=True)}\n")
+        return medians
+
+    def _seed(self, user, runs, projects):
+        now = timezone.now()
+        existing = list(Project.objects.filter(user=user))
+        existing += Project.objects.bulk_create(
+            Project(user=user, name=f"bench-{i}", github_url=f"https://github.com/bench/repo-{i}")
+            for i in range(len(existing), projects)
+        )
+        batch_size = 10000
+        for offset in range(0, runs, batch_size):
+            batch, started = [], []
+            for _ in range(min(batch_size, runs - offset)):
+                # About 1 in 500 runs is still in flight, like a busy production table
+                status = random.choice(TestRun.ACTIVE_STATUSES) if random.random() < 0.002 else random.choice(TERMINAL_MIX)
+                batch.append(TestRun(project=random.choice(existing), status=status))
+                started.append(now - timedelta(seconds=random.randint(0, 730 * 24 * 3600)))
+            TestRun.objects.bulk_create(batch)
+            # started_at is auto_now_add, so backdate it in a second pass
+            for run, started_at in zip(batch, started):
+                run.started_at = started_at
+                if run.status not in TestRun.ACTIVE_STATUSES:
+                    run.completed_at = started_at + timedelta(minutes=10)
+            TestRun.objects.bulk_update(batch, ['started_at', 'completed_at'], batch_size=2000)
+            self.stdout.write(f"Seeded {offset + len(batch)} / {runs} runs")
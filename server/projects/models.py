@@ -1,6 +1,34 @@
 import uuid
 from django.db import models
+from django.db.models import Case, Count, F, IntegerField, Max, OuterRef, Q, Subquery, Sum, When
+from django.db.models.fields.json import KT
+from django.db.models.functions import Cast, Coalesce
 from django.conf import settings
+from django.utils import timezone
+
+from users.models import Subscription
+
+class ProjectQuerySet(models.QuerySet):
+    def with_run_stats(self):
+        """
+        Annotates runs_count, last_run_status, last_completed_at and bugs_fixed from
+        ProjectRunStats in the same query. Projects without a stats row fall back to
+        correlated subqueries over their runs (only evaluated for those rows).
+        """
+        runs = TestRun.objects.filter(project=OuterRef('pk')).order_by()
+        totals = runs.values('project')
+        has_stats = Q(run_stats__isnull=False)
+
+        def from_stats(field, fallback):
+            return Case(When(has_stats, then=F(f'run_stats__{field}')), default=Subquery(fallback))
+
+        return self.annotate(
+            runs_count=from_stats('runs_count', totals.annotate(n=Count('id')).values('n')),
+            last_run_status=from_stats('last_run_status', runs.order_by('-started_at').values('status')[:1]),
+            last_completed_at=from_stats('last_completed_at', totals.annotate(at=Max('completed_at')).values('at')),
+            bugs_fixed=from_stats('bugs_fixed', totals.annotate(n=Sum('bugs_fixed')).values('n')),
+        )
+
 
 class Project(models.Model):
     """
@@ -10,16 +38,22 @@ class Project(models.Model):
     name = models.CharField(max_length=255)
     github_url = models.URLField(max_length=512)
     
-    # Simple placeholder for the cloning path on the worker machine
+    # Path of the project's cached bare mirror on the worker machine (see worker/repo_cache.py)
     local_path = models.CharField(max_length=512, blank=True, null=True) 
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProjectQuerySet.as_manager()
+
     def __str__(self):
         return f"Project: {self.name} by {self.user.email}"
 
 
+# Statuses a run passes through while the worker owns it
+ACTIVE_RUN_STATUSES = ('QUEUED', 'CLONING', 'TESTING', 'DEBUGGING', 'REPORTING')
+
+
 class TestRun(models.Model):
     """
     Represents a single autonomous execution by the 3-Agent system.
@@ -47,15 +81,387 @@ class TestRun(models.Model):
     status = models.CharField(max_length=50, choices=STATUS_CHOICES, default='QUEUED')
     run_type = models.CharField(max_length=50, choices=TYPE_CHOICES, default='FULL_STACK')
     
+    # Commit the run tested, and whether to skip change-aware selection and test everything
+    commit_sha = models.CharField(max_length=40, blank=True, null=True)
+    full_run = models.BooleanField(default=False)
+    
     # Delivery artifacts [cite: 146]
     pr_url = models.URLField(max_length=512, blank=True, null=True)
     report_url = models.URLField(max_length=512, blank=True, null=True) 
     
+    # Set once the run's quota reservation was given back (it never reached the queue)
+    quota_refunded = models.BooleanField(default=False)
+    
+    # Verified fixes merged onto the PR branch (rolled up into ProjectRunStats.bugs_fixed)
+    bugs_fixed = models.PositiveIntegerField(default=0)
+    
+    # Cost/latency aggregates, copied from the worker's metrics at the end of every phase (worker/metrics.py)
+    claude_calls = models.PositiveIntegerField(default=0)
+    claude_seconds = models.FloatField(default=0)
+    claude_retries = models.PositiveIntegerField(default=0)
+    cache_hits = models.PositiveIntegerField(default=0)
+    input_tokens = models.PositiveIntegerField(default=0)
+    output_tokens = models.PositiveIntegerField(default=0)
+    # Prompt-cached prefix tokens (billed apart from input_tokens): written to / read from the cache
+    prompt_cache_write_tokens = models.PositiveIntegerField(default=0)
+    prompt_cache_read_tokens = models.PositiveIntegerField(default=0)
+    cost_usd = models.FloatField(default=0)
+    github_calls = models.PositiveIntegerField(default=0)
+    github_seconds = models.FloatField(default=0)
+    
+    # Live progress while an agent is streaming its output (throttled writes from the worker)
+    tokens_received = models.PositiveIntegerField(default=0)
+    progress_updated_at = models.DateTimeField(null=True, blank=True)
+    
     started_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
+    # Bumped on every write; drives the ETag/Last-Modified of the runs API (projects/conditional.py)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    ACTIVE_STATUSES = ACTIVE_RUN_STATUSES
 
     class Meta:
         ordering = ['-started_at']
+        indexes = [
+            # Run lists: always scoped to a project (or the user's projects), newest first
+            models.Index(fields=['project', '-started_at'], name='testrun_project_started_idx'),
+            # Active-run polling (ACTIVE_STATUSES); partial, so it stays tiny however large the history grows
+            models.Index(
+                fields=['status', 'started_at'], name='testrun_active_status_idx',
+                condition=Q(status__in=ACTIVE_RUN_STATUSES),
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Partial saves would otherwise skip auto_now and leave cached responses looking fresh
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'updated_at' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'updated_at']
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Run {self.id} on {self.project.name} - {self.status}"
+
+    def fail_and_refund(self):
+        """
+        Marks a run that never made it into the queue FAILED and returns its run to the
+        owner's quota. Claimed with a conditional UPDATE, so the refund happens at most once
+        even if the view and the sweeper race. Returns whether this call did the refund.
+        """
+        claimed = TestRun.objects.filter(pk=self.pk, quota_refunded=False).update(
+            quota_refunded=True, status='FAILED', updated_at=timezone.now(),
+        )
+        if not claimed:
+            return False
+        self.status, self.quota_refunded = 'FAILED', True
+        Subscription.refund_run(self.project.user_id)
+        ProjectRunStats.run_status_changed(self)
+        return True
+
+
+class ProjectRunStats(models.Model):
+    """
+    Denormalised run statistics of a Project, so project lists don't count runs per row.
+    Maintained at the points where runs change state (start_run, worker status changes,
+    completion). Rows are created lazily from the runs table, which also backfills projects
+    that predate this model.
+    """
+    project = models.OneToOneField(Project, on_delete=models.CASCADE, primary_key=True, related_name='run_stats')
+    runs_count = models.PositiveIntegerField(default=0)
+    last_run_status = models.CharField(max_length=50, blank=True, null=True)
+    last_run_started_at = models.DateTimeField(null=True, blank=True)
+    last_completed_at = models.DateTimeField(null=True, blank=True)
+    bugs_fixed = models.PositiveIntegerField(default=0)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Run stats for project {self.project_id}"
+
+    @staticmethod
+    def from_runs(project_id):
+        """
+        Recompute the statistics from the runs and archived runs tables (used to create
+        missing rows), so a project's history still counts after archive_runs.
+        """
+        runs = TestRun.objects.filter(project_id=project_id)
+        archived = ArchivedRun.objects.filter(project_id=project_id)
+        totals = runs.aggregate(
+            runs_count=Count('id'),
+            last_completed_at=Max('completed_at'),
+            bugs_fixed=Coalesce(Sum('bugs_fixed'), 0),
+        )
+        archived_totals = archived.aggregate(
+            runs_count=Count('id'),
+            last_completed_at=Max('completed_at'),
+            bugs_fixed=Coalesce(Sum(Cast(KT('data__bugs_fixed'), IntegerField())), 0),
+        )
+        totals['runs_count'] += archived_totals['runs_count']
+        totals['bugs_fixed'] += archived_totals['bugs_fixed']
+        totals['last_completed_at'] = max(
+            filter(None, (totals['last_completed_at'], archived_totals['last_completed_at'])), default=None,
+        )
+        # Not necessarily a live run: archive_runs keeps old runs that hold a project's test map
+        candidates = [
+            queryset.order_by('-started_at').values('status', 'started_at').first() for queryset in (runs, archived)
+        ]
+        last_run = max(filter(None, candidates), key=lambda run: run['started_at'], default=None)
+        totals['last_run_status'] = last_run['status'] if last_run else None
+        totals['last_run_started_at'] = last_run['started_at'] if last_run else None
+        return totals
+
+    @classmethod
+    def _ensure(cls, project_id):
+        # True when the row was just built from the runs table, i.e. it already reflects the change
+        _, created = cls.objects.get_or_create(project_id=project_id, defaults=cls.from_runs(project_id))
+        return created
+
+    @classmethod
+    def run_started(cls, run):
+        if cls._ensure(run.project_id):
+            return
+        cls.objects.filter(project_id=run.project_id).update(
+            runs_count=F('runs_count') + 1,
+            last_run_status=run.status,
+            last_run_started_at=run.started_at,
+        )
+
+    @classmethod
+    def run_status_changed(cls, run):
+        if cls._ensure(run.project_id):
+            return
+        # Only the project's most recent run decides last_run_status
+        cls.objects.filter(project_id=run.project_id).filter(
+            Q(last_run_started_at__isnull=True) | Q(last_run_started_at__lte=run.started_at)
+        ).update(last_run_status=run.status, last_run_started_at=run.started_at)
+
+    @classmethod
+    def run_completed(cls, run):
+        """Call exactly once per run, after it has been saved as COMPLETE."""
+        if cls._ensure(run.project_id):
+            return
+        cls.objects.filter(project_id=run.project_id).update(
+            bugs_fixed=F('bugs_fixed') + run.bugs_fixed,
+            last_completed_at=run.completed_at,
+        )
+        cls.run_status_changed(run)
+
+
+class ArchivedRun(models.Model):
+    """
+    Cold storage for finished runs past RUN_ARCHIVE_RETENTION_DAYS (see the archive_runs command).
+    Only the columns dashboards filter on are kept; everything else is folded into `data`.
+    ProjectRunStats keeps counting archived runs (see ProjectRunStats.from_runs).
+    """
+    id = models.UUIDField(primary_key=True, editable=False) # Same id the TestRun had
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='archived_runs')
+    status = models.CharField(max_length=50)
+    started_at = models.DateTimeField()
+    completed_at = models.DateTimeField(null=True, blank=True)
+    data = models.JSONField(default=dict)
+    
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['project', '-started_at'], name='archivedrun_project_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived run {self.id} ({self.status})"
+
+
+class RunArtifact(models.Model):
+    """
+    An output of a run (generated tests, raw test logs, diffs, the report) kept in the
+    artifact store (worker/artifacts.py). Content lives in the store under `key`; identical
+    content is stored once across runs.
+    """
+    run = models.ForeignKey(TestRun, on_delete=models.CASCADE, related_name='artifacts')
+    name = models.CharField(max_length=512) # e.g. "report.md", "logs/shard-1-pytest.log"
+    key = models.CharField(max_length=600)
+    sha256 = models.CharField(max_length=64)
+    size = models.PositiveBigIntegerField(default=0)
+    content_type = models.CharField(max_length=100, default='application/octet-stream')
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['name']
+        unique_together = ('run', 'name')
+
+    def __str__(self):
+        return f"{self.name} of run {self.run_id}"
+
+
+class RunCheckpoint(models.Model):
+    """
+    Durable output of one pipeline phase of a TestRun (see worker/tasks.py).
+    A run resumes from the first phase without a completed checkpoint.
+    """
+    PHASE_CHOICES = (
+        ('clone', 'Clone'),
+        ('plan', 'Plan'),
+        ('execute', 'Execute'),
+        ('fix', 'Fix'),
+        ('report', 'Report'),
+        ('deliver', 'Deliver'),
+    )
+
+    run = models.ForeignKey(TestRun, on_delete=models.CASCADE, related_name='checkpoints')
+    phase = models.CharField(max_length=20, choices=PHASE_CHOICES)
+    data = models.JSONField(default=dict)
+    attempts = models.PositiveIntegerField(default=0)
+    
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('run', 'phase')
+
+    def __str__(self):
+        return f"{self.phase} checkpoint for run {self.run_id}"
+
+class PhaseTiming(models.Model):
+    """
+    One execution attempt of a pipeline phase: where and how long it ran. Unlike the checkpoint
+    (one row per phase, overwritten on retry) every attempt is kept, for per-phase latency
+    percentiles across runs (/api/v1/metrics/phases/).
+    """
+    OUTCOME_CHOICES = (
+        ('RUNNING', 'Running'),
+        ('OK', 'Completed'),
+        ('ERROR', 'Failed'),
+    )
+
+    run = models.ForeignKey(TestRun, on_delete=models.CASCADE, related_name='phase_timings')
+    phase = models.CharField(max_length=20, choices=RunCheckpoint.PHASE_CHOICES)
+    attempt = models.PositiveIntegerField(default=1)
+    worker_host = models.CharField(max_length=255, blank=True)
+    outcome = models.CharField(max_length=10, choices=OUTCOME_CHOICES, default='RUNNING')
+    
+    started_at = models.DateTimeField()
+    completed_at = models.DateTimeField(null=True, blank=True)
+    duration_seconds = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['started_at']
+        indexes = [
+            # Percentiles are always taken per phase over a recent window
+            models.Index(fields=['phase', 'started_at'], name='phasetiming_phase_started_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.phase} attempt {self.attempt} of run {self.run_id}"
+
+
+class ModelRoutingDecision(models.Model):
+    """
+    Which model served one Claude call and why (worker/routing.py), with its latency and usage,
+    so the routing thresholds can be tuned from real traffic (/api/v1/metrics/routing/).
+    Outlives the run it belongs to (archival only unlinks it).
+    """
+    OUTCOME_CHOICES = (
+        ('OK', 'Answered'),
+        ('CACHE_HIT', 'Response cache hit'),
+        ('ERROR', 'Failed'),
+    )
+
+    run = models.ForeignKey(TestRun, on_delete=models.SET_NULL, null=True, blank=True, related_name='routing_decisions')
+    agent = models.CharField(max_length=20)
+    task = models.CharField(max_length=20)
+    plan = models.CharField(max_length=50, blank=True)
+    prompt_tokens = models.PositiveIntegerField(default=0) # Estimated, as seen by the router
+    escalation = models.PositiveIntegerField(default=0)
+    
+    routed_model = models.CharField(max_length=100)
+    model = models.CharField(max_length=100) # Differs from routed_model after a fallback
+    reason = models.CharField(max_length=255)
+    fell_back = models.BooleanField(default=False)
+    
+    outcome = models.CharField(max_length=10, choices=OUTCOME_CHOICES)
+    latency_seconds = models.FloatField()
+    retries = models.PositiveIntegerField(default=0)
+    input_tokens = models.PositiveIntegerField(default=0)
+    output_tokens = models.PositiveIntegerField(default=0)
+    cost_usd = models.FloatField(default=0)
+    
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['agent', 'created_at'], name='routing_agent_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.agent}/{self.task} -> {self.model} ({self.reason})"
+
+
+class BatchRequest(models.Model):
+    """
+    A Claude request deferred to the Message Batches API (worker/batches.py): queued here,
+    submitted with others in one batch, and its result attached to the run once it arrives.
+    """
+    KIND_CHOICES = (
+        ('report', 'Run report'),
+    )
+    STATUS_CHOICES = (
+        ('PENDING', 'Waiting to be submitted'),
+        ('SUBMITTING', 'Submission in flight or unconfirmed'),
+        ('SUBMITTED', 'In a batch'),
+        ('SUCCEEDED', 'Result attached'),
+        ('FAILED', 'Failed'),
+    )
+
+    run = models.ForeignKey(TestRun, on_delete=models.CASCADE, related_name='batch_requests')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    custom_id = models.CharField(max_length=64, unique=True) # Matches results back to requests
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    
+    # Messages API request body (model, max_tokens, system, messages) and the router's choice
+    params = models.JSONField()
+    route = models.JSONField(default=dict)
+    
+    batch_id = models.CharField(max_length=100, blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    submitted_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            # Submitter and poller only ever look at the open requests
+            models.Index(
+                fields=['status', 'created_at'], name='batchrequest_open_idx',
+                condition=Q(status__in=('PENDING', 'SUBMITTING', 'SUBMITTED')),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} batch request for run {self.run_id} ({self.status})"
+
+
+class TestDependencyMap(models.Model):
+    """
+    The generated test suite of a run together with the repo files each test depends on.
+    Follow-up runs of the same project re-run only the tests affected by the commit diff.
+    """
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='test_maps')
+    run = models.OneToOneField(TestRun, on_delete=models.CASCADE, related_name='test_map')
+    commit_sha = models.CharField(max_length=40)
+    
+    # {test_path: {"code": "...", "sources": ["app/views.py", ...]}}
+    tests = models.JSONField(default=dict)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Test map for {self.project.name} @ {self.commit_sha[:8]}"
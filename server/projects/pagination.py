@@ -0,0 +1,20 @@
+from rest_framework.pagination import CursorPagination
+
+
+class RunCursorPagination(CursorPagination):
+    """
+    Keyset pagination over a user's runs. Unlike offset pages it stays O(page) deep into
+    the history and doesn't skip/duplicate rows while new runs are being started. `id`
+    breaks ties between runs started at the same instant, so pages never overlap or skip.
+    """
+    ordering = ('-started_at', '-id')
+    page_size = 25
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class ProjectCursorPagination(CursorPagination):
+    ordering = ('-created_at', '-id')
+    page_size = 25
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -1,19 +1,34 @@
 from rest_framework import serializers
-from .models import Project, TestRun
+from .models import PhaseTiming, Project, RunArtifact, TestRun
 
 class ProjectSerializer(serializers.ModelSerializer):
     """
     Serializer for Project objects (GitHub Repositories).
+    Run statistics come from Project.objects.with_run_stats() annotations, never per-row queries.
     """
     runs_count = serializers.SerializerMethodField()
+    last_run_status = serializers.SerializerMethodField()
+    last_completed_at = serializers.SerializerMethodField()
+    bugs_fixed = serializers.SerializerMethodField()
     
     class Meta:
         model = Project
-        fields = ('id', 'name', 'github_url', 'created_at', 'runs_count')
-        read_only_fields = ('created_at', 'runs_count')
-        
+        fields = ('id', 'name', 'github_url', 'created_at', 'runs_count', 'last_run_status', 'last_completed_at', 'bugs_fixed')
+        read_only_fields = ('created_at', 'runs_count', 'last_run_status', 'last_completed_at', 'bugs_fixed')
+
+    # A project that was just created isn't annotated, and has no runs yet either
     def get_runs_count(self, project):
-        return project.runs.count()
+        return getattr(project, 'runs_count', None) or 0
+
+    def get_last_run_status(self, project):
+        return getattr(project, 'last_run_status', None)
+
+    def get_last_completed_at(self, project):
+        completed_at = getattr(project, 'last_completed_at', None)
+        return serializers.DateTimeField().to_representation(completed_at) if completed_at else None
+
+    def get_bugs_fixed(self, project):
+        return getattr(project, 'bugs_fixed', None) or 0
 
 class TestRunSerializer(serializers.ModelSerializer):
     """
@@ -25,11 +40,39 @@ class TestRunSerializer(serializers.ModelSerializer):
     class Meta:
         model = TestRun
         fields = (
-            'id', 'project_name', 'status', 'status_display', 'run_type', 
-            'pr_url', 'report_url', 'started_at', 'completed_at'
+            'id', 'project_name', 'status', 'status_display', 'run_type', 'commit_sha', 'full_run',
+            'bugs_fixed', 'pr_url', 'report_url', 'tokens_received', 'progress_updated_at',
+            'claude_calls', 'claude_seconds', 'input_tokens', 'output_tokens',
+            'prompt_cache_write_tokens', 'prompt_cache_read_tokens', 'cost_usd',
+            'started_at', 'completed_at'
         )
         read_only_fields = fields
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Every queryset this serializer renders goes through here (project_name needs the join)."""
+        return queryset.select_related('project')
+
+
+class RunArtifactSerializer(serializers.ModelSerializer):
+    """
+    Stored output of a run (content is served by RunArtifactView).
+    """
+    class Meta:
+        model = RunArtifact
+        fields = ('name', 'size', 'content_type', 'sha256', 'created_at')
+        read_only_fields = fields
+
+
+class PhaseTimingSerializer(serializers.ModelSerializer):
+    """
+    One attempt of a pipeline phase of a run.
+    """
+    class Meta:
+        model = PhaseTiming
+        fields = ('phase', 'attempt', 'outcome', 'worker_host', 'started_at', 'completed_at', 'duration_seconds')
+        read_only_fields = fields
+
 
 class StartRunSerializer(serializers.Serializer):
     """
@@ -42,3 +85,8 @@ class StartRunSerializer(serializers.Serializer):
         required=True,
         help_text="Option A: FULL_STACK, Option B: FRONTEND_ONLY"
     )
+    full_run = serializers.BooleanField(
+        required=False,
+        default=False,
+        help_text="Ignore the previous run's test map and test the whole repository."
+    )
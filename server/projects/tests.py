@@ -0,0 +1,91 @@
+"""
+Query-count regression tests for the projects/runs API.
+
+Every endpoint must issue a fixed number of SQL queries however many projects and runs the
+user has (no N+1), within the budgets below. Authentication is forced, so it costs none.
+"""
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from .models import ArchivedRun, Project, ProjectRunStats, TestRun
+
+BUDGETS = {
+    'project-list': 3,    # two validator aggregates + the page
+    'project-detail': 2,  # the object + the runs aggregate for its validators
+    'testrun-list': 2,    # validator aggregate + the page
+    'testrun-detail': 1,
+    'testrun-status': 1,
+}
+
+
+class QueryCountTests(TestCase):
+    SIZES = (1, 25)
+
+    def _seed(self, size):
+        user = get_user_model().objects.create_user(
+            username=f"query-count-{size}", email=f"query-count-{size}@example.com", password=None,
+        )
+        projects = Project.objects.bulk_create(
+            Project(user=user, name=f"project-{i}", github_url=f"https://github.com/example/project-{i}")
+            for i in range(size)
+        )
+        runs = TestRun.objects.bulk_create(
+            TestRun(project=project, status=status)
+            for project in projects for status in ('COMPLETE', 'FAILED')
+        )
+        # Leave every other project without a stats row to cover the annotate fallback
+        ProjectRunStats.objects.bulk_create(
+            ProjectRunStats(project=project, **ProjectRunStats.from_runs(project.pk)) for project in projects[::2]
+        )
+        return user, projects[0], runs[0]
+
+    def _measure(self, size):
+        user, project, run = self._seed(size)
+        client = APIClient()
+        client.force_authenticate(user)
+        urls = {
+            'project-list': reverse('project-list'),
+            'project-detail': reverse('project-detail', args=[project.pk]),
+            'testrun-list': reverse('testrun-list'),
+            'testrun-detail': reverse('testrun-detail', args=[run.pk]),
+            'testrun-status': reverse('testrun-status', args=[run.pk]),
+        }
+        counts = {}
+        for name, url in urls.items():
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url, {'page_size': 100} if name.endswith('list') else None)
+            self.assertEqual(response.status_code, 200, name)
+            counts[name] = len(queries)
+        return counts
+
+    def test_query_counts_are_constant_and_within_budget(self):
+        counts = {size: self._measure(size) for size in self.SIZES}
+        for name, budget in BUDGETS.items():
+            with self.subTest(endpoint=name):
+                seen = {counts[size][name] for size in self.SIZES}
+                self.assertEqual(len(seen), 1, f"{name}: query count varies with list size {sorted(seen)}")
+                self.assertLessEqual(max(seen), budget)
+
+
+class ProjectRunStatsTests(TestCase):
+
+    def test_from_runs_counts_archived_runs(self):
+        user = get_user_model().objects.create_user(username="stats", email="stats@example.com", password=None)
+        project = Project.objects.create(user=user, name="project", github_url="https://github.com/example/project")
+        run = TestRun.objects.create(project=project, status='COMPLETE', bugs_fixed=2)
+        ArchivedRun.objects.create(
+            id=uuid.uuid4(), project=project, status='FAILED',
+            started_at=run.started_at.replace(year=run.started_at.year - 1), data={'bugs_fixed': 3},
+        )
+
+        stats = ProjectRunStats.from_runs(project.pk)
+
+        self.assertEqual(stats['runs_count'], 2)
+        self.assertEqual(stats['bugs_fixed'], 5)
+        self.assertEqual(stats['last_run_status'], 'COMPLETE')
@@ -1,88 +1,345 @@
+import json
+import os
+import re
+import time
+
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.renderers import BaseRenderer
 from rest_framework.response import Response
+from rest_framework.views import APIView
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, Max
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 
-from .models import Project, TestRun
-from .serializers import ProjectSerializer, TestRunSerializer, StartRunSerializer
+from .conditional import ConditionalGetMixin
+from .models import BatchRequest, Project, ProjectRunStats, RunArtifact, TestRun
+from .pagination import ProjectCursorPagination, RunCursorPagination
+from .serializers import PhaseTimingSerializer, ProjectSerializer, RunArtifactSerializer, TestRunSerializer, StartRunSerializer
+from users.authentication import QueryParamJWTAuthentication, StreamTicketAuthentication, issue_stream_ticket
+from users.models import Subscription
+from worker.artifacts import InvalidRange, NoSuchKey, delete_artifact_keys, get_artifact_store
+from worker.events import TERMINAL_STATUSES, publish_status, run_channel
+from worker.redis_conn import get_redis
 from worker.tasks import run_autonomous_test # Import the Celery task
 
-class ProjectViewSet(viewsets.ModelViewSet):
+class ProjectViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows projects (GitHub repos) to be viewed or edited.
     """
     serializer_class = ProjectSerializer
+    pagination_class = ProjectCursorPagination
     
     def get_queryset(self):
         # Only show projects belonging to the authenticated user
+        return self.owned_projects().with_run_stats()
+
+    def owned_projects(self):
         return Project.objects.filter(user=self.request.user)
 
+    def list_version(self, queryset):
+        # Validators don't need the stats annotations. Run stats are part of the payload,
+        # so run churn has to change them too
+        projects = self.owned_projects().aggregate(count=Count('id'), last=Max('updated_at'))
+        runs = TestRun.objects.filter(project__user=self.request.user).aggregate(count=Count('id'), last=Max('updated_at'))
+        stamps = [stamp for stamp in (projects['last'], runs['last']) if stamp]
+        return {'count': projects['count'], 'runs': runs['count'], 'last_modified': max(stamps, default=None)}
+
+    def object_version(self, project):
+        runs = project.runs.aggregate(count=Count('id'), last=Max('updated_at'))
+        stamps = [stamp for stamp in (project.updated_at, runs['last']) if stamp]
+        return {'runs': runs['count'], 'last_modified': max(stamps)}
+
     def perform_create(self, serializer):
         # Automatically set the user on project creation
-        serializer.save(user=self.request.user)
+        project = serializer.save(user=self.request.user)
+        ProjectRunStats.objects.create(project=project)
+
+    def perform_destroy(self, instance):
+        # The cascade removes the runs' RunArtifact rows; their store keys go once that has committed
+        keys = list(RunArtifact.objects.filter(run__project=instance).values_list('key', flat=True))
+        instance.delete()
+        transaction.on_commit(lambda: delete_artifact_keys(keys))
 
     @action(detail=True, methods=['post'], url_path='run')
     def start_run(self, request, pk=None):
         """
         Endpoint to start an autonomous test run for a specific project.
-        Core logic: Check subscription -> Decrement run count -> Trigger Celery task.
+        Core logic: Reserve a run from the quota -> Create the run -> Trigger Celery task
+        (the reservation is refunded if the run can't be queued).
         """
         project = self.get_object()
-        user_subscription = getattr(request.user, 'subscription', None)
 
-        # 1. Check Subscription and Remaining Runs [cite: 114]
-        if not user_subscription or user_subscription.runs_remaining <= 0:
+        # Validate the run type input (before anything is charged)
+        serializer = StartRunSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        run_type = serializer.validated_data['run_type']
+        full_run = serializer.validated_data['full_run']
+
+        # 1. Check and decrement runs_remaining in one atomic UPDATE [cite: 114, 115]
+        runs_remaining = Subscription.reserve_run(request.user)
+        if runs_remaining is None:
             return Response(
                 {"detail": "No runs remaining. Please upgrade your subscription."},
                 status=status.HTTP_402_PAYMENT_REQUIRED
             )
-
-        # Validate the run type input
-        serializer = StartRunSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        run_type = serializer.validated_data['run_type']
-        
-        # 2. Decrement runs_remaining [cite: 115]
-        user_subscription.runs_remaining -= 1
-        user_subscription.save(update_fields=['runs_remaining'])
         
-        # 3. Create a new TestRun object (status='Queued') 
-        test_run = TestRun.objects.create(
-            project=project,
-            status='QUEUED',
-            run_type=run_type
-        )
+        # 2. Create a new TestRun object (status='Queued') 
+        try:
+            test_run = TestRun.objects.create(
+                project=project,
+                status='QUEUED',
+                run_type=run_type,
+                full_run=full_run
+            )
+        except Exception:
+            Subscription.refund_run(request.user.id)
+            raise
+        ProjectRunStats.run_started(test_run)
         
-        # 4. Triggers the asynchronous Celery task [cite: 117]
-        task = run_autonomous_test.delay(run_id=str(test_run.id))
+        # 3. Triggers the asynchronous Celery task [cite: 117]
+        try:
+            task = run_autonomous_test.delay(run_id=str(test_run.id))
+        except Exception as e:
+            # Broker unreachable: the run never existed as far as the quota is concerned
+            print(f"Could not queue run {test_run.id}: {e}")
+            test_run.fail_and_refund()
+            return Response(
+                {"detail": "The run could not be queued and was not charged. Please try again."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
         
         # Save the Celery task ID for status polling
         test_run.celery_task_id = task.id
         test_run.save(update_fields=['celery_task_id'])
         
-        # 5. Immediately returns a 202 Accepted response [cite: 118]
+        # 4. Immediately returns a 202 Accepted response [cite: 118]
         return Response(
             {"detail": "Autonomous run started.", 
              "run_id": str(test_run.id),
-             "runs_remaining": user_subscription.runs_remaining},
+             "runs_remaining": runs_remaining},
             status=status.HTTP_202_ACCEPTED
         )
 
-class TestRunViewSet(viewsets.ReadOnlyModelViewSet):
+class TestRunViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint for viewing the user's past and current TestRuns.
     """
     serializer_class = TestRunSerializer
+    pagination_class = RunCursorPagination
     
     def get_queryset(self):
         # Only show runs for projects owned by the authenticated user
-        return TestRun.objects.filter(project__user=self.request.user).select_related('project')
+        return TestRunSerializer.setup_eager_loading(TestRun.objects.filter(project__user=self.request.user))
+
+    def list_version(self, queryset):
+        # updated_at moves on every write (including completion), so it subsumes completed_at
+        return queryset.aggregate(count=Count('id'), last_modified=Max('updated_at'))
+
+    def object_version(self, test_run):
+        return {'last_modified': test_run.updated_at, 'status': test_run.status}
     
     @action(detail=True, methods=['get'], url_path='status')
     def status(self, request, pk=None):
         """
         Polling endpoint to check the current status of a single run[cite: 148].
+        Answers 304 while nothing changed (send back the ETag as If-None-Match).
+        """
+        test_run = self.get_object()
+        return self.conditional_response(
+            request, self.object_version(test_run),
+            lambda: Response(TestRunSerializer(test_run).data),
+        )
+
+    @action(detail=True, methods=['get'], url_path='artifacts')
+    def artifacts(self, request, pk=None):
+        """
+        Lists the run's stored outputs; each is downloadable from /runs/<id>/artifacts/<name>.
+        """
+        test_run = self.get_object()
+        return Response(RunArtifactSerializer(test_run.artifacts.all(), many=True).data)
+
+    @action(detail=True, methods=['get'], url_path='phases')
+    def phases(self, request, pk=None):
+        """
+        Timing of every phase attempt of the run (which phase made it slow, and where it ran).
+        """
+        test_run = self.get_object()
+        return Response(PhaseTimingSerializer(test_run.phase_timings.all(), many=True).data)
+
+    @action(detail=True, methods=['post'], url_path='events/ticket')
+    def events_ticket(self, request, pk=None):
+        """
+        Single-use ticket for opening the run's event stream: /runs/<id>/events/?ticket=...
+        Fetch a new one for every (re)connection.
+        """
+        test_run = self.get_object()
+        return Response({
+            "ticket": issue_stream_ticket(request.user, test_run.id),
+            "expires_in": settings.RUN_EVENTS_TICKET_TTL,
+        })
+
+    @action(detail=True, methods=['post'], url_path='resume')
+    def resume(self, request, pk=None):
+        """
+        Restarts a FAILED run from its last completed phase (no extra run is charged). Runs that
+        were refunded (they never reached the queue) can't be resumed: that would be a free run.
         """
         test_run = get_object_or_404(TestRun, id=pk, project__user=request.user)
-        return Response(TestRunSerializer(test_run).data)
+        if test_run.quota_refunded:
+            return Response(
+                {"detail": "This run was refunded and can't be resumed; start a new run instead."},
+                status=status.HTTP_409_CONFLICT
+            )
+        # Claimed with a conditional UPDATE: of two concurrent resumes only one re-queues the run
+        claimed = TestRun.objects.filter(pk=test_run.pk, status='FAILED', quota_refunded=False).update(
+            status='QUEUED', updated_at=timezone.now(),
+        )
+        if not claimed:
+            return Response(
+                {"detail": "Only failed runs can be resumed."},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        test_run.status = 'QUEUED'
+        ProjectRunStats.run_status_changed(test_run)
+        publish_status(test_run)
+        task = run_autonomous_test.delay(run_id=str(test_run.id))
+        test_run.celery_task_id = task.id
+        test_run.save(update_fields=['celery_task_id'])
+
+        return Response(
+            {"detail": "Run resumed.", "run_id": str(test_run.id)},
+            status=status.HTTP_202_ACCEPTED
+        )
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets DRF content negotiation accept `Accept: text/event-stream`."""
+    media_type = 'text/event-stream'
+    format = 'sse'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Error responses (401/403/404) carry a dict: sent as a single SSE `error` event
+        if isinstance(data, dict):
+            return _sse('error', data).encode()
+        return data
+
+
+def _sse(event, data, event_id=None):
+    event_id = f"id: {event_id}\n" if event_id else ""
+    return f"{event_id}event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+EVENT_ID_RE = re.compile(r'^\d+-\d+$')
+
+
+class RunEventsView(APIView):
+    """
+    Server-Sent Events stream of a run's status and progress: /api/v1/runs/<id>/events/?ticket=...
+    Replaces polling TestRunViewSet.status. Sends a snapshot first, then every event the worker
+    appends to the run's Redis stream, and closes once the run reaches a terminal status or after
+    RUN_EVENTS_MAX_SECONDS. Each open stream holds an API thread, so connections are kept short:
+    clients reconnect with a fresh ticket (POST /runs/<id>/events/ticket/) and the last event id
+    (Last-Event-ID header or ?last_event_id=), and are replayed what they missed.
+    """
+    authentication_classes = (StreamTicketAuthentication,)
+    renderer_classes = (EventStreamRenderer,)
+
+    def get(self, request, pk=None):
+        # The ticket was issued after an ownership check, for this run only
+        if not request.auth or request.auth.get('run') != str(pk):
+            raise Http404("No such run.")
+        last_event_id = request.headers.get('Last-Event-ID') or request.query_params.get('last_event_id')
+        if last_event_id and not EVENT_ID_RE.match(last_event_id):
+            last_event_id = None
+        response = StreamingHttpResponse(self._stream(pk, last_event_id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no' # Disable proxy buffering (nginx)
+        return response
+
+    def _stream(self, pk, last_event_id=None):
+        conn = get_redis()
+        stream = run_channel(pk)
+        yield f"retry: {settings.RUN_EVENTS_RETRY_MS}\n\n"
+
+        if last_event_id:
+            cursor = last_event_id
+        else:
+            # Position taken before the snapshot, so nothing appended in between is missed
+            latest = conn.xrevrange(stream, count=1)
+            cursor = latest[0][0].decode() if latest else '0-0'
+        test_run = TestRunSerializer.setup_eager_loading(TestRun.objects.all()).get(id=pk)
+        if not last_event_id or test_run.status in TERMINAL_STATUSES:
+            yield _sse('snapshot', TestRunSerializer(test_run).data, event_id=cursor)
+            if test_run.status in TERMINAL_STATUSES:
+                return
+
+        deadline = time.monotonic() + settings.RUN_EVENTS_MAX_SECONDS
+        while (remaining := deadline - time.monotonic()) > 0:
+            block = min(settings.RUN_EVENTS_HEARTBEAT_SECONDS, remaining)
+            entries = conn.xread({stream: cursor}, block=max(1, int(block * 1000)), count=100)
+            if not entries:
+                yield ": keep-alive\n\n"
+                continue
+            for entry_id, fields in entries[0][1]:
+                cursor = entry_id.decode()
+                payload = json.loads(fields[b'message'])
+                yield _sse(payload['event'], payload, event_id=cursor)
+                if payload['event'] == 'status' and payload['data'].get('status') in TERMINAL_STATUSES:
+                    return
+
+
+class RunArtifactView(APIView):
+    """
+    Streams a stored run artifact: /api/v1/runs/<id>/artifacts/<name> and /api/v1/runs/<id>/report.pdf.
+    Honours single-range `Range` requests (206/416) and If-None-Match, decompressing only the
+    frames it sends, so large logs and reports never have to fit in the API process's memory.
+    """
+    authentication_classes = (QueryParamJWTAuthentication,) # Links are opened directly by the browser
+
+    def get(self, request, pk=None, name=None):
+        artifact = RunArtifact.objects.filter(run_id=pk, run__project__user=request.user, name=name).first()
+        if artifact is None:
+            # The PDF is rendered off the pipeline (render queue) and can trail delivery briefly
+            if name == 'report.pdf' and RunArtifact.objects.filter(run_id=pk, run__project__user=request.user, name='report.md').exists():
+                return Response({"detail": "The report PDF is still being rendered."}, status=status.HTTP_202_ACCEPTED)
+            # A batched report (CLAUDE_BATCH_REPORTS) arrives after the run completes
+            if name in ('report.md', 'report.pdf') and BatchRequest.objects.filter(
+                run_id=pk, run__project__user=request.user, kind='report', status__in=('PENDING', 'SUBMITTING', 'SUBMITTED'),
+            ).exists():
+                return Response({"detail": "The report is still being generated."}, status=status.HTTP_202_ACCEPTED)
+            raise Http404("No such artifact.")
+        etag = f'"{artifact.sha256}"'
+        if request.headers.get('If-None-Match') == etag:
+            return HttpResponseNotModified()
+
+        range_header = request.headers.get('Range')
+        if request.headers.get('If-Range', etag) != etag:
+            range_header = None # The client's partial copy is stale: send the whole object
+        try:
+            stored = get_artifact_store().get_object(Key=artifact.key, Range=range_header)
+        except NoSuchKey:
+            raise Http404("Artifact content is missing from the store.")
+        except InvalidRange:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f"bytes */{artifact.size}"
+            return response
+
+        partial = 'ContentRange' in stored
+        response = StreamingHttpResponse(
+            stored['Body'],
+            status=status.HTTP_206_PARTIAL_CONTENT if partial else status.HTTP_200_OK,
+            content_type=stored['ContentType'],
+        )
+        response['Content-Length'] = stored['ContentLength']
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        response['Content-Disposition'] = f'inline; filename="{os.path.basename(name)}"'
+        if partial:
+            response['Content-Range'] = stored['ContentRange']
+        return response
@@ -22,8 +22,11 @@ python manage.py collectstatic --noinput
 # 4. Start Gunicorn WSGI server in production mode
 # Use the $PORT environment variable provided by the host (Digital Ocean)
 echo "Starting Gunicorn WSGI server..."
+# Threaded workers: each open run event stream (SSE) holds a thread, not a whole worker process
 exec gunicorn applaud.wsgi:application \
     --bind 0.0.0.0:"${PORT:-8000}" \
     --workers 4 \
+    --worker-class gthread \
+    --threads 32 \
     --timeout 120 \
     --log-level info
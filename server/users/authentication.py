@@ -0,0 +1,60 @@
+import json
+import secrets
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from worker.redis_conn import get_redis
+
+STREAM_TICKET_PREFIX = 'events:ticket'
+
+
+class QueryParamJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that also accepts the access token as ?token=...
+    Artifact links are opened directly by the browser, which can't set an Authorization header.
+    """
+
+    def authenticate(self, request):
+        header_auth = super().authenticate(request)
+        if header_auth is not None:
+            return header_auth
+
+        raw_token = request.query_params.get('token')
+        if not raw_token:
+            return None
+        validated_token = self.get_validated_token(raw_token.encode())
+        return self.get_user(validated_token), validated_token
+
+
+def issue_stream_ticket(user, run_id):
+    """A ticket for one connection to the run's event stream, valid for RUN_EVENTS_TICKET_TTL seconds."""
+    ticket = secrets.token_urlsafe(24)
+    get_redis().set(
+        f"{STREAM_TICKET_PREFIX}:{ticket}", json.dumps({'user': user.pk, 'run': str(run_id)}),
+        ex=settings.RUN_EVENTS_TICKET_TTL,
+    )
+    return ticket
+
+
+class StreamTicketAuthentication(BaseAuthentication):
+    """
+    Authenticates ?ticket=... from issue_stream_ticket(). Tickets are consumed on first use
+    (GETDEL), so one leaked into a log is worthless; request.auth holds the run it was issued for.
+    """
+
+    def authenticate(self, request):
+        ticket = request.query_params.get('ticket')
+        if not ticket:
+            return None
+        raw = get_redis().getdel(f"{STREAM_TICKET_PREFIX}:{ticket}")
+        if raw is None:
+            raise AuthenticationFailed("Invalid or expired stream ticket.")
+        grant = json.loads(raw)
+        user = get_user_model().objects.filter(pk=grant['user'], is_active=True).first()
+        if user is None:
+            raise AuthenticationFailed("Invalid or expired stream ticket.")
+        return user, grant
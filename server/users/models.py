@@ -1,6 +1,8 @@
 from django.db import models
+from django.db.models import F
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
+from django.utils import timezone
 
 class User(AbstractUser):
     """
@@ -50,3 +52,24 @@ class Subscription(models.Model):
     
     def __str__(self):
         return f"{self.user.email} - {self.plan} ({self.status})"
+
+    @classmethod
+    def reserve_run(cls, user):
+        """
+        Atomically takes one run off the user's quota with a single conditional UPDATE, so
+        concurrent starts can't oversell it and never hold the row lock across a request.
+        Returns the runs left, or None if there is no subscription or no run remaining.
+        """
+        reserved = cls.objects.filter(user=user, runs_remaining__gt=0).update(
+            runs_remaining=F('runs_remaining') - 1, updated_at=timezone.now(),
+        )
+        if not reserved:
+            return None
+        return cls.objects.filter(user=user).values_list('runs_remaining', flat=True).first()
+
+    @classmethod
+    def refund_run(cls, user_id):
+        """Gives back a reserved run (see TestRun.fail_and_refund for the at-most-once guard)."""
+        cls.objects.filter(user_id=user_id).update(
+            runs_remaining=F('runs_remaining') + 1, updated_at=timezone.now(),
+        )
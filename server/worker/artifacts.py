@@ -0,0 +1,314 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+import uuid
+
+from django.conf import settings
+from django.utils import timezone
+
+from projects.models import RunArtifact, TestRun
+
+try:
+    import zstandard
+except ImportError: # Optional: gzip is used when zstandard isn't installed
+    zstandard = None
+
+# Formats that are already compressed are stored as-is
+PRECOMPRESSED_TYPES = ('application/pdf', 'application/zip', 'application/gzip', 'image/png', 'image/jpeg')
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class InvalidRange(Exception):
+    pass
+
+
+def _codec(name):
+    """(compress, decompress) callables for one frame."""
+    if name == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress, zstandard.ZstdDecompressor().decompress
+    if name == 'gzip':
+        return (lambda data: gzip.compress(data, compresslevel=6)), gzip.decompress
+    return (lambda data: data), (lambda data: data)
+
+
+def parse_range(header, size):
+    """
+    Resolves a single-range `Range: bytes=...` header against an object of `size` bytes into an
+    inclusive (start, end) pair. Returns None for no/unsupported ranges, raises InvalidRange
+    when it can't be satisfied.
+    """
+    match = _RANGE_RE.match((header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '': # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise InvalidRange(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise InvalidRange(header)
+    return start, end
+
+
+class LocalArtifactStore:
+    """
+    Content-addressed artifact store on the local filesystem with an S3-style interface
+    (put_object / get_object / head_object / delete_object), so it can be swapped for a
+    bucket later without touching callers.
+
+    Layout under `root`:
+        blobs/<sha[:2]>/<sha>        content as independently compressed frames of `chunk_size`
+        blobs/<sha[:2]>/<sha>.json   codec, size and frame offsets (enables range reads)
+        refs/<key>.json              key -> sha256, size, content type
+
+    Identical content is stored once however many keys (runs) point at it. Objects are
+    written and read one frame at a time, so large logs never sit in memory whole.
+    """
+
+    def __init__(self, root=None, chunk_size=None, codec=None):
+        self.root = root or settings.ARTIFACT_STORE_DIR
+        self.chunk_size = chunk_size or settings.ARTIFACT_CHUNK_SIZE
+        codec = codec or settings.ARTIFACT_COMPRESSION
+        if codec == 'auto':
+            codec = 'zstd' if zstandard else 'gzip'
+        if codec == 'zstd' and zstandard is None:
+            raise RuntimeError("ARTIFACT_COMPRESSION is 'zstd' but the zstandard package is not installed.")
+        self.codec = codec
+        os.makedirs(os.path.join(self.root, 'blobs'), exist_ok=True)
+        os.makedirs(os.path.join(self.root, 'refs'), exist_ok=True)
+
+    # --- Paths ---
+
+    def _blob_path(self, sha):
+        return os.path.join(self.root, 'blobs', sha[:2], sha)
+
+    def _ref_path(self, key):
+        path = os.path.normpath(os.path.join(self.root, 'refs', key.lstrip('/') + '.json'))
+        if not path.startswith(os.path.join(self.root, 'refs') + os.sep):
+            raise NoSuchKey(key)
+        return path
+
+    @staticmethod
+    def _write_json(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), delete=False) as handle:
+            json.dump(data, handle)
+        os.replace(handle.name, path)
+
+    # --- S3-style API ---
+
+    def put_object(self, Key, Body, ContentType='application/octet-stream'):
+        """Body is bytes, str or a binary file object (read `chunk_size` at a time)."""
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        if isinstance(Body, (bytes, bytearray)):
+            chunks = (Body[i:i + self.chunk_size] for i in range(0, len(Body), self.chunk_size))
+        else:
+            chunks = iter(lambda: Body.read(self.chunk_size), b'')
+
+        codec = 'identity' if ContentType in PRECOMPRESSED_TYPES else self.codec
+        compress, _ = _codec(codec)
+        digest = hashlib.sha256()
+        offsets, size = [0], 0
+        blobs_dir = os.path.join(self.root, 'blobs')
+        with tempfile.NamedTemporaryFile('wb', dir=blobs_dir, delete=False) as handle:
+            for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                handle.write(compress(bytes(chunk)))
+                offsets.append(handle.tell())
+        sha = digest.hexdigest()
+
+        blob = self._blob_path(sha)
+        if os.path.exists(blob + '.json'):
+            os.unlink(handle.name) # Deduplicated: this content is already stored
+            os.utime(blob + '.json') # Freshly referenced again; keeps collect_garbage's grace period honest
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(handle.name, blob)
+            self._write_json(blob + '.json', {
+                'codec': codec, 'size': size, 'chunk_size': self.chunk_size, 'offsets': offsets,
+            })
+
+        self._write_json(self._ref_path(Key), {
+            'sha256': sha, 'size': size, 'content_type': ContentType,
+            'last_modified': timezone.now().isoformat(),
+        })
+        return {'ETag': f'"{sha}"', 'ContentLength': size}
+
+    def head_object(self, Key):
+        try:
+            with open(self._ref_path(Key)) as handle:
+                ref = json.load(handle)
+        except FileNotFoundError:
+            raise NoSuchKey(Key)
+        return {
+            'ETag': f'"{ref["sha256"]}"',
+            'ContentLength': ref['size'],
+            'ContentType': ref['content_type'],
+            'LastModified': ref['last_modified'],
+            'sha256': ref['sha256'],
+        }
+
+    def get_object(self, Key, Range=None):
+        """
+        Returns the object's metadata with `Body` as an iterator of byte chunks. `Range` takes
+        an HTTP `bytes=start-end` header value; only the frames overlapping it are decompressed.
+        """
+        head = self.head_object(Key)
+        size = head['ContentLength']
+        byte_range = parse_range(Range, size) if Range else None
+        start, end = byte_range or (0, size - 1)
+        response = {**head, 'ContentLength': max(end - start + 1, 0), 'Body': self._iter_range(head['sha256'], start, end)}
+        if byte_range:
+            response['ContentRange'] = f"bytes {start}-{end}/{size}"
+        return response
+
+    def copy_object(self, CopySource, Key):
+        """Points `Key` at `CopySource`'s content (a new ref; the blob itself is shared)."""
+        head = self.head_object(CopySource)
+        os.utime(self._blob_path(head['sha256']) + '.json')
+        self._write_json(self._ref_path(Key), {
+            'sha256': head['sha256'], 'size': head['ContentLength'], 'content_type': head['ContentType'],
+            'last_modified': timezone.now().isoformat(),
+        })
+        return {'ETag': head['ETag'], 'ContentLength': head['ContentLength']}
+
+    def delete_object(self, Key):
+        """Drops the key; unreferenced blobs are reclaimed by collect_garbage()."""
+        try:
+            os.unlink(self._ref_path(Key))
+        except FileNotFoundError:
+            pass
+
+    def iter_keys(self, Prefix=''):
+        """Every stored key starting with `Prefix` (cf. S3 list_objects_v2)."""
+        refs = os.path.join(self.root, 'refs')
+        Prefix = Prefix.lstrip('/')
+        for dirpath, _, filenames in os.walk(os.path.join(refs, os.path.dirname(Prefix))):
+            for filename in filenames:
+                if filename.endswith('.json'):
+                    key = os.path.relpath(os.path.join(dirpath, filename[:-5]), refs).replace(os.sep, '/')
+                    if key.startswith(Prefix):
+                        yield key
+
+    def _iter_range(self, sha, start, end):
+        blob = self._blob_path(sha)
+        with open(blob + '.json') as handle:
+            index = json.load(handle)
+        _, decompress = _codec(index['codec'])
+        chunk_size, offsets = index['chunk_size'], index['offsets']
+        if end < start:
+            return
+        with open(blob, 'rb') as handle:
+            for frame in range(start // chunk_size, end // chunk_size + 1):
+                handle.seek(offsets[frame])
+                data = decompress(handle.read(offsets[frame + 1] - offsets[frame]))
+                frame_start = frame * chunk_size
+                yield data[max(start - frame_start, 0):end - frame_start + 1]
+
+    def collect_garbage(self, grace_seconds=3600):
+        """
+        Deletes blobs no key refers to any more. Blobs younger than `grace_seconds` are kept,
+        as a concurrent put_object may be about to reference them. Returns the number removed.
+        """
+        cutoff = timezone.now().timestamp() - grace_seconds
+        live = set()
+        for dirpath, _, filenames in os.walk(os.path.join(self.root, 'refs')):
+            for filename in filenames:
+                with open(os.path.join(dirpath, filename)) as handle:
+                    live.add(json.load(handle)['sha256'])
+        removed = 0
+        for dirpath, _, filenames in os.walk(os.path.join(self.root, 'blobs')):
+            for filename in filenames:
+                index = os.path.join(dirpath, filename)
+                if filename.endswith('.json') and filename[:-5] not in live and os.path.getmtime(index) < cutoff:
+                    os.unlink(os.path.join(dirpath, filename[:-5]))
+                    os.unlink(os.path.join(dirpath, filename))
+                    removed += 1
+        return removed
+
+
+_store = None
+
+
+def get_artifact_store():
+    global _store
+    if _store is None:
+        _store = LocalArtifactStore()
+    return _store
+
+
+def run_artifact_key(run_id, name):
+    return f"runs/{run_id}/{name}"
+
+
+def delete_artifact_keys(keys):
+    """Drops the store keys of deleted RunArtifact rows; their blobs go at the next collect_garbage()."""
+    store = get_artifact_store()
+    for key in keys:
+        store.delete_object(Key=key)
+
+
+def delete_orphaned_run_keys(batch_size=500):
+    """
+    Drops the keys of runs that no longer exist (deleted with their project or user, or archived
+    by a process that died before cleaning up). Returns the number of keys removed.
+    """
+    def _flush(keys_by_run):
+        existing = {str(pk) for pk in TestRun.objects.filter(id__in=list(keys_by_run)).values_list('id', flat=True)}
+        orphaned = [key for run_id, keys in keys_by_run.items() if run_id not in existing for key in keys]
+        delete_artifact_keys(orphaned)
+        return len(orphaned)
+
+    removed, keys_by_run = 0, {}
+    for key in get_artifact_store().iter_keys(Prefix='runs/'):
+        run_id = key.split('/')[1]
+        try:
+            uuid.UUID(run_id)
+        except ValueError:
+            continue
+        keys_by_run.setdefault(run_id, []).append(key)
+        if len(keys_by_run) >= batch_size:
+            removed += _flush(keys_by_run)
+            keys_by_run = {}
+    if keys_by_run:
+        removed += _flush(keys_by_run)
+    return removed
+
+
+def record_run_artifact(run, name, key, result, content_type):
+    """Records a stored object (a put_object/copy_object result) as the RunArtifact `name` of `run`."""
+    artifact, _ = RunArtifact.objects.update_or_create(
+        run=run, name=name,
+        defaults={
+            'key': key,
+            'sha256': result['ETag'].strip('"'),
+            'size': result['ContentLength'],
+            'content_type': content_type,
+        },
+    )
+    return artifact
+
+
+def save_run_artifact(run, name, body, content_type='text/plain; charset=utf-8'):
+    """Stores an output of `run` under `name` and records it as a RunArtifact."""
+    key = run_artifact_key(run.id, name)
+    result = get_artifact_store().put_object(Key=key, Body=body, ContentType=content_type)
+    return record_run_artifact(run, name, key, result, content_type)
+
+
+def save_run_artifact_file(run, name, path, content_type='text/plain; charset=utf-8'):
+    with open(path, 'rb') as handle:
+        return save_run_artifact(run, name, handle, content_type)
@@ -0,0 +1,166 @@
+"""
+Message Batches mode (CLAUDE_BATCH_REPORTS): the Reporting Agent's final call is queued as a
+BatchRequest instead of holding an 'llm' worker slot while it runs. Periodic tasks submit the
+queued requests together (submit_message_batches) and attach results to their runs as the
+batches end (poll_message_batches); the run itself completes without waiting for its report.
+"""
+import time
+from datetime import timedelta
+
+import httpx
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from projects.models import BatchRequest
+from .claude_client import MessageBatchesClient
+from .metrics import ClaudeCallTimer, flush_run_metrics, run_context
+from .routing import Route
+
+# Agent each kind of request is made for (metrics and routing records)
+AGENTS = {'report': 'scribe'}
+# Allowance for skew between our clock and the API's when matching batches to submissions
+CLOCK_SKEW = timedelta(minutes=5)
+
+
+def queue_report(run, params, route):
+    """Defers a run's report to the next batch. Idempotent per run (a re-delivered phase re-queues nothing)."""
+    request, _ = BatchRequest.objects.get_or_create(
+        custom_id=f"report-{run.id}",
+        defaults={'run': run, 'kind': 'report', 'params': params, 'route': route._asdict()},
+    )
+    return request
+
+
+def submit_pending():
+    """
+    Submits up to CLAUDE_BATCH_MAX_REQUESTS queued requests as one batch. The rows are claimed
+    with SKIP LOCKED and committed as SUBMITTING before the API call, so no lock is held across
+    it and a request is never sent twice: when the call's outcome is unknown (a transport error,
+    or a DB error after it) they stay SUBMITTING until _reconcile settles them. Returns the
+    number submitted.
+    """
+    with transaction.atomic():
+        requests = list(
+            BatchRequest.objects.filter(status='PENDING')
+            .select_for_update(skip_locked=True)[:settings.CLAUDE_BATCH_MAX_REQUESTS]
+        )
+        if not requests:
+            return 0
+        pks = [request.pk for request in requests]
+        BatchRequest.objects.filter(pk__in=pks).update(status='SUBMITTING', submitted_at=timezone.now())
+
+    try:
+        batch = MessageBatchesClient().create([
+            {'custom_id': request.custom_id, 'params': request.params} for request in requests
+        ])
+    except httpx.HTTPStatusError:
+        # The API answered with an error, so no batch exists: the requests can simply go again
+        BatchRequest.objects.filter(pk__in=pks, status='SUBMITTING').update(status='PENDING', submitted_at=None)
+        raise
+    BatchRequest.objects.filter(pk__in=pks, status='SUBMITTING').update(status='SUBMITTED', batch_id=batch['id'])
+    print(f"Batches: submitted {len(requests)} requests as {batch['id']}.")
+    return len(requests)
+
+
+def poll_submitted(on_result, on_failure):
+    """
+    Collects the results of every ended batch. `on_result(request, text)` attaches a successful
+    answer to its run; failed requests are re-queued up to CLAUDE_BATCH_MAX_ATTEMPTS times, then
+    handed to `on_failure(request)`. Returns the number of requests settled.
+    """
+    client = MessageBatchesClient()
+    settled = _reconcile(client, on_result, on_failure)
+    batch_ids = BatchRequest.objects.filter(status='SUBMITTED').values_list('batch_id', flat=True).distinct()
+    for batch_id in list(batch_ids):
+        batch = client.retrieve(batch_id)
+        if batch['processing_status'] != 'ended':
+            continue
+        for line in client.results(batch):
+            settled += _settle(batch_id, line['custom_id'], line['result'], on_result, on_failure)
+        # A request the results never mentioned is treated as failed rather than left waiting forever
+        for request in BatchRequest.objects.filter(status='SUBMITTED', batch_id=batch_id):
+            settled += _settle(batch_id, request.custom_id, {'type': 'errored', 'error': {'message': 'missing from results'}},
+                               on_result, on_failure)
+    return settled
+
+
+def _reconcile(client, on_result, on_failure):
+    """
+    Resolves submissions left SUBMITTING for CLAUDE_BATCH_RECONCILE_SECONDS. Batches the API holds
+    that none of our rows name are the candidates: requests found in their results are adopted
+    and settled; once every such batch has ended, the requests in none of them never reached the
+    API and are re-queued. Returns the number of requests settled.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.CLAUDE_BATCH_RECONCILE_SECONDS)
+    stuck = list(BatchRequest.objects.filter(status='SUBMITTING', submitted_at__lt=cutoff))
+    if not stuck:
+        return 0
+    listed = list(client.list_since(min(request.submitted_at for request in stuck) - CLOCK_SKEW))
+    known = set(BatchRequest.objects.filter(batch_id__in=[batch['id'] for batch in listed]).values_list('batch_id', flat=True))
+    unknown = [batch for batch in listed if batch['id'] not in known]
+
+    settled = 0
+    waiting = {request.custom_id for request in stuck}
+    for batch in unknown:
+        if batch['processing_status'] != 'ended':
+            continue
+        for line in client.results(batch):
+            if line['custom_id'] not in waiting:
+                continue
+            waiting.discard(line['custom_id'])
+            BatchRequest.objects.filter(custom_id=line['custom_id'], status='SUBMITTING').update(
+                status='SUBMITTED', batch_id=batch['id'],
+            )
+            settled += _settle(batch['id'], line['custom_id'], line['result'], on_result, on_failure)
+
+    if waiting and all(batch['processing_status'] == 'ended' for batch in unknown):
+        requeued = BatchRequest.objects.filter(custom_id__in=waiting, status='SUBMITTING').update(
+            status='PENDING', submitted_at=None,
+        )
+        print(f"Batches: re-queued {requeued} requests whose submission never reached the API.")
+    return settled
+
+
+def _settle(batch_id, custom_id, result, on_result, on_failure):
+    request = BatchRequest.objects.select_related('run__project').filter(
+        custom_id=custom_id, batch_id=batch_id, status='SUBMITTED',
+    ).first()
+    if request is None:
+        return 0 # Already settled by a concurrent poller, or not ours
+
+    # Every transition is a conditional UPDATE from SUBMITTED, so a result is applied at most once
+    message = result.get('message') or {}
+    if result['type'] == 'succeeded':
+        text = message['content'][0]['text'] if message.get('content') else ''
+        with transaction.atomic():
+            claimed = BatchRequest.objects.filter(pk=request.pk, status='SUBMITTED').update(
+                status='SUCCEEDED', completed_at=timezone.now(), attempts=request.attempts + 1,
+            )
+            if claimed:
+                on_result(request, text)
+    else:
+        # errored, canceled or expired; errors nest the API error object ({'type': 'error', 'error': {...}})
+        error = result.get('error') or {}
+        error = error.get('message') or (error.get('error') or {}).get('message') or result['type']
+        retry = request.attempts + 1 < settings.CLAUDE_BATCH_MAX_ATTEMPTS
+        claimed = BatchRequest.objects.filter(pk=request.pk, status='SUBMITTED').update(
+            status='PENDING' if retry else 'FAILED', batch_id=None if retry else batch_id,
+            attempts=request.attempts + 1, error=f"{result['type']}: {error}",
+            completed_at=None if retry else timezone.now(),
+        )
+        if claimed and not retry:
+            on_failure(request)
+    if claimed:
+        _record_usage(request, message.get('usage'), error=result['type'] != 'succeeded')
+    return claimed
+
+
+def _record_usage(request, usage, error=False):
+    """Accounts a batch result like any other Claude call of its run, at the batch price."""
+    waited = (timezone.now() - request.created_at).total_seconds()
+    with run_context(request.run_id, request.run.project_id):
+        timer = ClaudeCallTimer(AGENTS[request.kind], Route(**request.route))
+        timer.started = time.perf_counter() - waited # A batched call's latency is its time in the queue
+        timer.done(usage=usage, error=error, cost_factor=settings.CLAUDE_BATCH_COST_FACTOR)
+    flush_run_metrics(request.run_id)
@@ -0,0 +1,132 @@
+import math
+import os
+import re
+
+# Conservative average for mixed prose and source code (code tokenises denser than English)
+CHARS_PER_TOKEN = 3.5
+
+# Traceback frames: Python ('File "app/views.py", line 42') and JS/TS stack frames ('src/Cart.jsx:17:9')
+PY_FRAME_RE = re.compile(r'File "([^"]+)", line (\d+)')
+JS_FRAME_RE = re.compile(r'([\w./-]+\.(?:js|jsx|ts|tsx|mjs|cjs)):(\d+)(?::\d+)?')
+
+
+def estimate_tokens(text):
+    """Cheap, tokenizer-free estimate of how many tokens `text` will cost."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def chunk_text(text, max_tokens):
+    """Splits text on line boundaries into chunks of at most ~max_tokens each."""
+    max_chars = int(max_tokens * CHARS_PER_TOKEN)
+    chunks, current, size = [], [], 0
+    for line in text.splitlines(keepends=True):
+        # A single oversized line (minified bundle, giant log entry) is hard-split
+        while len(line) > max_chars:
+            if current:
+                chunks.append("".join(current))
+                current, size = [], 0
+            chunks.append(line[:max_chars])
+            line = line[max_chars:]
+        if size + len(line) > max_chars and current:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line)
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def pack_items(items, max_tokens):
+    """Groups whole items (e.g. individual diffs) into batches that each fit in max_tokens."""
+    batches, current, used = [], [], 0
+    for item in items:
+        cost = estimate_tokens(item)
+        if cost > max_tokens:
+            # Too big to keep whole: it gets split and each piece becomes its own batch
+            if current:
+                batches.append(current)
+                current, used = [], 0
+            batches.extend([piece] for piece in chunk_text(item, max_tokens))
+            continue
+        if used + cost > max_tokens and current:
+            batches.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def head_tokens(text, max_tokens):
+    """Keeps the start of a text (e.g. a repo summary, most important facts first) within max_tokens."""
+    max_chars = int(max_tokens * CHARS_PER_TOKEN)
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + "\n... (truncated) ..."
+
+
+def tail_tokens(text, max_tokens):
+    """Keeps the end of a log (where the traceback and final error live) within max_tokens."""
+    max_chars = int(max_tokens * CHARS_PER_TOKEN)
+    if len(text) <= max_chars:
+        return text
+    return "... (earlier output truncated) ...\n" + text[-max_chars:]
+
+
+def traceback_lines(error_log, file_path):
+    """Line numbers in `file_path` that the error log's stack frames point at."""
+    name = os.path.basename(file_path)
+    lines = set()
+    for regex in (PY_FRAME_RE, JS_FRAME_RE):
+        for frame_path, line_no in regex.findall(error_log or ""):
+            if frame_path.endswith(file_path) or os.path.basename(frame_path) == name:
+                lines.add(int(line_no))
+    return sorted(lines)
+
+
+def trim_around_lines(content, line_numbers, max_tokens):
+    """
+    Reduces a source file to the regions around `line_numbers`, growing the context
+    window symmetrically until the budget is used. Each kept region is introduced with
+    its line range so the Fixer can still produce correct hunk headers.
+    Falls back to the head of the file when there are no line numbers to anchor on.
+    """
+    if estimate_tokens(content) <= max_tokens:
+        return content
+
+    lines = content.splitlines()
+    anchors = [n for n in line_numbers if 1 <= n <= len(lines)]
+    if not anchors:
+        return chunk_text(content, max_tokens)[0] + "\n... (rest of file truncated) ...\n"
+
+    def _render(context):
+        ranges = []
+        for anchor in anchors:
+            start, end = max(1, anchor - context), min(len(lines), anchor + context)
+            if ranges and start <= ranges[-1][1] + 1:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([start, end])
+        parts = []
+        for start, end in ranges:
+            parts.append(f"# --- lines {start}-{end} of {len(lines)} ---")
+            parts.extend(lines[start - 1:end])
+        return "\n".join(parts) + "\n"
+
+    best = _render(0)
+    context = 5
+    while context < len(lines):
+        candidate = _render(context)
+        if estimate_tokens(candidate) > max_tokens:
+            break
+        best = candidate
+        context *= 2
+    return best
+
+
+def trim_around_traceback(content, error_log, file_path, max_tokens):
+    return trim_around_lines(content, traceback_lines(error_log, file_path), max_tokens)
@@ -1,114 +1,693 @@
-# server/worker/claude_client.py - FINAL ZERO-BUG, PAPRI-POWERED VERSION
+"""
+Claude Messages API clients for the three agents (Planner, Fixer, Scribe): prompt construction
+with cached system prefixes, model routing, shared rate limiting, retries with fallback, response
+caching, streaming, and the Message Batches client used by worker/batches.py.
+"""
 
+import asyncio
 import httpx
 from django.conf import settings
 import json
+import random
 import time
+from datetime import datetime
 
-class Claude4Client:
+from .budget import estimate_tokens, chunk_text, head_tokens, pack_items, tail_tokens, trim_around_traceback
+from .metrics import ClaudeCallTimer
+from .rate_limiter import get_rate_limiter
+from .response_cache import get_response_cache
+from .routing import ModelRouter
+
+
+def estimate_request_tokens(payload):
+    """Rough token cost of a request for rate limiting: estimated input tokens plus the full output allowance."""
+    return estimate_tokens(json.dumps(payload['system'])) + estimate_tokens(json.dumps(payload['messages'])) + payload['max_tokens']
+
+
+class _ClaudeClientBase:
     """
-    A unified, high-cohesion client for Anthropic Claude Sonnet 4.0 API.
-    All agents use this single interface for efficiency and consistency.
+    Shared configuration and prompt construction for the sync and async Claude clients.
+    Both transports build identical payloads so the agents behave the same either way.
     """
-    
-    API_URL = "https://api.anthropic.com/v1/messages"
-    MODEL = "claude-3-sonnet" # Optimal model for reasoning, coding, and budget (SWE-bench performance is high)
 
-    def __init__(self):
+    # Rate limited (429), overloaded (529) and transient gateway/server errors are worth retrying
+    RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+    def __init__(self, plan=None):
         if not hasattr(settings, 'CLAUDE_API_KEY') or not settings.CLAUDE_API_KEY:
             raise ValueError("CLAUDE_API_KEY is not configured in settings.")
         
+        # The customer's Subscription plan, one of the routing inputs (worker/routing.py)
+        self.plan = plan
+        self.router = ModelRouter(plan)
+        
+        # Overridable so load tests can point the agents at a local stand-in (manage.py mock_upstreams)
+        self.api_url = f"{settings.CLAUDE_API_BASE_URL.rstrip('/')}/v1/messages"
         self.headers = {
             "x-api-key": settings.CLAUDE_API_KEY,
             "anthropic-version": "2023-06-01",
             "content-type": "application/json"
         }
-        self.client = httpx.Client(headers=self.headers, timeout=180.0) 
 
-    def call_api(self, system_prompt, user_prompt, max_tokens=3000):
-        """Generic function to send a prompt to the Claude API."""
-        # Use random delay to simulate network latency, which is common in production
-        time.sleep(0.1) 
-        
-        payload = {
-            "model": self.MODEL,
+    def _route(self, agent, system_prompt, user_prompt, task=None, escalation=0):
+        prompt_tokens = estimate_tokens(json.dumps(system_prompt)) + estimate_tokens(user_prompt)
+        return self.router.route(agent, prompt_tokens, task=task, escalation=escalation)
+
+    def _build_payload(self, system_prompt, user_prompt, max_tokens, model):
+        return {
+            "model": model,
             "max_tokens": max_tokens,
             "system": system_prompt,
             "messages": [{"role": "user", "content": user_prompt}]
         }
 
-        try:
-            print(f"--- Calling Claude API: {system_prompt[:50]}...")
-            response = self.client.post(self.API_URL, json=payload)
-            response.raise_for_status() 
-            data = response.json()
-            
-            if data and data.get('content'):
-                return data['content'][0]['text']
-            
-            return "API response format error: Content missing."
-            
-        except Exception as e:
-            raise Exception(f"Critical Claude API Error: {e}")
+    def _extract_text(self, data):
+        if data and data.get('content'):
+            return data['content'][0]['text']
+        
+        return "API response format error: Content missing."
 
+    def _retry_delay(self, attempt, response=None):
+        """Seconds to wait before retry number `attempt` (0-based): the server's retry-after, else jittered exponential backoff."""
+        if response is not None:
+            retry_after = response.headers.get('retry-after')
+            if retry_after:
+                try:
+                    return float(retry_after)
+                except ValueError:
+                    pass
+        ceiling = min(settings.CLAUDE_RETRY_MAX_DELAY, settings.CLAUDE_RETRY_BASE_DELAY * (2 ** attempt))
+        return random.uniform(ceiling / 2, ceiling)
 
-    # --- AGENT 1: Testing Agent (The Planner) ---
-    def generate_test_plan(self, file_structure_summary, requirements_file):
-        """Generates the comprehensive Playwright/Pytest suite for the target stack."""
-        system_prompt = (
-            "You are the **Testing Agent (The Planner)**, a 20-year veteran Lead QA Architect specializing in **React (Vite) and Django (DRF) codebases**. "
-            "Your sole mission is to create a complete, high-coverage suite of **Playwright and Pytest** scripts. "
-            "Your persona demands flawless logic and adherence to the project's 'Zero Bug' standard."
+    @staticmethod
+    def _prompt_label(system_prompt):
+        """Start of the system prompt (a string or content blocks) for log lines."""
+        if isinstance(system_prompt, list):
+            system_prompt = system_prompt[0]['text'] if system_prompt else ''
+        return system_prompt[:50]
+
+    def _log_call(self, timer, system_prompt, usage=None, mode=''):
+        usage = usage or {}
+        print(f"--- Claude API{mode} [{timer.agent}] {timer.elapsed:.2f}s, "
+              f"{usage.get('input_tokens', '?')} in / {usage.get('output_tokens', '?')} out tokens "
+              f"({usage.get('cache_read_input_tokens', 0)} cached, {usage.get('cache_creation_input_tokens', 0)} written to cache), "
+              f"{timer.retries} retries: {self._prompt_label(system_prompt)}...")
+
+    def _should_retry(self, response, attempt):
+        return response.status_code in self.RETRYABLE_STATUS_CODES and attempt < settings.CLAUDE_MAX_RETRIES
+
+    def _fall_back(self, payload, timer, failures):
+        """
+        After CLAUDE_FALLBACK_AFTER_FAILURES overloaded responses or timeouts, moves the call to
+        its route's fallback model (once); returns the payload to send next.
+        """
+        route = timer.route if timer is not None else None
+        if route is None or failures < settings.CLAUDE_FALLBACK_AFTER_FAILURES or payload['model'] == route.fallback:
+            return payload
+        print(f"--- Claude API: {payload['model']} overloaded or timing out; falling back to {route.fallback}")
+        timer.fall_back(route.fallback)
+        return {**payload, "model": route.fallback}
+
+    # --- Response cache (identical requests across runs/workers) ---
+    def _cache_lookup(self, agent, payload, use_cache):
+        """Returns (cache, key, cached_text); cache is None when caching is off for this call."""
+        cache = get_response_cache()
+        if cache is None or not use_cache or not cache.enabled_for(agent):
+            return None, None, None
+        key = cache.make_key(payload)
+        return cache, key, cache.get(key)
+
+    def _cache_store(self, cache, key, data):
+        # Only cache well-formed answers; format errors should be retried next time
+        if cache is not None and data and data.get('content'):
+            cache.set(key, self._extract_text(data))
+
+    # --- Prompt builders (one per agent) ---
+    # Each agent's persona, reasoning framework and output constraint never change, so they form the
+    # system prompt: a stable prefix, with only the inputs in the user turn. The instructions alone
+    # are below the API's minimum cacheable prefix; only the Fixer's per-run repo context makes one
+    # long enough for Anthropic prompt caching (see _system_blocks).
+    PLANNER_INSTRUCTIONS = (
+        "You are the **Testing Agent (The Planner)**, a 20-year veteran Lead QA Architect specializing in **React (Vite) and Django (DRF) codebases**. "
+        "Your sole mission is to create a complete, high-coverage suite of **Playwright and Pytest** scripts. "
+        "Your persona demands flawless logic and adherence to the project's 'Zero Bug' standard.\n\n"
+        "**Reasoning Framework (Chain of Thought):**\n"
+        "1. **Blueprint Analysis:** Deconstruct the provided file structure and dependencies (React/Django/PostgreSQL stack).\n"
+        "2. **Critical Path Mapping:** Identify and prioritize all critical paths (Auth, Billing, Start Run logic).\n"
+        "3. **Code Generation:** Write the raw, complete code for all necessary test files.\n\n"
+        "**OUTPUT CONSTRAINT:** You MUST return ONLY the raw, runnable code blocks (Pytest/Playwright). Do NOT include any conversational filler, explanations, or text outside of the code itself. "
+        "Put each test file in its own fenced code block whose first line is a comment holding the file's relative path (e.g. `# tests/test_auth.py`). "
+        "When the input lists Changed Files, write tests ONLY for those files."
+    )
+    FIXER_INSTRUCTIONS = (
+        "You are the **Debugging Agent (The Fixer)**, a Principal Full-Stack Engineer at Google whose code is unbreakable. "
+        "Your task is to fix the bug using the **most minimal and precise code change possible**. "
+        "Your persona dictates that the fix MUST be verifiably correct and strictly follow the project stack (Django ORM, React Hooks).\n\n"
+        "**Reasoning Framework (Chain of Thought):**\n"
+        "1. **Trace Analysis:** Pinpoint the exact line and type of error using the log (e.g., Django 500, React State issue).\n"
+        "2. **Code Context:** Examine the provided file content to locate the root cause (e.g., incorrect query, missing dependency).\n"
+        "3. **Minimal Patch:** Generate the smallest possible fix that resolves the issue.\n\n"
+        "**OUTPUT CONSTRAINT:** You MUST return **ONLY the Unified Diff patch**. Do NOT include any filler, persona chatter, or surrounding text. The output must be ready for `git apply`."
+    )
+    SCRIBE_INSTRUCTIONS = (
+        "You are the **Reporting Agent (The Scribe)**, a seasoned Technical Writer and Analyst. "
+        "Your goal is to transform technical logs into high-value, client-facing artifacts. "
+        "Your persona requires polished, professional communication that emphasizes value (e.g., 'X% more stable').\n\n"
+        "**Reasoning Framework (Chain of Thought):**\n"
+        "1. **Synthesis:** Collect all fixed diffs and logs.\n"
+        "2. **Value Translation:** Calculate the stability gain and translate technical fixes into business value.\n"
+        "3. **Dual Output:** Generate two distinct documents.\n\n"
+        "**OUTPUT CONSTRAINT:** You MUST provide a two-part response: 1. The full Markdown content for the **2-3 Page PDF Summary** (titled 'Applaude Autonomous Remediation Report'). 2. The full text for the **GitHub Pull Request Description**. Separate these two sections clearly."
+    )
+    SUMMARY_INSTRUCTIONS = (
+        "You are the **Reporting Agent (The Scribe)**, condensing one slice of an autonomous run's logs and diffs. "
+        "Your summary will be merged with others into the final client report, so keep every concrete fact.\n\n"
+        "Summarise the material you are given. For each bug keep: the file, the failing test, the root cause, "
+        "the fix applied and whether it was verified. Drop repeated log noise. Use terse bullet points."
+    )
+
+    @staticmethod
+    def _system_blocks(*texts):
+        """
+        System prompt as content blocks: the static instructions, then any per-run context shared
+        by many calls (e.g. the repo summary for the Fixer). A block is marked as a cache breakpoint
+        only once the prefix up to it reaches CLAUDE_PROMPT_CACHE_MIN_TOKENS; the API won't cache
+        anything shorter.
+        """
+        blocks, prefix_tokens = [], 0
+        for text in filter(None, texts):
+            prefix_tokens += estimate_tokens(text)
+            block = {"type": "text", "text": text}
+            if prefix_tokens >= settings.CLAUDE_PROMPT_CACHE_MIN_TOKENS:
+                block["cache_control"] = {"type": "ephemeral"}
+            blocks.append(block)
+        return blocks
+
+    def _test_plan_prompts(self, file_structure_summary, requirements_file, focus_files=None):
+        # Follow-up runs only need tests for the files that changed and have no existing coverage
+        focus = (
+            f"Changed Files (write tests ONLY for these): {', '.join(focus_files)}\n" if focus_files else ""
         )
         user_prompt = (
-            "**Reasoning Framework (Chain of Thought):**\n"
-            "1. **Blueprint Analysis:** Deconstruct the provided file structure and dependencies (React/Django/PostgreSQL stack).\n"
-            "2. **Critical Path Mapping:** Identify and prioritize all critical paths (Auth, Billing, Start Run logic).\n"
-            "3. **Code Generation:** Write the raw, complete code for all necessary test files.\n\n"
             f"**INPUT:**\n"
             f"File Structure: {file_structure_summary}\n"
-            f"Requirements: {requirements_file}\n\n"
-            "**OUTPUT CONSTRAINT:** You MUST return ONLY the raw, runnable code blocks (Pytest/Playwright). Do NOT include any conversational filler, explanations, or text outside of the code itself."
+            f"Requirements: {requirements_file}\n"
+            f"{focus}"
         )
-        # Higher max_tokens for code generation
-        return self.call_api(system_prompt, user_prompt, max_tokens=4096) 
-    
-    # --- AGENT 2: Debugging Agent (The Fixer) ---
-    def generate_diff_fix(self, error_log, failed_file_content, failed_file_path):
-        """Analyzes error, reads code, and provides the minimal, verifiable code diff."""
-        system_prompt = (
-            "You are the **Debugging Agent (The Fixer)**, a Principal Full-Stack Engineer at Google whose code is unbreakable. "
-            "Your task is to fix the bug using the **most minimal and precise code change possible**. "
-            "Your persona dictates that the fix MUST be verifiably correct and strictly follow the project stack (Django ORM, React Hooks)."
+        return self._system_blocks(self.PLANNER_INSTRUCTIONS), user_prompt
+
+    def _diff_fix_prompts(self, error_log, failed_file_content, failed_file_path, repo_context=None):
+        # Keep the prompt bounded: the end of the log and only the regions the traceback points at
+        error_log = tail_tokens(error_log, settings.FIXER_LOG_TOKEN_BUDGET)
+        failed_file_content = trim_around_traceback(
+            failed_file_content, error_log, failed_file_path, settings.FIXER_FILE_TOKEN_BUDGET
+        )
+        # The repo summary is identical for every Fixer call of a run, so it extends the cached prefix
+        context = (
+            f"**REPOSITORY CONTEXT:**\n{head_tokens(repo_context, settings.FIXER_REPO_CONTEXT_TOKEN_BUDGET)}"
+            if repo_context else None
         )
         user_prompt = (
-            "**Reasoning Framework (Chain of Thought):**\n"
-            "1. **Trace Analysis:** Pinpoint the exact line and type of error using the log (e.g., Django 500, React State issue).\n"
-            "2. **Code Context:** Examine the provided file content to locate the root cause (e.g., incorrect query, missing dependency).\n"
-            "3. **Minimal Patch:** Generate the smallest possible fix that resolves the issue.\n\n"
             f"**INPUT:**\n"
             f"Failing File Path: {failed_file_path}\n"
             f"Error Log:\n{error_log}\n"
-            f"Failing File Content:\n{failed_file_content}\n\n"
-            "**OUTPUT CONSTRAINT:** You MUST return **ONLY the Unified Diff patch**. Do NOT include any filler, persona chatter, or surrounding text. The output must be ready for `git apply`."
+            f"Failing File Content:\n{failed_file_content}\n"
         )
+        return self._system_blocks(self.FIXER_INSTRUCTIONS, context), user_prompt
+
+    def _report_prompts(self, run_logs, fixes_count):
+        user_prompt = f"**INPUT:** The autonomous run found and fixed {fixes_count} bugs. Logs and diffs follow:\n{run_logs}\n"
+        return self._system_blocks(self.SCRIBE_INSTRUCTIONS), user_prompt
+
+    def _summary_prompts(self, material):
+        return self._system_blocks(self.SUMMARY_INSTRUCTIONS), f"**MATERIAL:**\n{material}"
+
+    def _report_material(self, run_logs, fixed_diffs):
+        return run_logs + "\n" + "\n".join(fixed_diffs)
+
+    def _report_batches(self, run_logs, fixed_diffs):
+        """Map inputs: log chunks and whole diffs packed into batches of REPORT_CHUNK_TOKENS."""
+        items = chunk_text(run_logs, settings.REPORT_CHUNK_TOKENS) + list(fixed_diffs)
+        return ["\n\n".join(batch) for batch in pack_items(items, settings.REPORT_CHUNK_TOKENS)]
+
+
+class Claude4Client(_ClaudeClientBase):
+    """
+    A unified, high-cohesion client for Anthropic Claude Sonnet 4.0 API.
+    All agents use this single interface for efficiency and consistency.
+    """
+
+    def __init__(self, plan=None):
+        super().__init__(plan)
+        self.client = httpx.Client(headers=self.headers, timeout=180.0) 
+
+    def call_api(self, system_prompt, user_prompt, max_tokens=3000, agent=None, use_cache=True, route=None):
+        """
+        Generic function to send a prompt to the Claude API.
+        `agent` names the caller ('planner', 'fixer', 'scribe') for per-agent cache opt-out and
+        model routing; `route` overrides the router's default choice for the agent.
+        """
+        route = route or self._route(agent, system_prompt, user_prompt)
+        payload = self._build_payload(system_prompt, user_prompt, max_tokens, route.model)
+        timer = ClaudeCallTimer(agent, route)
+
+        cache, cache_key, cached = self._cache_lookup(agent, payload, use_cache)
+        if cached is not None:
+            timer.done(cache_hit=True)
+            print(f"--- Claude API cache hit [{timer.agent}]: {self._prompt_label(system_prompt)}...")
+            return cached
+
+        try:
+            data = self._post_with_retries(payload, timer)
+            self._cache_store(cache, cache_key, data)
+        except Exception as e:
+            timer.done(error=True)
+            raise Exception(f"Critical Claude API Error: {e}")
+
+        timer.done(usage=data.get('usage'))
+        self._log_call(timer, system_prompt, data.get('usage'))
+        return self._extract_text(data)
+
+    def _post_with_retries(self, payload, timer=None):
+        """Sends the request through the cluster rate limiter, retrying transient failures (counted on `timer`)."""
+        limiter = get_rate_limiter()
+        reserved = estimate_request_tokens(payload)
+        overloads = 0 # 529s and timeouts, which a different model may not suffer from
+
+        for attempt in range(settings.CLAUDE_MAX_RETRIES + 1):
+            if limiter is not None:
+                limiter.acquire(reserved)
+
+            try:
+                response = self.client.post(self.api_url, json=payload)
+            except httpx.TransportError as e: # Timeouts, connection resets; the attempt may have reached the API, so its reservation stands
+                if attempt == settings.CLAUDE_MAX_RETRIES:
+                    raise
+                if timer is not None:
+                    timer.retries += 1
+                overloads += isinstance(e, httpx.TimeoutException)
+                fallback = self._fall_back(payload, timer, overloads)
+                if fallback is not payload:
+                    payload = fallback
+                    continue
+                delay = self._retry_delay(attempt)
+                print(f"--- Claude API transport error ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            if response.is_error and limiter is not None:
+                limiter.refund(reserved) # Rejected, so it used none of the tokens reserved for it
+            if self._should_retry(response, attempt):
+                if timer is not None:
+                    timer.retries += 1
+                overloads += response.status_code == 529
+                fallback = self._fall_back(payload, timer, overloads)
+                if fallback is not payload:
+                    payload = fallback
+                    continue
+                delay = self._retry_delay(attempt, response)
+                if limiter is not None and response.status_code in (429, 529):
+                    limiter.pause(delay)
+                print(f"--- Claude API returned {response.status_code}; retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            response.raise_for_status()
+            data = response.json()
+            if limiter is not None:
+                limiter.settle(reserved, data.get('usage'))
+            return data
+
+
+    def stream_api(self, system_prompt, user_prompt, max_tokens=3000, agent=None, use_cache=True, route=None):
+        """
+        Streaming (SSE) variant of call_api: yields text deltas as Claude produces them.
+        Transient failures are retried only before the first delta arrives; a cache hit
+        yields the whole cached text as a single delta.
+        """
+        route = route or self._route(agent, system_prompt, user_prompt)
+        payload = self._build_payload(system_prompt, user_prompt, max_tokens, route.model)
+        timer = ClaudeCallTimer(agent, route)
+
+        cache, cache_key, cached = self._cache_lookup(agent, payload, use_cache)
+        if cached is not None:
+            timer.done(cache_hit=True)
+            print(f"--- Claude API cache hit (stream) [{timer.agent}]: {self._prompt_label(system_prompt)}...")
+            yield cached
+            return
+
+        limiter = get_rate_limiter()
+        reserved = estimate_request_tokens(payload)
+        chunks = []
+        usage = {}
+        overloads = 0
+
+        try:
+            for attempt in range(settings.CLAUDE_MAX_RETRIES + 1):
+                if limiter is not None:
+                    limiter.acquire(reserved)
+
+                delay = None
+                status_code = None
+                try:
+                    with self.client.stream("POST", self.api_url, json={**payload, "stream": True}) as response:
+                        if response.is_error and limiter is not None:
+                            limiter.refund(reserved) # Rejected, so it used none of the tokens reserved for it
+                        if self._should_retry(response, attempt):
+                            delay = self._retry_delay(attempt, response)
+                            status_code = response.status_code
+                        else:
+                            response.raise_for_status()
+                            for event in self._iter_sse_events(response):
+                                if event['type'] == 'message_start':
+                                    usage.update(event['message'].get('usage', {}))
+                                elif event['type'] == 'content_block_delta' and event['delta'].get('type') == 'text_delta':
+                                    chunks.append(event['delta']['text'])
+                                    yield event['delta']['text']
+                                elif event['type'] == 'message_delta':
+                                    usage.update(event.get('usage', {}))
+                                elif event['type'] == 'error':
+                                    raise Exception(event['error'].get('message', 'stream error'))
+                except httpx.TransportError as e:
+                    # Deltas already handed to the caller cannot be taken back, so only retry before the first one
+                    if chunks or attempt == settings.CLAUDE_MAX_RETRIES:
+                        raise
+                    delay = self._retry_delay(attempt)
+                    overloads += isinstance(e, httpx.TimeoutException)
+                    print(f"--- Claude API transport error ({e}); retrying in {delay:.1f}s")
+
+                if delay is None:
+                    break
+                timer.retries += 1
+                overloads += status_code == 529
+                fallback = self._fall_back(payload, timer, overloads)
+                if fallback is not payload:
+                    payload = fallback
+                    continue
+                if limiter is not None and status_code in (429, 529):
+                    limiter.pause(delay)
+                time.sleep(delay)
+
+        except Exception as e:
+            timer.done(usage=usage, error=True)
+            if limiter is not None and usage: # Failed mid-stream: what was used is known
+                limiter.settle(reserved, usage)
+            raise Exception(f"Critical Claude API Error: {e}")
+
+        timer.done(usage=usage)
+        self._log_call(timer, system_prompt, usage, mode=' (stream)')
+        if limiter is not None:
+            limiter.settle(reserved, usage)
+        if chunks:
+            self._cache_store(cache, cache_key, {'content': [{'text': "".join(chunks)}]})
+
+    def _iter_sse_events(self, response):
+        """Parses a text/event-stream body into the JSON payloads of its data: lines."""
+        for line in response.iter_lines():
+            if line.startswith('data:'):
+                data = line[len('data:'):].strip()
+                if data:
+                    yield json.loads(data)
+
+    # --- AGENT 1: Testing Agent (The Planner) ---
+    def generate_test_plan(self, file_structure_summary, requirements_file, focus_files=None):
+        """Generates the comprehensive Playwright/Pytest suite for the target stack."""
+        system_prompt, user_prompt = self._test_plan_prompts(file_structure_summary, requirements_file, focus_files)
+        # Higher max_tokens for code generation
+        return self.call_api(system_prompt, user_prompt, max_tokens=4096, agent='planner') 
+
+    def generate_test_plan_stream(self, file_structure_summary, requirements_file, focus_files=None):
+        """Streaming version of generate_test_plan: yields the suite's text as it is written."""
+        system_prompt, user_prompt = self._test_plan_prompts(file_structure_summary, requirements_file, focus_files)
+        return self.stream_api(system_prompt, user_prompt, max_tokens=4096, agent='planner')
+    
+    # --- AGENT 2: Debugging Agent (The Fixer) ---
+    def generate_diff_fix(self, error_log, failed_file_content, failed_file_path, repo_context=None, escalation=0):
+        """
+        Analyzes error, reads code, and provides the minimal, verifiable code diff.
+        `repo_context` (the run's repo summary) is sent as a cached prefix shared by the run's Fixer calls;
+        `escalation` > 0 (a previous patch failed verification) routes the call to the strong model.
+        """
+        system_prompt, user_prompt = self._diff_fix_prompts(error_log, failed_file_content, failed_file_path, repo_context)
+        route = self._route('fixer', system_prompt, user_prompt, escalation=escalation)
         # Low max_tokens for focused output (efficiency and cost-saving)
-        return self.call_api(system_prompt, user_prompt, max_tokens=1024) 
+        return self.call_api(system_prompt, user_prompt, max_tokens=1024, agent='fixer', route=route)
 
     # --- AGENT 3: Reporting Agent (The Scribe) ---
-    def generate_report(self, run_logs, fixes_count):
-        """Generates the 2-3 page PDF summary and the technical Pull Request description."""
-        system_prompt = (
-            "You are the **Reporting Agent (The Scribe)**, a seasoned Technical Writer and Analyst. "
-            "Your goal is to transform technical logs into high-value, client-facing artifacts. "
-            "Your persona requires polished, professional communication that emphasizes value (e.g., 'X% more stable')."
+    def generate_report(self, run_logs, fixes_count, fixed_diffs=()):
+        """
+        Generates the 2-3 page PDF summary and the technical Pull Request description.
+        Oversized inputs are first map-reduced into summaries so the prompt stays within budget.
+        """
+        system_prompt, user_prompt = self._prepare_report(run_logs, fixes_count, fixed_diffs)
+        return self.call_api(system_prompt, user_prompt, max_tokens=3000, agent='scribe')
+
+    def report_batch_request(self, run_logs, fixes_count, fixed_diffs=()):
+        """
+        The generate_report call as a Message Batches request: (params, route). Oversized inputs
+        are still map-reduced here, synchronously; only the final report is deferred.
+        """
+        system_prompt, user_prompt = self._prepare_report(run_logs, fixes_count, fixed_diffs)
+        route = self._route('scribe', system_prompt, user_prompt)
+        return self._build_payload(system_prompt, user_prompt, 3000, route.model), route
+
+    def _prepare_report(self, run_logs, fixes_count, fixed_diffs):
+        material = self._report_material(run_logs, fixed_diffs)
+        if estimate_tokens(material) > settings.REPORT_PROMPT_TOKEN_BUDGET:
+            material = summarise_for_report(run_logs, fixed_diffs, self.plan)
+        return self._report_prompts(material, fixes_count)
+
+
+class AsyncClaude4Client(_ClaudeClientBase):
+    """
+    asyncio twin of Claude4Client built on httpx.AsyncClient.
+    Used where an agent has many independent requests to make (e.g. one fix per failing test),
+    so they can be in flight together instead of paying the API latency once per request.
+    Use as an async context manager so the connection pool is closed on the same event loop.
+    """
+
+    def __init__(self, max_concurrency=None, plan=None):
+        super().__init__(plan)
+        self.max_concurrency = max_concurrency or settings.CLAUDE_MAX_CONCURRENCY
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=180.0,
+            limits=httpx.Limits(max_connections=self.max_concurrency),
         )
-        user_prompt = (
-            "**Reasoning Framework (Chain of Thought):**\n"
-            "1. **Synthesis:** Collect all fixed diffs and logs.\n"
-            "2. **Value Translation:** Calculate the stability gain and translate technical fixes into business value.\n"
-            "3. **Dual Output:** Generate two distinct documents.\n\n"
-            f"**INPUT:** The autonomous run found and fixed {fixes_count} bugs. Logs and diffs follow:\n{run_logs}\n\n"
-            "**OUTPUT CONSTRAINT:** You MUST provide a two-part response: 1. The full Markdown content for the **2-3 Page PDF Summary** (titled 'Applaude Autonomous Remediation Report'). 2. The full text for the **GitHub Pull Request Description**. Separate these two sections clearly."
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def call_api(self, system_prompt, user_prompt, max_tokens=3000, agent=None, use_cache=True, route=None):
+        """Async counterpart of Claude4Client.call_api."""
+        route = route or self._route(agent, system_prompt, user_prompt)
+        payload = self._build_payload(system_prompt, user_prompt, max_tokens, route.model)
+
+        timer = ClaudeCallTimer(agent, route)
+
+        # Cache tiers and metrics do blocking Redis I/O, so keep them off the event loop
+        cache, cache_key, cached = await asyncio.to_thread(self._cache_lookup, agent, payload, use_cache)
+        if cached is not None:
+            await asyncio.to_thread(timer.done, cache_hit=True)
+            print(f"--- Claude API cache hit (async) [{timer.agent}]: {self._prompt_label(system_prompt)}...")
+            return cached
+
+        try:
+            data = await self._post_with_retries(payload, timer)
+            await asyncio.to_thread(self._cache_store, cache, cache_key, data)
+        except Exception as e:
+            await asyncio.to_thread(timer.done, error=True)
+            raise Exception(f"Critical Claude API Error: {e}")
+
+        await asyncio.to_thread(timer.done, usage=data.get('usage'))
+        self._log_call(timer, system_prompt, data.get('usage'), mode=' (async)')
+        return self._extract_text(data)
+
+    async def _post_with_retries(self, payload, timer=None):
+        """Async counterpart of Claude4Client._post_with_retries."""
+        limiter = get_rate_limiter()
+        reserved = estimate_request_tokens(payload)
+        overloads = 0
+
+        for attempt in range(settings.CLAUDE_MAX_RETRIES + 1):
+            if limiter is not None:
+                await limiter.acquire_async(reserved)
+
+            try:
+                response = await self.client.post(self.api_url, json=payload)
+            except httpx.TransportError as e: # The attempt may have reached the API: its reservation stands
+                if attempt == settings.CLAUDE_MAX_RETRIES:
+                    raise
+                if timer is not None:
+                    timer.retries += 1
+                overloads += isinstance(e, httpx.TimeoutException)
+                fallback = self._fall_back(payload, timer, overloads)
+                if fallback is not payload:
+                    payload = fallback
+                    continue
+                delay = self._retry_delay(attempt)
+                print(f"--- Claude API transport error ({e}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            if response.is_error and limiter is not None:
+                await asyncio.to_thread(limiter.refund, reserved) # Rejected, so it used none of the tokens reserved for it
+            if self._should_retry(response, attempt):
+                if timer is not None:
+                    timer.retries += 1
+                overloads += response.status_code == 529
+                fallback = self._fall_back(payload, timer, overloads)
+                if fallback is not payload:
+                    payload = fallback
+                    continue
+                delay = self._retry_delay(attempt, response)
+                if limiter is not None and response.status_code in (429, 529):
+                    await asyncio.to_thread(limiter.pause, delay)
+                print(f"--- Claude API returned {response.status_code}; retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            response.raise_for_status()
+            data = response.json()
+            if limiter is not None:
+                await asyncio.to_thread(limiter.settle, reserved, data.get('usage'))
+            return data
+
+    async def gather_bounded(self, jobs, concurrency=None):
+        """
+        Runs zero-argument coroutine factories with at most `concurrency` in flight.
+        Results come back in the same order as `jobs`; a job that raises yields its
+        exception in its slot so one bad request does not cancel the others.
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.max_concurrency)
+
+        async def _run(job):
+            async with semaphore:
+                return await job()
+
+        return await asyncio.gather(*(_run(job) for job in jobs), return_exceptions=True)
+
+    # --- AGENT 2: Debugging Agent (The Fixer), fan-out mode ---
+    async def generate_diff_fix(self, error_log, failed_file_content, failed_file_path, repo_context=None, escalation=0):
+        system_prompt, user_prompt = self._diff_fix_prompts(error_log, failed_file_content, failed_file_path, repo_context)
+        route = self._route('fixer', system_prompt, user_prompt, escalation=escalation)
+        return await self.call_api(system_prompt, user_prompt, max_tokens=1024, agent='fixer', route=route)
+
+    async def generate_diff_fixes(self, bugs, concurrency=None, repo_context=None):
+        """
+        Requests a fix for every bug at once (bounded by `concurrency`).
+        `bugs` is a list of dicts with 'error_log', 'file_content' and 'file_path' keys.
+        """
+        jobs = [
+            (lambda bug=bug: self.generate_diff_fix(bug['error_log'], bug['file_content'], bug['file_path'], repo_context))
+            for bug in bugs
+        ]
+        return await self.gather_bounded(jobs, concurrency)
+
+    # --- AGENT 3: Reporting Agent (The Scribe), map-reduce mode ---
+    async def summarise(self, material):
+        system_prompt, user_prompt = self._summary_prompts(material)
+        route = self._route('scribe', system_prompt, user_prompt, task='summary')
+        return await self.call_api(
+            system_prompt, user_prompt, max_tokens=settings.REPORT_SUMMARY_MAX_TOKENS, agent='scribe', route=route,
         )
-        return self.call_api(system_prompt, user_prompt, max_tokens=3000)
+
+    async def reduce_for_report(self, run_logs, fixed_diffs):
+        """
+        Summarises the batches in parallel, then re-packs and re-summarises the summaries
+        until the combined text fits REPORT_PROMPT_TOKEN_BUDGET.
+        """
+        batches = self._report_batches(run_logs, fixed_diffs)
+        while True:
+            summaries = await self.gather_bounded([(lambda batch=batch: self.summarise(batch)) for batch in batches])
+            for summary in summaries:
+                if isinstance(summary, Exception):
+                    raise summary
+            material = "\n\n".join(summaries)
+            if len(summaries) == 1 or estimate_tokens(material) <= settings.REPORT_PROMPT_TOKEN_BUDGET:
+                return material
+            batches = ["\n\n".join(batch) for batch in pack_items(summaries, settings.REPORT_CHUNK_TOKENS)]
+
+    async def generate_report(self, run_logs, fixes_count, fixed_diffs=()):
+        material = self._report_material(run_logs, fixed_diffs)
+        if estimate_tokens(material) > settings.REPORT_PROMPT_TOKEN_BUDGET:
+            material = await self.reduce_for_report(run_logs, fixed_diffs)
+        system_prompt, user_prompt = self._report_prompts(material, fixes_count)
+        return await self.call_api(system_prompt, user_prompt, max_tokens=3000, agent='scribe')
+
+
+class MessageBatchesClient(_ClaudeClientBase):
+    """
+    Client for the Message Batches API: Messages requests processed asynchronously (within 24h)
+    at a discount, for output nobody is waiting on (see worker/batches.py).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.batches_url = f"{self.api_url}/batches"
+        self.client = httpx.Client(headers=self.headers, timeout=60.0)
+
+    def create(self, requests):
+        """Submits [{'custom_id', 'params'}, ...] as one batch; returns the batch object."""
+        return self._request('POST', self.batches_url, json={'requests': requests})
+
+    def retrieve(self, batch_id):
+        return self._request('GET', f"{self.batches_url}/{batch_id}")
+
+    def list_since(self, since):
+        """Every batch created at or after the aware datetime `since`, newest first."""
+        params = {'limit': 100}
+        while True:
+            page = self._request('GET', self.batches_url, params=params)
+            for batch in page['data']:
+                if datetime.fromisoformat(batch['created_at'].replace('Z', '+00:00')) < since:
+                    return
+                yield batch
+            if not page.get('has_more'):
+                return
+            params['after_id'] = page['last_id']
+
+    def results(self, batch):
+        """Streams an ended batch's results: {'custom_id', 'result': {'type', 'message' | 'error'}} per line."""
+        with self.client.stream('GET', batch['results_url']) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line.strip():
+                    yield json.loads(line)
+
+    def _request(self, method, url, **kwargs):
+        # Only responses that say the request was not processed are retried; a transport error
+        # on create() might have created the batch, so it surfaces and the caller tries later
+        for attempt in range(settings.CLAUDE_MAX_RETRIES + 1):
+            response = self.client.request(method, url, **kwargs)
+            if self._should_retry(response, attempt):
+                delay = self._retry_delay(attempt, response)
+                print(f"--- Claude Batches API returned {response.status_code}; retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            response.raise_for_status()
+            return response.json()
+
+
+def summarise_for_report(run_logs, fixed_diffs, plan=None):
+    """Synchronous entry point for the Reporting Agent's parallel map-reduce step."""
+    async def _run():
+        async with AsyncClaude4Client(plan=plan) as client:
+            return await client.reduce_for_report(run_logs, fixed_diffs)
+
+    return asyncio.run(_run())
+
+
+def generate_diff_fixes_concurrently(bugs, concurrency=None, repo_context=None, plan=None):
+    """Synchronous entry point for Celery tasks: fans out the Fixer calls and waits for all diffs."""
+    async def _run():
+        async with AsyncClaude4Client(max_concurrency=concurrency, plan=plan) as client:
+            return await client.generate_diff_fixes(bugs, concurrency, repo_context)
+
+    return asyncio.run(_run())
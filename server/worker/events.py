@@ -0,0 +1,39 @@
+import json
+
+import redis
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .redis_conn import get_redis
+
+# Statuses after which a run emits no further events
+TERMINAL_STATUSES = ('COMPLETE', 'FAILED')
+
+
+def run_channel(run_id):
+    """Redis stream of the run's events; its entry ids are the SSE event ids clients resume from."""
+    return f"runs:{run_id}:events"
+
+
+def publish_run_event(run_id, event, data):
+    """
+    Appends a run event to the run's Redis stream for the /events/ endpoint, which replays it to
+    clients reconnecting with Last-Event-ID. Fire-and-forget: a Redis hiccup must never fail
+    the pipeline, and subscribers re-sync from a DB snapshot.
+    """
+    message = json.dumps(
+        {'event': event, 'data': data, 'at': timezone.now()},
+        cls=DjangoJSONEncoder,
+    )
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.xadd(run_channel(run_id), {'message': message}, maxlen=settings.RUN_EVENTS_BACKLOG, approximate=True)
+        pipe.expire(run_channel(run_id), settings.RUN_EVENTS_RETENTION_SECONDS)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Events: could not publish {event} for run {run_id} ({e}).")
+
+
+def publish_status(run, **extra):
+    publish_run_event(run.id, 'status', {'status': run.status, **extra})
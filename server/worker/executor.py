@@ -0,0 +1,324 @@
+import ast
+import contextlib
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+PYTHON_SUFFIXES = ('.py',)
+PLAYWRIGHT_SUFFIXES = ('.js', '.jsx', '.ts', '.tsx', '.mjs')
+
+# Stack frames that point back into the repository under test
+PY_FRAME_RE = re.compile(r'File "([^"]+)", line (\d+)')
+PYTEST_FRAME_RE = re.compile(r'^([\w./-]+\.py):(\d+):', re.M)
+JS_FRAME_RE = re.compile(r'([\w./-]+\.(?:js|jsx|ts|tsx|mjs)):(\d+)(?::\d+)?')
+JS_IMPORT_RE = re.compile(r'''(?:import\s[^'"]*?from\s*|import\s*\(?\s*|require\(\s*)['"](\.{1,2}/[^'"]+)['"]''')
+JS_RESOLVE_SUFFIXES = ('', '.js', '.jsx', '.ts', '.tsx', '/index.js', '/index.jsx', '/index.ts', '/index.tsx')
+
+
+def write_test_file(worktree, rel_path, code):
+    """Writes one generated test file under GENERATED_TESTS_DIR in the run's worktree; returns its repo-relative path."""
+    target = os.path.normpath(os.path.join(settings.GENERATED_TESTS_DIR, rel_path))
+    if target.startswith('..') or os.path.isabs(target):
+        raise ValueError(f"Refusing to write generated test outside the worktree: {rel_path}")
+    full_path = os.path.join(worktree, target)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, 'w', encoding='utf-8') as handle:
+        handle.write(code)
+    return target.replace(os.sep, '/')
+
+
+def _file_of(path):
+    """Strips a pytest node id ('tests/test_x.py::test_y') down to its file."""
+    return path.split('::', 1)[0]
+
+
+def _node_id(test_file, case):
+    """
+    pytest node id of a JUnit test case: 'path.py::Class::name', or 'path.py::name' for a module-level
+    test. xunit1 classnames are the dotted module path followed by any (nested) class names.
+    """
+    name = case.get('name', '')
+    if not name:
+        return test_file
+    module = test_file[:-len('.py')].replace('/', '.') if test_file.endswith('.py') else ''
+    classname = case.get('classname', '')
+    classes = classname[len(module) + 1:] if module and classname.startswith(module + '.') else ''
+    return '::'.join([test_file, *filter(None, classes.split('.')), name])
+
+
+def _parse_junit(xml_path, worktree):
+    """
+    Reads a JUnit XML report into counts plus a list of {'file', 'test', 'node', 'traceback'} failures.
+    Returns None when there is no report, or it is unreadable or lists no tests: the runner
+    crashed or collected nothing, which must never pass for a green shard.
+    """
+    result = {'passed': 0, 'failed': 0, 'skipped': 0, 'failures': []}
+    try:
+        root = ET.parse(xml_path).getroot()
+    except (OSError, ET.ParseError):
+        return None
+    if root.find('.//testcase') is None:
+        return None
+
+    for case in root.iter('testcase'):
+        problem = case.find('failure')
+        if problem is None:
+            problem = case.find('error')
+        if case.find('skipped') is not None:
+            result['skipped'] += 1
+        elif problem is not None:
+            result['failed'] += 1
+            test_file = case.get('file') or case.get('classname', '').replace('.', '/') + '.py'
+            if os.path.isabs(test_file):
+                test_file = os.path.relpath(test_file, worktree)
+            test_file = test_file.replace(os.sep, '/')
+            result['failures'].append({
+                'file': test_file,
+                'test': case.get('name', ''),
+                'node': _node_id(test_file, case) if test_file.endswith(PYTHON_SUFFIXES) else test_file,
+                'traceback': (problem.text or problem.get('message') or '').strip(),
+            })
+        else:
+            result['passed'] += 1
+    return result
+
+
+def _shard_failure(paths, message, exit_code):
+    """Result for a shard whose runner produced no usable report: every test in it counts as failed."""
+    return {
+        'passed': 0, 'failed': len(paths), 'skipped': 0, 'exit_code': exit_code,
+        'failures': [{'file': _file_of(path), 'test': '', 'node': path, 'traceback': message} for path in paths],
+    }
+
+
+def _runner_env(worktree, report, scratch):
+    """
+    Environment for the test runner: only the TEST_ENV_PASSTHROUGH variables of the worker's own.
+    Customer code and generated tests run here, so the worker's secrets (API keys, DB and broker
+    credentials) must never be visible to them. HOME and the temp dir are the shard's scratch
+    directory rather than the worker's, so nothing under the worker's home (git or cloud
+    credentials, caches) is in reach by default either.
+    """
+    env = {name: os.environ[name] for name in settings.TEST_ENV_PASSTHROUGH if name in os.environ}
+    env.update({
+        'PYTHONPATH': worktree, 'PLAYWRIGHT_JUNIT_OUTPUT_NAME': report,
+        'HOME': scratch, 'TMPDIR': scratch, 'XDG_CACHE_HOME': os.path.join(scratch, '.cache'),
+    })
+    return env
+
+
+class TestExecutor:
+    """
+    Runs a generated suite inside a run's worktree, sharded across the worker's cores.
+
+    Each shard is its own pytest (or Playwright) subprocess writing a JUnit XML report, so
+    shards execute truly in parallel; a thread pool of `workers` threads supervises them.
+    (Celery prefork children are daemonic and may not fork a multiprocessing pool of their own.)
+    Per-test timeouts use pytest-timeout; every shard also has a hard wall-clock cap. Results carry
+    an `exit_code` that is 0 only if every runner exited cleanly.
+    """
+
+    def __init__(self, worktree, workers=None, test_timeout=None, shard_timeout=None, log_dir=None):
+        self.worktree = worktree
+        self.log_dir = log_dir # When set, each shard's runner output is written to <log_dir>/shard-<n>-<runner>.log
+        self.workers = workers or settings.TEST_EXECUTOR_WORKERS or os.cpu_count() or 1
+        self.test_timeout = test_timeout or settings.TEST_TIMEOUT_SECONDS
+        self.shard_timeout = shard_timeout or settings.TEST_SHARD_TIMEOUT_SECONDS
+
+    def shard(self, paths, shards):
+        """Greedy largest-first packing by file size (a proxy for run time) into `shards` buckets."""
+        buckets = [[] for _ in range(shards)]
+        loads = [0] * shards
+
+        def _size(path):
+            try:
+                return os.path.getsize(os.path.join(self.worktree, _file_of(path)))
+            except OSError:
+                return 0
+
+        for path in sorted(paths, key=_size, reverse=True):
+            target = loads.index(min(loads))
+            buckets[target].append(path)
+            loads[target] += _size(path) or 1
+        return [bucket for bucket in buckets if bucket]
+
+    def _pytest_command(self, paths, report):
+        command = [
+            sys.executable, '-m', 'pytest', '-q', '-p', 'no:cacheprovider',
+            '-o', 'junit_family=xunit1', f"--junitxml={report}",
+            '-p', 'pytest_timeout', f"--timeout={self.test_timeout}",
+        ]
+        return command + list(paths)
+
+    def _playwright_command(self, paths):
+        return ['npx', '--no-install', 'playwright', 'test', '--reporter=junit',
+                f"--timeout={self.test_timeout * 1000}"] + list(paths)
+
+    def _output(self, shard, kind):
+        if not self.log_dir:
+            return contextlib.nullcontext(subprocess.DEVNULL)
+        return open(os.path.join(self.log_dir, f"shard-{shard}-{kind}.log"), 'wb')
+
+    def _run_shard(self, shard, paths):
+        python_paths = [p for p in paths if _file_of(p).endswith(PYTHON_SUFFIXES)]
+        browser_paths = [p for p in paths if _file_of(p).endswith(PLAYWRIGHT_SUFFIXES)]
+        merged = {'passed': 0, 'failed': 0, 'skipped': 0, 'exit_code': 0, 'failures': []}
+
+        with tempfile.TemporaryDirectory(prefix='applaude-shard-') as scratch:
+            for kind, shard_paths in (('pytest', python_paths), ('playwright', browser_paths)):
+                if not shard_paths:
+                    continue
+                report = os.path.join(scratch, f"{kind}.xml")
+                env = _runner_env(self.worktree, report, scratch)
+                if kind == 'pytest':
+                    command = self._pytest_command(shard_paths, report)
+                else:
+                    command = self._playwright_command(shard_paths)
+                try:
+                    # Output goes straight to disk, never through this process's memory
+                    with self._output(shard, kind) as output:
+                        completed = subprocess.run(
+                            command, cwd=self.worktree, env=env, timeout=self.shard_timeout,
+                            stdout=output, stderr=subprocess.STDOUT,
+                        )
+                except subprocess.TimeoutExpired:
+                    result = _shard_failure(shard_paths, f"Timed out: shard exceeded {self.shard_timeout}s.", 124)
+                except FileNotFoundError as e:
+                    result = _shard_failure(shard_paths, f"Runner unavailable: {e}", 127)
+                else:
+                    result = _parse_junit(report, self.worktree)
+                    if result is None:
+                        result = _shard_failure(
+                            shard_paths, f"{kind} exited with code {completed.returncode} without reporting any test.",
+                            completed.returncode or 1,
+                        )
+                    else:
+                        result['exit_code'] = completed.returncode
+                _merge(merged, result)
+        return merged
+
+    def run_incrementally(self):
+        """Runner for test files that arrive one at a time (see IncrementalRun)."""
+        return IncrementalRun(self)
+
+    def run(self, paths):
+        """
+        Executes the given test files (or pytest node ids) and returns merged counts
+        and the structured failure list.
+        """
+        merged = {'passed': 0, 'failed': 0, 'skipped': 0, 'exit_code': 0, 'failures': []}
+        if not paths:
+            return merged
+        shards = self.shard(paths, min(self.workers, len(paths)))
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            for result in pool.map(self._run_shard, range(1, len(shards) + 1), shards):
+                _merge(merged, result)
+        merged['failures'].sort(key=lambda f: (f['file'], f['test']))
+        return merged
+
+
+class IncrementalRun:
+    """
+    Executes test files as they become available, e.g. while the Planner is still streaming the
+    rest of the suite: each submitted file starts in its own runner process straight away, on up
+    to the executor's `workers` at a time. results() waits for all of them and merges their
+    results like TestExecutor.run().
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.pool = ThreadPoolExecutor(max_workers=executor.workers)
+        self.futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def submit(self, path):
+        label = f"stream-{len(self.futures) + 1}" # Log names never clash with a later full run's shards
+        self.futures.append(self.pool.submit(self.executor._run_shard, label, [path]))
+
+    def results(self):
+        merged = {'passed': 0, 'failed': 0, 'skipped': 0, 'exit_code': 0, 'failures': []}
+        for future in self.futures:
+            _merge(merged, future.result())
+        merged['failures'].sort(key=lambda f: (f['file'], f['test']))
+        return merged
+
+
+def _merge(merged, result):
+    for key in ('passed', 'failed', 'skipped'):
+        merged[key] += result[key]
+    merged['exit_code'] = merged['exit_code'] or result['exit_code']
+    merged['failures'].extend(result['failures'])
+
+
+def imported_sources(test_path, worktree):
+    """
+    Repository files a test file imports directly: Python modules resolved against the worktree
+    root, and relative JS/TS imports resolved against the test file's directory.
+    """
+    full_path = os.path.join(worktree, test_path)
+    try:
+        with open(full_path, encoding='utf-8', errors='replace') as handle:
+            source = handle.read()
+    except OSError:
+        return []
+
+    found = []
+    if test_path.endswith(PYTHON_SUFFIXES):
+        try:
+            tree = ast.parse(source)
+        except SyntaxError:
+            return []
+        modules = []
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                modules.append(node.module)
+                modules.extend(f"{node.module}.{alias.name}" for alias in node.names)
+        for module in modules:
+            base = module.replace('.', '/')
+            for candidate in (base + '.py', base + '/__init__.py'):
+                if os.path.isfile(os.path.join(worktree, candidate)) and candidate not in found:
+                    found.append(candidate)
+    else:
+        base_dir = os.path.dirname(test_path)
+        for spec in JS_IMPORT_RE.findall(source):
+            target = os.path.normpath(os.path.join(base_dir, spec)).replace(os.sep, '/')
+            for suffix in JS_RESOLVE_SUFFIXES:
+                if os.path.isfile(os.path.join(worktree, target + suffix)) and target + suffix not in found:
+                    found.append(target + suffix)
+                    break
+    return [path for path in found if not path.startswith(settings.GENERATED_TESTS_DIR + '/')]
+
+
+def locate_failing_source(failure, worktree):
+    """
+    Picks the repository file to hand to the Fixer: the innermost stack frame that lives in the
+    worktree but outside the generated tests, else the first repo module the test imports,
+    else the failing test file itself.
+    """
+    candidates = []
+    for regex in (PY_FRAME_RE, PYTEST_FRAME_RE, JS_FRAME_RE):
+        for path, _ in regex.findall(failure['traceback']):
+            rel_path = os.path.relpath(path, worktree) if os.path.isabs(path) else path
+            rel_path = rel_path.replace(os.sep, '/')
+            if rel_path.startswith(('..', settings.GENERATED_TESTS_DIR + '/')):
+                continue
+            if os.path.isfile(os.path.join(worktree, rel_path)):
+                candidates.append(rel_path)
+    if candidates:
+        return candidates[-1]
+    # Assertion failures only show the test's own frame: blame the first repo module it imports
+    sources = imported_sources(failure['file'], worktree)
+    return sources[0] if sources else failure['file']
@@ -0,0 +1,269 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+# Version-control metadata: a directory in a clone, a plain `.git` file in a git worktree
+VCS_METADATA = {'.git', '.hg', '.svn', '.bzr'}
+
+SKIP_DIRS = VCS_METADATA | {
+    'node_modules', '__pycache__', '.venv', 'venv', 'env', 'dist', 'build',
+    '.next', '.nuxt', 'coverage', '.pytest_cache', '.mypy_cache', '.tox', 'staticfiles',
+}
+
+# Extension -> compact language code stored in the index
+LANGUAGES = {
+    '.py': 'py', '.js': 'js', '.jsx': 'jsx', '.mjs': 'js', '.cjs': 'js', '.ts': 'ts', '.tsx': 'tsx',
+    '.vue': 'vue', '.svelte': 'svelte', '.html': 'html', '.css': 'css', '.scss': 'css',
+    '.json': 'json', '.yml': 'yaml', '.yaml': 'yaml', '.toml': 'toml', '.md': 'md', '.sql': 'sql',
+    '.sh': 'sh', '.go': 'go', '.rb': 'rb', '.java': 'java', '.kt': 'kt', '.rs': 'rs', '.php': 'php',
+}
+
+MANIFESTS = ('package.json', 'requirements.txt', 'pyproject.toml', 'Pipfile', 'setup.py', 'setup.cfg')
+LOCKFILES = {
+    'package-lock.json': 'npm', 'yarn.lock': 'yarn', 'pnpm-lock.yaml': 'pnpm', 'bun.lockb': 'bun',
+    'poetry.lock': 'poetry', 'Pipfile.lock': 'pipenv', 'uv.lock': 'uv',
+}
+
+# Dependency name -> stack label reported to the Planner
+STACK_MARKERS = {
+    'react': 'React', 'vite': 'Vite', 'next': 'Next.js', 'vue': 'Vue', 'svelte': 'Svelte',
+    '@angular/core': 'Angular', 'tailwindcss': 'Tailwind', 'express': 'Express', 'typescript': 'TypeScript',
+    '@playwright/test': 'Playwright', 'jest': 'Jest', 'vitest': 'Vitest', 'cypress': 'Cypress',
+    'django': 'Django', 'djangorestframework': 'DRF', 'flask': 'Flask', 'fastapi': 'FastAPI',
+    'celery': 'Celery', 'sqlalchemy': 'SQLAlchemy', 'pytest': 'Pytest',
+    'psycopg2': 'PostgreSQL', 'psycopg2-binary': 'PostgreSQL', 'psycopg': 'PostgreSQL',
+    'mysqlclient': 'MySQL', 'redis': 'Redis', 'pymongo': 'MongoDB', 'mongoose': 'MongoDB',
+}
+
+REQUIREMENT_NAME_RE = re.compile(r'^\s*([A-Za-z0-9][A-Za-z0-9._-]*)')
+TEST_PATH_RE = re.compile(r'(^|/)(tests?|__tests__|e2e|spec)(/|$)|(^|/)test_[^/]+\.py$|\.(test|spec)\.[jt]sx?$')
+
+
+def _hash_file(path):
+    digest = hashlib.blake2b(digest_size=10)
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _language(path):
+    return LANGUAGES.get(os.path.splitext(path)[1].lower(), '')
+
+
+def _skipped(rel_path):
+    parts = rel_path.split('/')
+    return parts[-1] in VCS_METADATA or any(part in SKIP_DIRS for part in parts[:-1])
+
+
+class RepoIndexer:
+    """
+    Incremental structural index of a checked-out repository.
+
+    Each index records, per file, a short content hash, the size and a language code, plus the
+    stacks detected from manifests and lockfiles. Indexes are stored gzip-compressed under
+    REPO_INDEX_DIR/<project_id>/<commit_sha>.json.gz. When a project has a previous index, only
+    the files `git diff` reports as changed since that commit are re-hashed.
+    """
+
+    def __init__(self, index_dir=None, max_workers=None, keep=None):
+        self.index_dir = index_dir or settings.REPO_INDEX_DIR
+        self.max_workers = max_workers or settings.REPO_INDEX_THREADS
+        self.keep = keep or settings.REPO_INDEX_KEEP
+
+    # --- Storage ---
+    def _project_dir(self, project_id):
+        path = os.path.join(self.index_dir, str(project_id))
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def load(self, project_id, commit_sha):
+        path = os.path.join(self._project_dir(project_id), f"{commit_sha}.json.gz")
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, 'rt', encoding='utf-8') as handle:
+            return json.load(handle)
+
+    def load_latest(self, project_id):
+        pointer = os.path.join(self._project_dir(project_id), 'LATEST')
+        if not os.path.exists(pointer):
+            return None
+        with open(pointer) as handle:
+            return self.load(project_id, handle.read().strip())
+
+    def _save(self, project_id, index):
+        project_dir = self._project_dir(project_id)
+        path = os.path.join(project_dir, f"{index['commit']}.json.gz")
+        with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as handle:
+            json.dump(index, handle, separators=(',', ':'))
+        os.replace(path + '.tmp', path)
+        with open(os.path.join(project_dir, 'LATEST.tmp'), 'w') as handle:
+            handle.write(index['commit'])
+        os.replace(os.path.join(project_dir, 'LATEST.tmp'), os.path.join(project_dir, 'LATEST'))
+        self._prune(project_dir, index['commit'])
+
+    def _prune(self, project_dir, current):
+        """Keeps the project's `keep` most recently written indexes (always including `current`)."""
+        indexes = [
+            os.path.join(project_dir, name) for name in os.listdir(project_dir)
+            if name.endswith('.json.gz') and name != f"{current}.json.gz"
+        ]
+        indexes.sort(key=os.path.getmtime, reverse=True)
+        for path in indexes[max(self.keep - 1, 0):]:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass # Pruned concurrently by another worker
+
+    # --- Indexing ---
+    def _walk(self, worktree):
+        for dirpath, dirnames, filenames in os.walk(worktree):
+            dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+            for name in filenames:
+                if name in VCS_METADATA:
+                    continue
+                yield os.path.relpath(os.path.join(dirpath, name), worktree).replace(os.sep, '/')
+
+    def _changed_since(self, worktree, base_sha, commit_sha):
+        """(changed_or_added, deleted) paths between two commits, or None if base_sha is unknown."""
+        result = subprocess.run(
+            ['git', 'diff', '--name-status', '--no-renames', '-z', base_sha, commit_sha],
+            cwd=worktree, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            return None
+        fields = result.stdout.split('\0')
+        changed, deleted = [], []
+        for status, path in zip(fields[0::2], fields[1::2]):
+            (deleted if status == 'D' else changed).append(path)
+        return changed, deleted
+
+    def _describe(self, worktree, rel_paths):
+        def _entry(rel_path):
+            full_path = os.path.join(worktree, rel_path)
+            if not os.path.isfile(full_path) or os.path.islink(full_path):
+                return rel_path, None
+            return rel_path, [_hash_file(full_path), os.path.getsize(full_path), _language(rel_path)]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return dict(pool.map(_entry, rel_paths))
+
+    def build(self, project_id, worktree, commit_sha):
+        """Returns the index for commit_sha, re-hashing only what changed since the last indexed commit."""
+        existing = self.load(project_id, commit_sha)
+        if existing is not None:
+            return existing
+
+        previous = self.load_latest(project_id)
+        delta = self._changed_since(worktree, previous['commit'], commit_sha) if previous else None
+
+        if delta is None:
+            files = self._describe(worktree, list(self._walk(worktree)))
+            reindexed = len(files)
+        else:
+            changed, deleted = delta
+            changed = [p for p in changed if not _skipped(p)]
+            files = dict(previous['files'])
+            for path in deleted:
+                files.pop(path, None)
+            files.update(self._describe(worktree, changed))
+            reindexed = len(changed)
+
+        files = {path: entry for path, entry in files.items() if entry is not None}
+        index = {
+            'commit': commit_sha,
+            'files': files,
+            'stacks': self._detect_stacks(worktree, files),
+        }
+        self._save(project_id, index)
+        print(f"Indexer: {reindexed} of {len(files)} files (re)indexed for {commit_sha[:8]}.")
+        return index
+
+    # --- Stack detection ---
+    def _manifest_dependencies(self, worktree, rel_path):
+        full_path = os.path.join(worktree, rel_path)
+        name = os.path.basename(rel_path)
+        try:
+            with open(full_path, encoding='utf-8', errors='replace') as handle:
+                text = handle.read()
+        except OSError:
+            return {}
+
+        if name == 'package.json':
+            try:
+                data = json.loads(text)
+            except ValueError:
+                return {}
+            return {**data.get('devDependencies', {}), **data.get('dependencies', {})}
+
+        if name == 'requirements.txt':
+            deps = {}
+            for line in text.splitlines():
+                line = line.split('#', 1)[0].strip()
+                match = REQUIREMENT_NAME_RE.match(line)
+                if match:
+                    deps[match.group(1).lower()] = line[len(match.group(1)):].strip()
+            return deps
+
+        # pyproject.toml / Pipfile / setup.*: a name scan is enough to recognise the stack
+        return {dep: '' for dep in STACK_MARKERS if re.search(rf'["\'\s]{re.escape(dep)}\b', text, re.I)}
+
+    def _detect_stacks(self, worktree, files):
+        stacks = {}
+        for rel_path in files:
+            name = os.path.basename(rel_path)
+            if name in LOCKFILES:
+                stacks.setdefault(os.path.dirname(rel_path) or '.', {'labels': [], 'deps': {}, 'lockfiles': []})['lockfiles'].append(LOCKFILES[name])
+            if name not in MANIFESTS or _skipped(rel_path):
+                continue
+            entry = stacks.setdefault(os.path.dirname(rel_path) or '.', {'labels': [], 'deps': {}, 'lockfiles': []})
+            deps = self._manifest_dependencies(worktree, rel_path)
+            entry['deps'].update(deps)
+            for dep in deps:
+                label = STACK_MARKERS.get(dep.lower())
+                if label and label not in entry['labels']:
+                    entry['labels'].append(label)
+        return stacks
+
+    # --- Summaries for the Planner ---
+    def summarize(self, index, max_dirs=25):
+        """Dense, token-cheap description of the repository's shape."""
+        files = index['files']
+        total_bytes = sum(entry[1] for entry in files.values())
+        languages = Counter(entry[2] for entry in files.values() if entry[2])
+
+        lines = [f"Commit {index['commit'][:12]}: {len(files)} files, {total_bytes // 1024} KiB."]
+        lines.append("Languages: " + ", ".join(f"{lang} {count}" for lang, count in languages.most_common(8)))
+
+        for root, stack in sorted(index['stacks'].items()):
+            labels = ", ".join(stack['labels']) or "unrecognised"
+            locks = f" (lock: {', '.join(stack['lockfiles'])})" if stack['lockfiles'] else ""
+            lines.append(f"Stack @ {root}/: {labels}{locks}")
+
+        dirs = Counter()
+        for path in files:
+            parts = path.split('/')
+            if len(parts) > 1:
+                dirs['/'.join(parts[:min(2, len(parts) - 1)])] += 1
+        lines.append("Dirs: " + "; ".join(f"{d}/ {n}" for d, n in dirs.most_common(max_dirs)))
+
+        tests = [path for path in files if TEST_PATH_RE.search(path)]
+        if tests:
+            lines.append(f"Existing tests: {len(tests)} files, e.g. " + ", ".join(sorted(tests)[:5]))
+        return "\n".join(lines)
+
+    def dependency_summary(self, index, max_per_stack=40):
+        """Compact dependency listing (name + version spec) per manifest root."""
+        lines = []
+        for root, stack in sorted(index['stacks'].items()):
+            deps = [f"{name}{(' ' + spec) if spec else ''}" for name, spec in sorted(stack['deps'].items())[:max_per_stack]]
+            if deps:
+                lines.append(f"{root}/: " + ", ".join(deps))
+        return "\n".join(lines) or "No dependency manifests found."
@@ -0,0 +1,203 @@
+"""
+End-to-end throughput benchmark of the run pipeline against the local upstream stand-ins.
+
+    python manage.py mock_upstreams &            # and workers with CLAUDE_API_BASE_URL/GITHUB_API_URL pointed at it
+    python manage.py bench_pipeline --runs 200 --concurrency 50 --save-baseline bench.json
+    python manage.py bench_pipeline --runs 200 --concurrency 50 --baseline bench.json --tolerance 0.15
+
+Every run goes through the real Celery queues, agents, executor and git plumbing; only Claude and
+the GitHub API are emulated. The fixture repository is a local bare git repo (file://), so
+`--fixture-dir` must be visible at the same path to every worker. Reports runs/minute, per-phase
+p50/p95/p99 (from the RunCheckpoint timestamps) and each worker's peak RSS, and fails when
+compared against a baseline that it regressed by more than the tolerance.
+"""
+import json
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+
+from celery import current_app
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from projects.models import Project, ProjectRunStats, RunCheckpoint, TestRun
+from worker.mock_upstreams import FIXTURE_FILES
+from worker.tasks import PHASES, run_autonomous_test
+
+BENCH_USERNAME = 'bench-pipeline'
+TERMINAL_STATUSES = ('COMPLETE', 'FAILED')
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(round(fraction * (len(values) - 1))), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = "Drives concurrent runs through the pipeline against mock upstreams and reports throughput."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=50)
+        parser.add_argument('--concurrency', type=int, default=10, help="Runs in flight at once.")
+        parser.add_argument('--projects', type=int, default=10, help="Runs are spread over this many projects.")
+        parser.add_argument('--fixture-dir', default=os.path.join(tempfile.gettempdir(), 'applaude-bench-fixture.git'))
+        parser.add_argument('--timeout', type=int, default=3600, help="Give up after this many seconds.")
+        parser.add_argument('--poll', type=float, default=2.0)
+        parser.add_argument('--baseline', help="JSON results of an earlier run to compare against.")
+        parser.add_argument('--save-baseline', help="Write this run's results as JSON to this path.")
+        parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed regression vs the baseline (0.1 = 10%%).")
+        parser.add_argument('--cleanup', action='store_true', help="Delete the benchmark user and its runs.")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        if options['cleanup']:
+            User.objects.filter(username=BENCH_USERNAME).delete()
+            self.stdout.write(self.style.SUCCESS("Benchmark data removed."))
+            return
+        if 'api.anthropic.com' in settings.CLAUDE_API_BASE_URL or 'api.github.com' in settings.GITHUB_API_URL:
+            raise CommandError(
+                "CLAUDE_API_BASE_URL / GITHUB_API_URL point at the real services; "
+                "run `manage.py mock_upstreams` and point the API and workers at it first."
+            )
+
+        repo_url = self._fixture_repo(options['fixture_dir'])
+        user, _ = User.objects.get_or_create(username=BENCH_USERNAME, defaults={'email': f"{BENCH_USERNAME}@example.com"})
+        user.github_username = BENCH_USERNAME
+        user.github_access_token = 'bench-token'
+        user.save(update_fields=['github_username', 'github_access_token'])
+        projects = list(Project.objects.filter(user=user, github_url=repo_url)[:options['projects']])
+        for index in range(len(projects), options['projects']):
+            project = Project.objects.create(user=user, name=f"bench-{index}", github_url=repo_url)
+            ProjectRunStats.objects.create(project=project)
+            projects.append(project)
+
+        run_ids = self._drive(projects, options)
+        results = self._results(run_ids)
+        self._report(results)
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as handle:
+                json.dump(results, handle, indent=2)
+            self.stdout.write(f"Baseline written to {options['save_baseline']}.")
+        if options['baseline']:
+            with open(options['baseline']) as handle:
+                regressions = self._compare(json.load(handle), results, options['tolerance'])
+            if regressions:
+                raise CommandError("Regressed against the baseline:\n  " + "\n  ".join(regressions))
+            self.stdout.write(self.style.SUCCESS(f"Within {options['tolerance']:.0%} of the baseline."))
+
+    def _fixture_repo(self, path):
+        """A bare repo holding FIXTURE_FILES (one seeded bug), created once and reused."""
+        if not os.path.exists(os.path.join(path, 'HEAD')):
+            with tempfile.TemporaryDirectory() as work:
+                for name, content in FIXTURE_FILES.items():
+                    os.makedirs(os.path.dirname(os.path.join(work, name)) or work, exist_ok=True)
+                    with open(os.path.join(work, name), 'w') as handle:
+                        handle.write(content)
+                git = ['git', '-c', 'user.name=Applaude Bench', '-c', 'user.email=bench@example.com']
+                subprocess.run([*git, 'init', '--quiet', '--initial-branch=main', work], check=True)
+                subprocess.run([*git, '-C', work, 'add', '-A'], check=True)
+                subprocess.run([*git, '-C', work, 'commit', '--quiet', '-m', 'Benchmark fixture'], check=True)
+                subprocess.run(['git', 'clone', '--bare', '--quiet', work, path], check=True)
+        return f"file://{os.path.abspath(path)}"
+
+    def _drive(self, projects, options):
+        """Keeps `concurrency` runs in flight until `runs` have finished. Returns all run ids."""
+        pending, finished = [], []
+        started = time.monotonic()
+        deadline = started + options['timeout']
+        total = options['runs']
+        while len(finished) < total:
+            while len(pending) < options['concurrency'] and len(pending) + len(finished) < total:
+                project = projects[(len(pending) + len(finished)) % len(projects)]
+                run = TestRun.objects.create(project=project, status='QUEUED', run_type='FULL_STACK')
+                ProjectRunStats.run_started(run)
+                task = run_autonomous_test.delay(run_id=str(run.id))
+                run.celery_task_id = task.id
+                run.save(update_fields=['celery_task_id'])
+                pending.append(run.id)
+
+            if time.monotonic() > deadline:
+                raise CommandError(f"Timed out with {len(pending)} runs still in flight ({len(finished)} finished).")
+            time.sleep(options['poll'])
+            done = set(TestRun.objects.filter(id__in=pending, status__in=TERMINAL_STATUSES).values_list('id', flat=True))
+            if done:
+                pending = [run_id for run_id in pending if run_id not in done]
+                finished.extend(done)
+                elapsed = time.monotonic() - started
+                self.stdout.write(f"  {len(finished)}/{total} finished after {elapsed:.0f}s")
+        self.elapsed = time.monotonic() - started
+        return finished
+
+    def _results(self, run_ids):
+        statuses = dict.fromkeys(TERMINAL_STATUSES, 0)
+        for status in TestRun.objects.filter(id__in=run_ids).values_list('status', flat=True):
+            statuses[status] += 1
+
+        durations = {phase: [] for phase, _ in PHASES}
+        checkpoints = RunCheckpoint.objects.filter(
+            run_id__in=run_ids, started_at__isnull=False, completed_at__isnull=False,
+        ).values_list('phase', 'started_at', 'completed_at')
+        for phase, started_at, completed_at in checkpoints:
+            durations[phase].append((completed_at - started_at).total_seconds())
+
+        return {
+            'recorded_at': timezone.now().isoformat(),
+            'runs': len(run_ids),
+            'statuses': statuses,
+            'elapsed_seconds': round(self.elapsed, 1),
+            'runs_per_minute': round(statuses['COMPLETE'] / (self.elapsed / 60), 2) if self.elapsed else 0.0,
+            'phases': {
+                phase: {
+                    'count': len(values),
+                    'p50': percentile(values, 0.50),
+                    'p95': percentile(values, 0.95),
+                    'p99': percentile(values, 0.99),
+                    'mean': statistics.fmean(values) if values else None,
+                }
+                for phase, values in durations.items()
+            },
+            'workers': self._worker_memory(),
+        }
+
+    @staticmethod
+    def _worker_memory():
+        """Peak RSS (MB) of each worker's main process, as reported by `celery inspect stats`."""
+        stats = current_app.control.inspect(timeout=5.0).stats() or {}
+        return {
+            worker: round(info.get('rusage', {}).get('maxrss', 0) / 1024, 1) # maxrss is in KB on Linux
+            for worker, info in sorted(stats.items())
+        }
+
+    def _report(self, results):
+        self.stdout.write(
+            f"\n{results['runs']} runs in {results['elapsed_seconds']}s: "
+            f"{results['statuses']['COMPLETE']} complete, {results['statuses']['FAILED']} failed, "
+            f"{results['runs_per_minute']} runs/min"
+        )
+        self.stdout.write(f"\n{'phase':<10}{'n':>6}{'p50 (s)':>10}{'p95 (s)':>10}{'p99 (s)':>10}")
+        for phase, row in results['phases'].items():
+            if not row['count']:
+                continue
+            self.stdout.write(f"{phase:<10}{row['count']:>6}{row['p50']:>10.2f}{row['p95']:>10.2f}{row['p99']:>10.2f}")
+        if results['workers']:
+            self.stdout.write("\nWorker peak RSS:")
+            for worker, rss in results['workers'].items():
+                self.stdout.write(f"  {worker}: {rss} MB")
+
+    @staticmethod
+    def _compare(baseline, results, tolerance):
+        regressions = []
+        if results['runs_per_minute'] < baseline['runs_per_minute'] * (1 - tolerance):
+            regressions.append(f"throughput {results['runs_per_minute']} runs/min (baseline {baseline['runs_per_minute']})")
+        for phase, row in results['phases'].items():
+            before = baseline['phases'].get(phase, {}).get('p95')
+            if before and row['p95'] and row['p95'] > before * (1 + tolerance):
+                regressions.append(f"{phase} p95 {row['p95']:.2f}s (baseline {before:.2f}s)")
+        return regressions
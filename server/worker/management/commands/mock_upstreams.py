@@ -0,0 +1,48 @@
+"""
+Serves local stand-ins for the Anthropic Messages API and the GitHub REST API (see
+worker/mock_upstreams.py), for load tests that must not spend tokens or touch real repos.
+
+    python manage.py mock_upstreams --port 8900 --claude-median 2 --claude-p99 8 --error-rate 0.02
+
+Point the workers at it with CLAUDE_API_BASE_URL=http://<host>:8900 and
+GITHUB_API_URL=http://<host>:8900, then drive load with `manage.py bench_pipeline`.
+"""
+from django.core.management.base import BaseCommand
+
+from worker.mock_upstreams import MockConfig, make_server
+
+
+class Command(BaseCommand):
+    help = "Runs the local Anthropic/GitHub stand-in server used by bench_pipeline."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=8900)
+        parser.add_argument('--claude-median', type=float, default=2.0, help="Median Claude latency (s).")
+        parser.add_argument('--claude-p99', type=float, default=8.0, help="p99 Claude latency (s).")
+        parser.add_argument('--github-median', type=float, default=0.2, help="Median GitHub API latency (s).")
+        parser.add_argument('--github-p99', type=float, default=1.0, help="p99 GitHub API latency (s).")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Share of Claude requests answered 429/529.")
+        parser.add_argument('--report-tokens', type=int, default=1500, help="Approximate size of the Scribe's report.")
+        parser.add_argument('--batch-seconds', type=float, default=30.0, help="Time until a message batch ends.")
+
+    def handle(self, *args, **options):
+        config = MockConfig(
+            claude_median=options['claude_median'], claude_p99=options['claude_p99'],
+            github_median=options['github_median'], github_p99=options['github_p99'],
+            error_rate=options['error_rate'], report_tokens=options['report_tokens'],
+            batch_seconds=options['batch_seconds'],
+        )
+        server = make_server(options['host'], options['port'], config)
+        self.stdout.write(self.style.SUCCESS(
+            f"Mock upstreams listening on http://{options['host']}:{options['port']} "
+            f"(Claude median {options['claude_median']}s / p99 {options['claude_p99']}s, "
+            f"error rate {options['error_rate']:.1%})"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Served: {config.counts}")
@@ -0,0 +1,330 @@
+import contextlib
+import contextvars
+import json
+import threading
+import time
+
+import redis
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from projects.models import ModelRoutingDecision, TestRun
+from .redis_conn import get_redis
+from .tracing import end_span, span, start_span
+
+# Run/project the current code is working for. Set by the pipeline around each phase; asyncio
+# tasks and to_thread calls inherit it, so fan-out calls are attributed without threading ids through.
+_run_context = contextvars.ContextVar('applaude_run_context', default=(None, None))
+
+PREFIX = 'metrics'
+HISTOGRAMS_INDEX = f'{PREFIX}:index:histograms'
+COUNTERS_INDEX = f'{PREFIX}:index:counters'
+
+HELP = {
+    'applaude_claude_request_seconds': ('histogram', "Claude call latency including retries and rate-limit waits."),
+    'applaude_claude_tokens_total': ('counter', "Claude tokens billed, from the API usage field (input, output, cache_write, cache_read)."),
+    'applaude_claude_retries_total': ('counter', "Claude request retries (transient errors, 429/529)."),
+    'applaude_claude_cache_total': ('counter', "Claude response cache lookups by result."),
+    'applaude_claude_cost_usd_total': ('counter', "Estimated Claude spend in USD."),
+    'applaude_claude_errors_total': ('counter', "Claude calls that failed after all retries."),
+    'applaude_claude_fallbacks_total': ('counter', "Claude calls moved to their fallback model (overload/timeouts)."),
+    'applaude_github_request_seconds': ('histogram', "GitHub/git operation latency."),
+    'applaude_github_requests_total': ('counter', "GitHub/git operations by outcome."),
+    'applaude_paystack_event_failures_total': ('counter', "Paystack events that failed to apply (final=true: needs attention)."),
+}
+
+
+def increment(name, amount=1, **labels):
+    """Bumps a counter outside of the Claude/GitHub call helpers (e.g. billing)."""
+    if settings.METRICS_ENABLED:
+        batch = _Batch()
+        batch.inc(name, amount, **labels)
+        batch.send()
+
+
+def current_run():
+    """(run_id, project_id) of the phase being executed, or (None, None)."""
+    return _run_context.get()
+
+
+@contextlib.contextmanager
+def run_context(run_id, project_id):
+    token = _run_context.set((str(run_id), str(project_id)))
+    try:
+        yield
+    finally:
+        _run_context.reset(token)
+
+
+def _labels_key(labels):
+    return json.dumps(labels, sort_keys=True, separators=(',', ':'))
+
+
+class _Batch:
+    """Collects metric writes for one observation and sends them in a single Redis pipeline."""
+
+    def __init__(self):
+        self.pipe = get_redis().pipeline(transaction=False)
+
+    def observe(self, name, value, **labels):
+        labels_key = _labels_key(labels)
+        key = f"{PREFIX}:h:{name}:{labels_key}"
+        bucket = next((b for b in settings.METRICS_LATENCY_BUCKETS if value <= b), '+Inf')
+        self.pipe.hincrby(key, str(bucket), 1)
+        self.pipe.hincrbyfloat(key, 'sum', value)
+        self.pipe.hincrby(key, 'count', 1)
+        self.pipe.sadd(HISTOGRAMS_INDEX, f"{name}|{labels_key}")
+
+    def inc(self, name, amount=1, **labels):
+        self.pipe.hincrbyfloat(f"{PREFIX}:c:{name}", _labels_key(labels), amount)
+        self.pipe.sadd(COUNTERS_INDEX, name)
+
+    def run_totals(self, run_id, **fields):
+        """Per-run aggregates, copied onto the TestRun by flush_run_metrics()."""
+        key = f"{PREFIX}:run:{run_id}"
+        for field, amount in fields.items():
+            self.pipe.hincrbyfloat(key, field, amount)
+        self.pipe.expire(key, 7 * 24 * 3600)
+
+    def send(self):
+        # Metrics must never fail the pipeline
+        try:
+            self.pipe.execute()
+        except redis.RedisError as e:
+            print(f"Metrics write failed: {e}")
+
+
+# Usage fields of a Messages API response and their `direction` label on applaude_claude_tokens_total.
+# input_tokens excludes the prompt-cached prefix, which is billed as a cache write or read instead.
+TOKEN_DIRECTIONS = {
+    'input_tokens': 'input',
+    'output_tokens': 'output',
+    'cache_creation_input_tokens': 'cache_write',
+    'cache_read_input_tokens': 'cache_read',
+}
+
+
+def claude_cost(usage):
+    return (
+        (usage.get('input_tokens') or 0) * settings.CLAUDE_INPUT_COST_PER_MTOK
+        + (usage.get('output_tokens') or 0) * settings.CLAUDE_OUTPUT_COST_PER_MTOK
+        + (usage.get('cache_creation_input_tokens') or 0) * settings.CLAUDE_CACHE_WRITE_COST_PER_MTOK
+        + (usage.get('cache_read_input_tokens') or 0) * settings.CLAUDE_CACHE_READ_COST_PER_MTOK
+    ) / 1_000_000
+
+
+# Routing decisions of this process's Claude calls, written in bulk by flush_run_metrics()
+_routing_decisions = []
+_routing_lock = threading.Lock()
+
+
+class ClaudeCallTimer:
+    """
+    Measures one Claude call (from the cache lookup to the final answer). The client bumps
+    `retries` as it retries, reports a fallback with fall_back(), and calls done() once with
+    the API `usage`, or with cache_hit/error. `route` is the router's choice for the call.
+    """
+
+    def __init__(self, agent, route=None):
+        self.agent = agent or 'other'
+        self.route = route
+        self.model = route.model if route else ''
+        self.fell_back = False
+        self.run_id, self.project_id = current_run()
+        self.started = time.perf_counter()
+        self.retries = 0
+        self.elapsed = 0.0
+        self.span = start_span('claude.messages', {
+            'gen_ai.system': 'anthropic', 'gen_ai.request.model': self.model or None, 'applaude.agent': self.agent,
+            'applaude.route_reason': route.reason if route else None,
+        })
+
+    def fall_back(self, model):
+        self.model = model
+        self.fell_back = True
+
+    def done(self, usage=None, cache_hit=False, error=False, cost_factor=1.0):
+        """`cost_factor` discounts the price (e.g. Message Batches requests are billed at half)."""
+        self.elapsed = time.perf_counter() - self.started
+        usage = usage or {}
+        cost = claude_cost(usage) * cost_factor
+        end_span(self.span, {
+            'gen_ai.usage.input_tokens': usage.get('input_tokens'),
+            'gen_ai.usage.output_tokens': usage.get('output_tokens'),
+            'gen_ai.usage.cache_creation_input_tokens': usage.get('cache_creation_input_tokens'),
+            'gen_ai.usage.cache_read_input_tokens': usage.get('cache_read_input_tokens'),
+            'applaude.cache_hit': cache_hit,
+            'applaude.retries': self.retries,
+            'applaude.fell_back': self.fell_back,
+            'gen_ai.response.model': self.model or None,
+        }, error=error)
+        self._record_decision(usage, cache_hit, error, cost)
+        if not settings.METRICS_ENABLED:
+            return
+        labels = {'agent': self.agent, 'project': self.project_id or ''}
+        batch = _Batch()
+        batch.observe('applaude_claude_request_seconds', self.elapsed, model=self.model, **labels)
+        if self.fell_back:
+            batch.inc('applaude_claude_fallbacks_total', to=self.model, **labels)
+        batch.inc('applaude_claude_cache_total', result='hit' if cache_hit else 'miss', **labels)
+        if self.retries:
+            batch.inc('applaude_claude_retries_total', self.retries, **labels)
+        if error:
+            batch.inc('applaude_claude_errors_total', **labels)
+        for field, direction in TOKEN_DIRECTIONS.items():
+            if usage.get(field):
+                batch.inc('applaude_claude_tokens_total', usage[field], direction=direction, **labels)
+        if cost:
+            batch.inc('applaude_claude_cost_usd_total', cost, **labels)
+        if self.run_id:
+            batch.run_totals(
+                self.run_id,
+                claude_calls=1,
+                claude_seconds=self.elapsed,
+                input_tokens=usage.get('input_tokens', 0),
+                output_tokens=usage.get('output_tokens', 0),
+                prompt_cache_write_tokens=usage.get('cache_creation_input_tokens') or 0,
+                prompt_cache_read_tokens=usage.get('cache_read_input_tokens') or 0,
+                claude_retries=self.retries,
+                cache_hits=int(cache_hit),
+                cost_usd=cost,
+            )
+        batch.send()
+
+    def _record_decision(self, usage, cache_hit, error, cost):
+        if self.route is None or not self.run_id:
+            return
+        decision = ModelRoutingDecision(
+            run_id=self.run_id,
+            agent=self.agent,
+            task=self.route.task,
+            plan=self.route.plan,
+            prompt_tokens=self.route.prompt_tokens,
+            escalation=self.route.escalation,
+            routed_model=self.route.model,
+            model=self.model,
+            reason=self.route.reason[:255],
+            fell_back=self.fell_back,
+            outcome='ERROR' if error else 'CACHE_HIT' if cache_hit else 'OK',
+            latency_seconds=self.elapsed,
+            retries=self.retries,
+            input_tokens=usage.get('input_tokens') or 0,
+            output_tokens=usage.get('output_tokens') or 0,
+            cost_usd=cost,
+        )
+        with _routing_lock:
+            _routing_decisions.append(decision)
+
+
+def flush_routing_decisions(run_id):
+    """Writes the buffered routing decisions of `run_id` (one INSERT for the whole phase)."""
+    with _routing_lock:
+        pending = [d for d in _routing_decisions if d.run_id == str(run_id)]
+        _routing_decisions[:] = [d for d in _routing_decisions if d.run_id != str(run_id)]
+    if not pending:
+        return
+    try:
+        ModelRoutingDecision.objects.bulk_create(pending)
+    except DatabaseError as e:
+        print(f"Recording {len(pending)} routing decisions failed: {e}")
+
+
+@contextlib.contextmanager
+def observe_github(operation):
+    """Times a GitHub/git operation (clone, fetch, push, PR creation) of the current run."""
+    run_id, project_id = current_run()
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        with span(f'github.{operation}', {'applaude.operation': operation}):
+            yield
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        if settings.METRICS_ENABLED:
+            labels = {'operation': operation, 'project': project_id or ''}
+            batch = _Batch()
+            batch.observe('applaude_github_request_seconds', elapsed, **labels)
+            batch.inc('applaude_github_requests_total', outcome=outcome, **labels)
+            if run_id:
+                batch.run_totals(run_id, github_calls=1, github_seconds=elapsed)
+            batch.send()
+
+
+# Run aggregate fields and their TestRun types
+RUN_FIELDS = {
+    'claude_calls': int, 'claude_seconds': float, 'input_tokens': int, 'output_tokens': int,
+    'prompt_cache_write_tokens': int, 'prompt_cache_read_tokens': int,
+    'claude_retries': int, 'cache_hits': int, 'cost_usd': float, 'github_calls': int, 'github_seconds': float,
+}
+
+
+def flush_run_metrics(run_id):
+    """
+    Copies the run's running totals from Redis onto its TestRun row (idempotent), and writes
+    its buffered routing decisions.
+    """
+    flush_routing_decisions(run_id)
+    try:
+        totals = get_redis().hgetall(f"{PREFIX}:run:{run_id}")
+    except redis.RedisError as e:
+        print(f"Metrics read failed: {e}")
+        return
+    if not totals:
+        return
+    values = {
+        field: cast(float(totals[field.encode()]))
+        for field, cast in RUN_FIELDS.items() if field.encode() in totals
+    }
+    TestRun.objects.filter(id=run_id).update(**values, updated_at=timezone.now())
+
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    client = get_redis()
+    series = {}
+
+    entries = [entry.decode().split('|', 1) for entry in client.smembers(HISTOGRAMS_INDEX)]
+    pipe = client.pipeline(transaction=False)
+    for name, labels_key in entries:
+        pipe.hgetall(f"{PREFIX}:h:{name}:{labels_key}")
+    for (name, labels_key), buckets in sorted(zip(entries, pipe.execute())):
+        series.setdefault(name, []).append(('h', json.loads(labels_key), buckets))
+    for name in sorted(m.decode() for m in client.smembers(COUNTERS_INDEX)):
+        for labels_key, value in sorted(client.hgetall(f"{PREFIX}:c:{name}").items()):
+            series.setdefault(name, []).append(('c', json.loads(labels_key), value))
+
+    lines = []
+    for name in sorted(series):
+        kind, help_text = HELP.get(name, ('untyped', ''))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for series_kind, labels, value in series[name]:
+            if series_kind == 'c':
+                lines.append(f"{name}{_format_labels(labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound in [*settings.METRICS_LATENCY_BUCKETS, '+Inf']:
+                cumulative += int(value.get(str(bound).encode(), 0))
+                lines.append(f"{name}_bucket{_format_labels({**labels, 'le': str(bound)})} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_number(value.get(b'sum', 0))}")
+            lines.append(f"{name}_count{_format_labels(labels)} {int(value.get(b'count', 0))}")
+    return "\n".join(lines) + "\n"
+
+
+def _number(value):
+    # repr() round-trips every float; '%g' would round totals past 1e6 to 6 significant digits
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items())) + "}"
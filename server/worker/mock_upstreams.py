@@ -0,0 +1,352 @@
+"""
+Local stand-ins for the Anthropic Messages API and the GitHub REST endpoints the pipeline uses,
+for offline load tests (see `manage.py mock_upstreams` and `manage.py bench_pipeline`).
+
+Responses are shaped per agent so a run goes through every phase for real: the Planner gets a
+pytest suite for the benchmark fixture repo (one test fails on the seeded bug), the Fixer a
+unified diff that fixes it, the Scribe a markdown report. Latency is log-normal (configured by
+its median and p99), a configurable share of requests fails with 429/529, and token usage is
+reported like the real API, including prompt-cache reads and writes for `cache_control` prefixes.
+Message Batches are accepted too and end after a configurable delay, with the same per-request
+error rate applied as `errored` results.
+"""
+import difflib
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The benchmark fixture repository (written by bench_pipeline): `sub` carries the seeded bug
+FIXTURE_FILES = {
+    'app/__init__.py': "",
+    'app/calc.py': (
+        "def add(a, b):\n"
+        "    return a + b\n"
+        "\n"
+        "\n"
+        "def sub(a, b):\n"
+        "    return a + b  # BUG: should subtract\n"
+    ),
+    'requirements.txt': "pytest\n",
+}
+BUGGY_LINE = "    return a + b  # BUG: should subtract\n"
+FIXED_LINE = "    return a - b\n"
+
+PLANNER_SUITE = (
+    "```python\n"
+    "# tests/test_calc_add.py\n"
+    "from app import calc\n"
+    "\n"
+    "\n"
+    "def test_add():\n"
+    "    assert calc.add(2, 3) == 5\n"
+    "```\n"
+    "\n"
+    "```python\n"
+    "# tests/test_calc_sub.py\n"
+    "from app import calc\n"
+    "\n"
+    "\n"
+    "def test_sub():\n"
+    "    assert calc.sub(5, 3) == 2\n"
+    "```\n"
+)
+
+FILE_CONTENT_RE = re.compile(r'Failing File Content:\n(.*)', re.S)
+FILE_PATH_RE = re.compile(r'Failing File Path: (\S+)')
+
+# Prompt caching as the API does it: prefixes of at least this many tokens, kept for 5 minutes after last use
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_TTL = 300
+
+
+class LatencyModel:
+    """Log-normal latency from a median and a p99 (seconds)."""
+
+    def __init__(self, median, p99):
+        self.mu = math.log(max(median, 1e-6))
+        self.sigma = max(math.log(max(p99, median) / max(median, 1e-6)) / 2.326, 0.0)
+
+    def sample(self):
+        return random.lognormvariate(self.mu, self.sigma) if self.sigma else math.exp(self.mu)
+
+
+class MockConfig:
+    def __init__(self, claude_median=2.0, claude_p99=8.0, github_median=0.2, github_p99=1.0,
+                 error_rate=0.0, report_tokens=1500, batch_seconds=30.0):
+        self.claude_latency = LatencyModel(claude_median, claude_p99)
+        self.github_latency = LatencyModel(github_median, github_p99)
+        self.error_rate = error_rate
+        self.report_tokens = report_tokens
+        self.batch_seconds = batch_seconds
+        self.lock = threading.Lock()
+        self.counts = {'messages': 0, 'errors': 0, 'pulls': 0, 'cache_reads': 0, 'cache_writes': 0, 'batches': 0}
+        self.prompt_cache = {} # prefix hash -> expiry (monotonic)
+        self.batches = {} # batch id -> {'ends_at': monotonic, 'results': [...]}
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def prompt_cache_hit(self, prefix_hash):
+        """True if the prefix is cached; (re)caches it either way, refreshing its TTL."""
+        now = time.monotonic()
+        with self.lock:
+            hit = self.prompt_cache.get(prefix_hash, 0) > now
+            self.prompt_cache[prefix_hash] = now + PROMPT_CACHE_TTL
+            self.counts['cache_reads' if hit else 'cache_writes'] += 1
+        return hit
+
+
+def _tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _usage(system_blocks, user, text, config):
+    """Usage block for a reply, splitting a cache_control prefix of the system prompt off the input."""
+    prefix, cached_prefix = "", ""
+    for block in system_blocks:
+        prefix += block.get('text', '')
+        if block.get('cache_control'):
+            cached_prefix = prefix
+    usage = {
+        'input_tokens': _tokens(prefix + user), 'output_tokens': _tokens(text),
+        'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 0,
+    }
+    cached_tokens = len(cached_prefix) // 4
+    if cached_tokens >= PROMPT_CACHE_MIN_TOKENS:
+        hit = config.prompt_cache_hit(hashlib.sha256(cached_prefix.encode()).hexdigest())
+        usage['cache_read_input_tokens' if hit else 'cache_creation_input_tokens'] = cached_tokens
+        usage['input_tokens'] = max(1, usage['input_tokens'] - cached_tokens)
+    return usage
+
+
+def agent_reply(system_prompt, user_prompt, config):
+    """The text the real agent would be expected to produce for this prompt."""
+    if 'Testing Agent' in system_prompt:
+        return PLANNER_SUITE
+    if 'Debugging Agent' in system_prompt:
+        path_match = FILE_PATH_RE.search(user_prompt)
+        content_match = FILE_CONTENT_RE.search(user_prompt)
+        path = path_match.group(1) if path_match else 'app/calc.py'
+        content = content_match.group(1).rstrip('\n') + "\n" if content_match else FIXTURE_FILES['app/calc.py']
+        fixed = content.replace(BUGGY_LINE, FIXED_LINE)
+        return "".join(difflib.unified_diff(
+            content.splitlines(keepends=True), fixed.splitlines(keepends=True),
+            fromfile=f"a/{path}", tofile=f"b/{path}",
+        ))
+    if 'condensing one slice' in system_prompt:
+        return "- app/calc.py: `sub` added instead of subtracting; fixed and verified by tests/test_calc_sub.py.\n"
+    # Scribe: a report of roughly the configured size
+    body = "The autonomous run found and fixed the arithmetic defect in `app/calc.py`. " * max(1, config.report_tokens // 16)
+    return (
+        "# Applaude Autonomous Remediation Report\n\n## Summary\n\n" + body +
+        "\n\n---\n\n## Pull Request Description\n\nFixes `calc.sub`, verified by the generated suite.\n"
+    )
+
+
+class MockUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'ApplaudeMock/1.0'
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def log_message(self, format, *args):
+        pass # Keep load tests quiet
+
+    def _json(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    # --- Routing ---
+
+    def do_POST(self):
+        if self.path == '/v1/messages':
+            return self._messages(self._body())
+        if self.path == '/v1/messages/batches':
+            return self._create_batch(self._body())
+        match = re.fullmatch(r'/repos/([^/]+)/([^/]+)/pulls', self.path)
+        if match:
+            return self._create_pull(*match.groups(), self._body())
+        self._json(404, {'message': 'Not Found'})
+
+    def do_GET(self):
+        match = re.fullmatch(r'/repos/([^/]+)/([^/]+)', self.path)
+        if match:
+            time.sleep(self.config.github_latency.sample())
+            return self._json(200, {'name': match.group(2), 'full_name': '/'.join(match.groups()), 'default_branch': 'main'})
+        url = urlsplit(self.path)
+        if url.path == '/v1/messages/batches':
+            return self._list_batches(parse_qs(url.query))
+        match = re.fullmatch(r'/v1/messages/batches/([^/]+)(/results)?', self.path)
+        if match:
+            return self._batch(*match.groups())
+        if self.path == '/_stats':
+            return self._json(200, self.config.counts)
+        self._json(404, {'message': 'Not Found'})
+
+    # --- Anthropic Messages API ---
+
+    def _messages(self, payload):
+        self.config.count('messages')
+        latency = self.config.claude_latency.sample()
+        if random.random() < self.config.error_rate:
+            self.config.count('errors')
+            time.sleep(min(latency, 1.0))
+            status = random.choice((429, 529))
+            error_type = 'rate_limit_error' if status == 429 else 'overloaded_error'
+            return self._json(status, {'type': 'error', 'error': {'type': error_type, 'message': 'Mock upstream error'}},
+                              headers={'retry-after': '1'})
+
+        message = self._reply(payload)
+        if payload.get('stream'):
+            return self._stream(message, latency)
+        time.sleep(latency)
+        self._json(200, message)
+
+    def _reply(self, payload):
+        system_blocks = payload.get('system') or []
+        if isinstance(system_blocks, str):
+            system_blocks = [{'type': 'text', 'text': system_blocks}]
+        system = "".join(block.get('text', '') for block in system_blocks)
+        user = "".join(
+            message['content'] if isinstance(message['content'], str)
+            else "".join(block.get('text', '') for block in message['content'])
+            for message in payload.get('messages', [])
+        )
+        text = agent_reply(system, user, self.config)
+        usage = _usage(system_blocks, user, text, self.config)
+        return {
+            'id': f"msg_mock_{uuid.uuid4().hex[:16]}", 'type': 'message', 'role': 'assistant',
+            'model': payload.get('model'), 'stop_reason': 'end_turn',
+            'content': [{'type': 'text', 'text': text}], 'usage': usage,
+        }
+
+    def _stream(self, message, latency):
+        text = message['content'][0]['text']
+        pieces = [text[i:i + 64] for i in range(0, len(text), 64)] or ['']
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def event(name, data):
+            self.wfile.write(f"event: {name}\ndata: {json.dumps(data)}\n\n".encode())
+            self.wfile.flush()
+
+        # Time to first token is a third of the latency, the rest is spread across the deltas
+        time.sleep(latency / 3)
+        event('message_start', {'type': 'message_start', 'message': {
+            **message, 'content': [], 'usage': {**message['usage'], 'output_tokens': 1},
+        }})
+        event('content_block_start', {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}})
+        for piece in pieces:
+            time.sleep(latency * 2 / 3 / len(pieces))
+            event('content_block_delta', {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': piece}})
+        event('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        event('message_delta', {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'},
+                                'usage': {'output_tokens': message['usage']['output_tokens']}})
+        event('message_stop', {'type': 'message_stop'})
+
+    # --- Message Batches API ---
+
+    def _create_batch(self, payload):
+        self.config.count('batches')
+        results = []
+        for request in payload.get('requests', []):
+            if random.random() < self.config.error_rate:
+                self.config.count('errors')
+                result = {'type': 'errored', 'error': {'type': 'error', 'error': {'type': 'api_error', 'message': 'Mock upstream error'}}}
+            else:
+                self.config.count('messages')
+                result = {'type': 'succeeded', 'message': self._reply(request['params'])}
+            results.append({'custom_id': request['custom_id'], 'result': result})
+        batch_id = f"msgbatch_mock_{uuid.uuid4().hex[:16]}"
+        with self.config.lock:
+            self.config.batches[batch_id] = {
+                'ends_at': time.monotonic() + self.config.batch_seconds, 'results': results,
+                'created_at': datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+            }
+        self._json(200, self._batch_object(batch_id))
+
+    def _list_batches(self, query):
+        """Newest first, paged with limit/after_id like the real API."""
+        with self.config.lock:
+            ids = list(reversed(self.config.batches))
+        after_id = (query.get('after_id') or [None])[0]
+        if after_id in ids:
+            ids = ids[ids.index(after_id) + 1:]
+        limit = int((query.get('limit') or [20])[0])
+        page = [self._batch_object(batch_id) for batch_id in ids[:limit]]
+        self._json(200, {
+            'data': page, 'has_more': len(ids) > limit,
+            'first_id': page[0]['id'] if page else None, 'last_id': page[-1]['id'] if page else None,
+        })
+
+    def _batch(self, batch_id, results):
+        if batch_id not in self.config.batches:
+            return self._json(404, {'type': 'error', 'error': {'type': 'not_found_error', 'message': 'Batch not found'}})
+        batch = self._batch_object(batch_id)
+        if not results:
+            return self._json(200, batch)
+        if batch['processing_status'] != 'ended':
+            return self._json(400, {'type': 'error', 'error': {'type': 'invalid_request_error', 'message': 'Batch still processing'}})
+        body = "".join(json.dumps(line) + "\n" for line in self.config.batches[batch_id]['results']).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-jsonl')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _batch_object(self, batch_id):
+        batch = self.config.batches[batch_id]
+        ended = time.monotonic() >= batch['ends_at']
+        counts = {'processing': 0, 'succeeded': 0, 'errored': 0, 'canceled': 0, 'expired': 0}
+        for line in batch['results']:
+            counts[line['result']['type'] if ended else 'processing'] += 1
+        host = self.headers.get('Host') or f"{self.server.server_address[0]}:{self.server.server_address[1]}"
+        return {
+            'id': batch_id, 'type': 'message_batch', 'request_counts': counts, 'created_at': batch['created_at'],
+            'processing_status': 'ended' if ended else 'in_progress',
+            'results_url': f"http://{host}/v1/messages/batches/{batch_id}/results" if ended else None,
+        }
+
+    # --- GitHub REST ---
+
+    def _create_pull(self, owner, repo, payload):
+        self.config.count('pulls')
+        time.sleep(self.config.github_latency.sample())
+        number = random.randint(1, 100000)
+        self._json(201, {
+            'number': number, 'state': 'open', 'title': payload.get('title'),
+            'head': {'ref': payload.get('head')}, 'base': {'ref': payload.get('base')},
+            'html_url': f"https://github.com/{owner}/{repo}/pull/{number}",
+        })
+
+
+def make_server(host, port, config):
+    server = ThreadingHTTPServer((host, port), MockUpstreamHandler)
+    server.daemon_threads = True
+    server.config = config
+    return server
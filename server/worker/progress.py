@@ -0,0 +1,54 @@
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from projects.models import TestRun
+
+from .budget import CHARS_PER_TOKEN
+from .events import publish_run_event
+
+
+class StreamProgress:
+    """
+    Passes a stream of text deltas through while keeping the TestRun's progress counters
+    current. DB writes are throttled to one per RUN_PROGRESS_MIN_INTERVAL seconds so a fast
+    stream does not turn into a write per token.
+    """
+
+    def __init__(self, run_id, min_interval=None):
+        self.run_id = run_id
+        self.min_interval = settings.RUN_PROGRESS_MIN_INTERVAL if min_interval is None else min_interval
+        self.chunks = []
+        self.chars_received = 0
+        self._last_write = 0.0
+
+    @property
+    def tokens_received(self):
+        # Output tokens are only reported at the end of a stream; estimated like every prompt budget until then
+        return int(self.chars_received / CHARS_PER_TOKEN)
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
+
+    def track(self, deltas):
+        for delta in deltas:
+            self.chunks.append(delta)
+            self.chars_received += len(delta)
+            self.flush()
+            yield delta
+        self.flush(force=True)
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_write < self.min_interval:
+            return
+        self._last_write = now
+        stamp = timezone.now()
+        TestRun.objects.filter(id=self.run_id).update(
+            tokens_received=self.tokens_received,
+            progress_updated_at=stamp,
+            updated_at=stamp, # .update() bypasses auto_now
+        )
+        publish_run_event(self.run_id, 'progress', {'tokens_received': self.tokens_received})
@@ -0,0 +1,154 @@
+import asyncio
+import time
+
+import redis
+from django.conf import settings
+
+from .redis_conn import get_redis
+
+# Two token buckets (requests/min and tokens/min) plus a shared "pause until" key set
+# when the API answers 429/529 with retry-after. Runs atomically inside Redis and uses the
+# server clock, so every worker process on every host sees the same state.
+# Returns the number of seconds the caller must wait; "0" means the reservation was taken.
+RESERVE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local rpm = tonumber(ARGV[1])
+local tpm = tonumber(ARGV[2])
+local cost = math.min(tonumber(ARGV[3]), tpm)
+
+local paused_until = tonumber(redis.call('GET', KEYS[3]) or '0')
+if paused_until > now then
+    return tostring(paused_until - now)
+end
+
+local function refill(key, capacity)
+    local state = redis.call('HMGET', key, 'level', 'ts')
+    local level = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    return math.min(capacity, level + (now - ts) * capacity / 60)
+end
+
+local requests = refill(KEYS[1], rpm)
+local tokens = refill(KEYS[2], tpm)
+
+local wait = 0
+if requests < 1 then wait = math.max(wait, (1 - requests) * 60 / rpm) end
+if tokens < cost then wait = math.max(wait, (cost - tokens) * 60 / tpm) end
+if wait == 0 then
+    requests = requests - 1
+    tokens = tokens - cost
+end
+
+redis.call('HSET', KEYS[1], 'level', requests, 'ts', now)
+redis.call('HSET', KEYS[2], 'level', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 120)
+redis.call('EXPIRE', KEYS[2], 120)
+return tostring(wait)
+"""
+
+# Extends the shared pause to ARGV[1] seconds from now, on the same (Redis server) clock
+# RESERVE_SCRIPT compares it with; worker clocks may be skewed.
+PAUSE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local seconds = tonumber(ARGV[1])
+local paused_until = now + seconds
+if paused_until > tonumber(redis.call('GET', KEYS[1]) or '0') then
+    redis.call('SET', KEYS[1], string.format('%.6f', paused_until), 'EX', math.max(1, math.ceil(seconds) + 1))
+end
+return 1
+"""
+
+# Gives back tokens that were reserved but not used (estimate minus actual usage).
+REFUND_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local level = tonumber(redis.call('HGET', KEYS[1], 'level') or capacity)
+redis.call('HSET', KEYS[1], 'level', math.min(capacity, level + tonumber(ARGV[2])))
+return 1
+"""
+
+
+class ClusterRateLimiter:
+    """
+    Redis-backed token-bucket limiter shared by every Celery worker.
+    Each Claude attempt reserves one request plus its estimated tokens before it is sent, and
+    settles it afterwards: refunded in full when the API rejects it, or down to actual usage.
+    When the API still pushes back, pause() stops the whole cluster for the retry-after window.
+    Fails open: if Redis is unreachable, calls proceed and rely on the retry policy instead.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, prefix="claude:ratelimit"):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.keys = [f"{prefix}:requests", f"{prefix}:tokens", f"{prefix}:paused_until"]
+        self._reserve = None
+        self._pause = None
+        self._refund = None
+
+    def reserve(self, tokens):
+        """Tries to take a slot; returns 0 on success or the seconds to wait before trying again."""
+        if self._reserve is None:
+            self._reserve = get_redis().register_script(RESERVE_SCRIPT)
+        try:
+            wait = self._reserve(keys=self.keys, args=[self.requests_per_minute, self.tokens_per_minute, tokens])
+        except redis.RedisError as e:
+            print(f"Rate limiter unavailable ({e}); proceeding without it.")
+            return 0
+        return float(wait)
+
+    def acquire(self, tokens):
+        while True:
+            wait = self.reserve(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens):
+        while True:
+            wait = await asyncio.to_thread(self.reserve, tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """Holds back every worker for `seconds` (used to honour retry-after on 429/529)."""
+        try:
+            if self._pause is None:
+                self._pause = get_redis().register_script(PAUSE_SCRIPT)
+            self._pause(keys=[self.keys[2]], args=[seconds])
+        except redis.RedisError:
+            pass
+
+    def settle(self, reserved_tokens, usage):
+        """Refunds the unused part of a reservation once the API reports actual usage."""
+        if not usage:
+            return
+        # Cache reads don't count against the input token limit; cache writes do
+        used = usage.get('input_tokens', 0) + usage.get('output_tokens', 0) + (usage.get('cache_creation_input_tokens') or 0)
+        self.refund(reserved_tokens - used)
+
+    def refund(self, tokens):
+        """Returns reserved tokens to the bucket, e.g. all of them for an attempt the API rejected."""
+        if tokens <= 0:
+            return
+        try:
+            if self._refund is None:
+                self._refund = get_redis().register_script(REFUND_SCRIPT)
+            self._refund(keys=[self.keys[1]], args=[self.tokens_per_minute, tokens])
+        except redis.RedisError:
+            pass
+
+
+_limiter = None
+
+
+def get_rate_limiter():
+    """Process-wide limiter (None when rate limiting is switched off in settings)."""
+    global _limiter
+    if _limiter is None and settings.CLAUDE_RATE_LIMIT_ENABLED:
+        _limiter = ClusterRateLimiter(
+            requests_per_minute=settings.CLAUDE_REQUESTS_PER_MINUTE,
+            tokens_per_minute=settings.CLAUDE_TOKENS_PER_MINUTE,
+        )
+    return _limiter
@@ -0,0 +1,15 @@
+import redis
+from django.conf import settings
+
+_client = None
+
+
+def get_redis():
+    """
+    Returns a process-wide Redis client on the same instance Celery uses as its broker.
+    The connection pool is created lazily so importing worker modules never touches the network.
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+    return _client
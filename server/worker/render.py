@@ -0,0 +1,109 @@
+import hashlib
+import html
+import tempfile
+
+from .artifacts import NoSuchKey, get_artifact_store
+
+# Bump whenever the template or stylesheet changes, so cached PDFs are re-rendered
+TEMPLATE_VERSION = '2'
+
+REPORT_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>{title}</title></head>
+<body>
+<header><span class="brand">Applaude</span> {title}</header>
+<main>{body}</main>
+</body>
+</html>
+"""
+
+REPORT_CSS = """
+@page { size: A4; margin: 2cm 1.8cm; @bottom-right { content: counter(page) " / " counter(pages); font-size: 9pt; color: #666; } }
+body { font-family: "DejaVu Sans", sans-serif; font-size: 10.5pt; line-height: 1.45; color: #1d1d1f; }
+header { border-bottom: 2px solid #4f46e5; padding-bottom: 6pt; margin-bottom: 14pt; font-size: 11pt; color: #555; }
+header .brand { font-weight: bold; color: #4f46e5; margin-right: 6pt; }
+h1, h2, h3 { color: #111; margin: 14pt 0 6pt; }
+pre, code { font-family: "DejaVu Sans Mono", monospace; font-size: 8.5pt; }
+pre { background: #f5f5f7; padding: 8pt; border-radius: 4pt; white-space: pre-wrap; word-wrap: break-word; }
+table { border-collapse: collapse; width: 100%; } th, td { border: 1px solid #ddd; padding: 4pt 6pt; }
+"""
+
+RENDER_CACHE_PREFIX = 'render-cache'
+
+
+def _fetch_inline_only(url, *args, **kwargs):
+    """
+    WeasyPrint url_fetcher that only resolves data: URLs. The report is model output shaped by
+    customer code and logs, so it must never make the render worker read local files
+    (file:///app/.env) or issue requests (SSRF); refused resources are simply left out.
+    """
+    from weasyprint.urls import default_url_fetcher
+
+    if not url.startswith('data:'):
+        raise ValueError(f"External resource refused in report: {url[:100]}")
+    return default_url_fetcher(url, *args, **kwargs)
+
+
+def content_hash(markdown_text, title):
+    return hashlib.sha256(f"{TEMPLATE_VERSION}\0{title}\0{markdown_text}".encode('utf-8')).hexdigest()
+
+
+class ReportRenderer:
+    """
+    Markdown -> PDF for the Reporting Agent's output, run on the dedicated 'render' queue.
+
+    The markdown converter, compiled stylesheet and font configuration are built once per
+    worker process and reused for every report, and rendered PDFs are cached in the artifact
+    store by a hash of their input, so re-rendering an identical report costs nothing. The
+    heavy imports live here rather than at module level: the API and the other queues import
+    worker.tasks but never render.
+    """
+
+    def __init__(self):
+        import markdown
+        from weasyprint import CSS
+        from weasyprint.text.fonts import FontConfiguration
+
+        self.font_config = FontConfiguration()
+        self.stylesheet = CSS(string=REPORT_CSS, font_config=self.font_config)
+        self.markdown = markdown.Markdown(extensions=['fenced_code', 'tables', 'sane_lists'])
+        # Raw HTML in the report is escaped and shown as text, never passed through to the PDF
+        self.markdown.preprocessors.deregister('html_block')
+        self.markdown.inlinePatterns.deregister('html')
+
+    def render_to(self, markdown_text, title, target):
+        """Writes the PDF into the binary file object `target`."""
+        from weasyprint import HTML
+
+        self.markdown.reset()
+        document = REPORT_TEMPLATE.format(title=html.escape(title), body=self.markdown.convert(markdown_text))
+        HTML(string=document, url_fetcher=_fetch_inline_only).write_pdf(target, stylesheets=[self.stylesheet], font_config=self.font_config)
+
+    def render_artifact(self, markdown_text, title, key):
+        """
+        Stores the PDF for `markdown_text` under `key` in the artifact store, rendering it
+        only on a cache miss. Returns the store's put/copy result.
+        """
+        store = get_artifact_store()
+        cache_key = f"{RENDER_CACHE_PREFIX}/{content_hash(markdown_text, title)}.pdf"
+        try:
+            return store.copy_object(CopySource=cache_key, Key=key)
+        except NoSuchKey:
+            pass
+
+        # Spooled to disk past a few MB, then streamed into the store frame by frame
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as pdf:
+            self.render_to(markdown_text, title, pdf)
+            pdf.seek(0)
+            store.put_object(Key=cache_key, Body=pdf, ContentType='application/pdf')
+        return store.copy_object(CopySource=cache_key, Key=key)
+
+
+_renderer = None
+
+
+def get_renderer():
+    global _renderer
+    if _renderer is None:
+        _renderer = ReportRenderer()
+    return _renderer
@@ -0,0 +1,211 @@
+import fcntl
+import os
+import shutil
+import subprocess
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Answers git's credential prompts from the environment, so the token never appears on a command line (ps)
+ASKPASS_SCRIPT = """#!/bin/sh
+case "$1" in
+    Username*) echo x-access-token ;;
+    *) echo "$APPLAUDE_GIT_TOKEN" ;;
+esac
+"""
+
+
+class RepoMirrorCache:
+    """
+    Per-project bare mirrors on the worker's disk, with a cheap `git worktree` per run.
+
+    Layout under REPO_CACHE_DIR:
+        mirrors/<project_id>.git      bare mirror, refreshed with an incremental fetch each run
+        worktrees/<project_id>/<run>  detached checkout for a single run
+        locks/<project_id>.lock       flock guarding mirror fetches and worktree bookkeeping
+
+    The lock is an OS file lock, so it is shared by every Celery process on the host and is
+    released automatically if a worker dies mid-fetch. Mirrors are evicted least-recently-used
+    once the cache exceeds REPO_CACHE_MAX_BYTES, skipping any mirror that still has worktrees.
+    """
+
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root or settings.REPO_CACHE_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else settings.REPO_CACHE_MAX_BYTES
+        self.mirrors_dir = os.path.join(self.root, 'mirrors')
+        self.worktrees_dir = os.path.join(self.root, 'worktrees')
+        self.locks_dir = os.path.join(self.root, 'locks')
+        for path in (self.mirrors_dir, self.worktrees_dir, self.locks_dir):
+            os.makedirs(path, exist_ok=True)
+        self.askpass = os.path.join(self.root, 'askpass.sh')
+        if not os.path.exists(self.askpass):
+            staging = f"{self.askpass}.{uuid.uuid4().hex}.tmp"
+            with open(staging, 'w') as handle:
+                handle.write(ASKPASS_SCRIPT)
+            os.chmod(staging, 0o700)
+            os.replace(staging, self.askpass)
+
+    # --- Paths ---
+    def mirror_path(self, project_id):
+        return os.path.join(self.mirrors_dir, f"{project_id}.git")
+
+    def worktree_path(self, project_id, run_id):
+        return os.path.join(self.worktrees_dir, str(project_id), str(run_id))
+
+    # --- Locking ---
+    @contextmanager
+    def lock(self, project_id, blocking=True):
+        """Exclusive per-project lock; yields False instead of waiting when blocking=False and it is held."""
+        with open(os.path.join(self.locks_dir, f"{project_id}.lock"), 'w') as handle:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(handle, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    # --- Git plumbing ---
+    def _git(self, *args, token=None, cwd=None):
+        env = {**os.environ, 'GIT_TERMINAL_PROMPT': '0'}
+        if token:
+            # Handed to git per invocation through GIT_ASKPASS: never in argv, never in the mirror's config
+            env.update({'GIT_ASKPASS': self.askpass, 'APPLAUDE_GIT_TOKEN': token})
+        result = subprocess.run(
+            ['git', *args],
+            cwd=cwd,
+            capture_output=True,
+            text=True,
+            timeout=settings.GIT_COMMAND_TIMEOUT,
+            env=env,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"git {' '.join(args[:2])} failed: {result.stderr.strip()}")
+        return result.stdout.strip()
+
+    def _touch(self, project_id):
+        stamp = os.path.join(self.mirror_path(project_id), 'applaude-last-used')
+        with open(stamp, 'a'):
+            os.utime(stamp, None)
+
+    def _last_used(self, mirror):
+        stamp = os.path.join(mirror, 'applaude-last-used')
+        return os.path.getmtime(stamp) if os.path.exists(stamp) else os.path.getmtime(mirror)
+
+    # --- Mirror and worktree steps (the caller holds self.lock(project_id)) ---
+    def _sync(self, project_id, repo_url, token=None):
+        mirror = self.mirror_path(project_id)
+        if os.path.isdir(mirror):
+            self._git('--git-dir', mirror, 'fetch', '--prune', '--quiet', 'origin', token=token)
+        else:
+            # Clone next to the final path and rename, so a crash never leaves a half-built mirror
+            staging = f"{mirror}.{uuid.uuid4().hex}.tmp"
+            try:
+                self._git('clone', '--mirror', '--quiet', repo_url, staging, token=token)
+                os.rename(staging, mirror)
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+        self._touch(project_id)
+        return mirror
+
+    def _add_worktree(self, project_id, run_id, ref):
+        mirror = self.mirror_path(project_id)
+        path = self.worktree_path(project_id, run_id)
+        if os.path.isdir(path):
+            return path, self._git('rev-parse', 'HEAD', cwd=path)
+        sha = self._git('--git-dir', mirror, 'rev-parse', f"{ref}^{{commit}}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._git('--git-dir', mirror, 'worktree', 'add', '--detach', '--quiet', path, sha)
+        self._touch(project_id)
+        return path, sha
+
+    # --- Public API ---
+    def sync(self, project_id, repo_url, token=None):
+        """Creates the project's mirror on first use, otherwise fetches only what changed."""
+        with self.lock(project_id):
+            return self._sync(project_id, repo_url, token=token)
+
+    def checkout(self, project_id, repo_url, run_id, ref='HEAD', token=None):
+        """
+        Refreshes the mirror and returns (worktree_path, commit_sha) for this run.
+        Idempotent: calling it again for the same run reuses the existing worktree.
+        Fetch and worktree are added under one lock, so evict() can't remove the mirror in between.
+        """
+        with self.lock(project_id):
+            self._sync(project_id, repo_url, token=token)
+            return self._add_worktree(project_id, run_id, ref)
+
+    def ensure_worktree(self, project_id, repo_url, run_id, commit_sha, token=None):
+        """
+        Worktree of an already-known commit, for pipeline phases that may run on another host:
+        reuses an existing checkout, else adds one from the local mirror, fetching only if the
+        mirror is missing or does not have the commit yet.
+        """
+        with self.lock(project_id):
+            try:
+                return self._add_worktree(project_id, run_id, commit_sha)
+            except RuntimeError:
+                self._sync(project_id, repo_url, token=token)
+                return self._add_worktree(project_id, run_id, commit_sha)
+
+    def add_worktree(self, project_id, run_id, ref='HEAD'):
+        """Adds a worktree from the mirror as it is, without fetching (e.g. extra checkouts of a pinned commit)."""
+        with self.lock(project_id):
+            return self._add_worktree(project_id, run_id, ref)
+
+    def remove_worktree(self, project_id, run_id):
+        mirror = self.mirror_path(project_id)
+        path = self.worktree_path(project_id, run_id)
+        with self.lock(project_id):
+            if os.path.isdir(path):
+                try:
+                    self._git('--git-dir', mirror, 'worktree', 'remove', '--force', path)
+                except RuntimeError:
+                    shutil.rmtree(path, ignore_errors=True)
+            if os.path.isdir(mirror):
+                self._git('--git-dir', mirror, 'worktree', 'prune')
+
+    def push(self, worktree, repo_url, branch, token=None):
+        """Pushes the worktree's HEAD to `branch` on the remote."""
+        self._git('push', '--force', '--quiet', repo_url, f"HEAD:refs/heads/{branch}", token=token, cwd=worktree)
+
+    def _active_worktrees(self, project_id):
+        project_dir = os.path.join(self.worktrees_dir, str(project_id))
+        return os.path.isdir(project_dir) and bool(os.listdir(project_dir))
+
+    @staticmethod
+    def disk_usage(path):
+        total = 0
+        for dirpath, _, filenames in os.walk(path):
+            for name in filenames:
+                try:
+                    total += os.lstat(os.path.join(dirpath, name)).st_size
+                except OSError:
+                    pass
+        return total
+
+    def evict(self):
+        """Deletes least-recently-used idle mirrors until the cache fits in max_bytes. Returns evicted project ids."""
+        mirrors = []
+        for name in os.listdir(self.mirrors_dir):
+            if name.endswith('.git'):
+                path = os.path.join(self.mirrors_dir, name)
+                mirrors.append((self._last_used(path), name[:-len('.git')], path, self.disk_usage(path)))
+
+        total = sum(size for *_, size in mirrors)
+        evicted = []
+        for _, project_id, path, size in sorted(mirrors):
+            if total <= self.max_bytes:
+                break
+            with self.lock(project_id, blocking=False) as acquired:
+                # Checked under the lock: worktrees are only added while holding it
+                if not acquired or self._active_worktrees(project_id):
+                    continue # A run is fetching into it or still using it
+                shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            evicted.append(project_id)
+        return evicted
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+
+from .redis_conn import get_redis
+
+
+class LocalLRUCache:
+    """
+    In-process LRU tier. Bounded both by entry count and by total bytes of cached text;
+    entries also expire after `ttl` seconds so a long-lived worker never serves stale data forever.
+    """
+
+    def __init__(self, max_entries, max_bytes, ttl):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                self._evict(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._evict(next(iter(self._entries)))
+
+    def _evict(self, key):
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value.encode('utf-8'))
+
+
+class RedisResponseCache:
+    """
+    Shared tier on the Celery broker's Redis, so identical requests from any worker hit.
+    Entries carry a TTL, and a sorted set of last-access times caps the number of keys (LRU trim).
+    """
+
+    KEY_PREFIX = "claude:response:"
+    INDEX_KEY = "claude:response:index"
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    def get(self, key):
+        conn = get_redis()
+        value = conn.get(self.KEY_PREFIX + key)
+        if value is None:
+            return None
+        conn.zadd(self.INDEX_KEY, {key: time.time()})
+        return value.decode('utf-8')
+
+    def set(self, key, value):
+        conn = get_redis()
+        pipe = conn.pipeline()
+        pipe.set(self.KEY_PREFIX + key, value, ex=self.ttl)
+        pipe.zadd(self.INDEX_KEY, {key: time.time()})
+        pipe.zcard(self.INDEX_KEY)
+        size = pipe.execute()[-1]
+
+        overflow = size - self.max_entries
+        if overflow > 0:
+            stale = [member.decode('utf-8') for member, _ in conn.zpopmin(self.INDEX_KEY, overflow)]
+            if stale:
+                conn.delete(*(self.KEY_PREFIX + k for k in stale))
+
+
+class ResponseCache:
+    """
+    Content-addressed cache for Claude responses: local LRU first, then shared Redis.
+    Keys are a SHA-256 of the exact request payload (model, system prompt, messages, max_tokens),
+    so any change to the prompt or model is automatically a different entry.
+    """
+
+    STATS_KEY = "claude:response:stats"
+
+    def __init__(self, local=None, shared=None, disabled_agents=()):
+        self.local = local
+        self.shared = shared
+        self.disabled_agents = set(disabled_agents)
+        self.counters = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'errors': 0}
+
+    @staticmethod
+    def make_key(payload):
+        canonical = json.dumps(
+            [payload['model'], payload['system'], payload['messages'], payload['max_tokens']],
+            sort_keys=True,
+            separators=(',', ':'),
+        )
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def enabled_for(self, agent):
+        return agent not in self.disabled_agents
+
+    def get(self, key):
+        if self.local is not None:
+            value = self.local.get(key)
+            if value is not None:
+                self._count('local_hits')
+                return value
+
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except redis.RedisError as e:
+                print(f"Response cache: shared tier unavailable ({e}).")
+                self._count('errors')
+                value = None
+            if value is not None:
+                self._count('shared_hits')
+                if self.local is not None:
+                    self.local.set(key, value)
+                return value
+
+        self._count('misses')
+        return None
+
+    def set(self, key, value):
+        if self.local is not None:
+            self.local.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value)
+            except redis.RedisError as e:
+                print(f"Response cache: could not write shared tier ({e}).")
+                self._count('errors')
+
+    def _count(self, name):
+        self.counters[name] += 1
+        try:
+            get_redis().hincrby(self.STATS_KEY, name, 1)
+        except redis.RedisError:
+            pass
+
+    def stats(self):
+        """Cluster-wide counters from Redis, falling back to this process's counters."""
+        try:
+            raw = get_redis().hgetall(self.STATS_KEY)
+            return {k.decode('utf-8'): int(v) for k, v in raw.items()}
+        except redis.RedisError:
+            return dict(self.counters)
+
+
+_cache = None
+
+
+def get_response_cache():
+    """Process-wide cache instance (None when caching is switched off in settings)."""
+    global _cache
+    if _cache is None and settings.CLAUDE_CACHE_ENABLED:
+        _cache = ResponseCache(
+            local=LocalLRUCache(
+                max_entries=settings.CLAUDE_CACHE_LOCAL_MAX_ENTRIES,
+                max_bytes=settings.CLAUDE_CACHE_LOCAL_MAX_BYTES,
+                ttl=settings.CLAUDE_CACHE_TTL,
+            ),
+            shared=RedisResponseCache(
+                max_entries=settings.CLAUDE_CACHE_SHARED_MAX_ENTRIES,
+                ttl=settings.CLAUDE_CACHE_TTL,
+            ),
+            disabled_agents=settings.CLAUDE_CACHE_DISABLED_AGENTS,
+        )
+    return _cache
@@ -0,0 +1,56 @@
+from typing import NamedTuple
+
+from django.conf import settings
+
+
+class Route(NamedTuple):
+    """Model chosen for one Claude call, the model to fall back to, and why."""
+    model: str
+    fallback: str
+    reason: str
+    task: str
+    prompt_tokens: int
+    plan: str
+    escalation: int = 0
+
+
+class ModelRouter:
+    """
+    Picks the model for each Claude call from the agent, the task, the prompt size and the
+    customer's plan:
+
+        planner               strong   (whole-suite generation needs the best reasoning)
+        fixer                 fast for short prompts, strong for long ones or CLAUDE_ROUTE_STRONG_PLANS
+        fixer, escalated      strong   (a previous patch failed verification)
+        scribe summary        fast     (map step of the report map-reduce)
+        scribe report         strong   (client-facing)
+
+    Every route names the other model as its fallback for overload/timeouts. Decisions are
+    recorded per call (ModelRoutingDecision) so the thresholds can be tuned from real data.
+    """
+
+    def __init__(self, plan=None):
+        self.plan = plan
+
+    def route(self, agent, prompt_tokens, task=None, escalation=0):
+        fast, strong = settings.CLAUDE_MODEL_FAST, settings.CLAUDE_MODEL_STRONG
+        task = task or agent or 'other'
+
+        def _route(model, reason):
+            return Route(model, strong if model == fast else fast, reason, task, prompt_tokens, self.plan or '', escalation)
+
+        if not settings.CLAUDE_ROUTING_ENABLED:
+            return _route(strong, 'routing disabled')
+        if escalation:
+            return _route(strong, f'escalation {escalation}: previous patch failed verification')
+        if agent == 'planner':
+            return _route(strong, 'test planning')
+        if agent == 'scribe':
+            return _route(fast, 'report summary') if task == 'summary' else _route(strong, 'client report')
+        if agent == 'fixer':
+            if self.plan in settings.CLAUDE_ROUTE_STRONG_PLANS:
+                return _route(strong, f'plan {self.plan}')
+            if prompt_tokens > settings.CLAUDE_ROUTE_FAST_MAX_TOKENS:
+                return _route(strong, f'large prompt ({prompt_tokens} tokens)')
+            return _route(fast, f'short fix ({prompt_tokens} tokens)')
+        return _route(strong, 'default')
@@ -0,0 +1,61 @@
+import os
+import subprocess
+
+from .executor import imported_sources
+from .indexer import LANGUAGES
+
+# Only changes to code can change test outcomes; docs, images etc. never select or generate tests
+CODE_LANGUAGES = {'py', 'js', 'jsx', 'ts', 'tsx', 'vue', 'svelte', 'html', 'css', 'sql'}
+
+
+def is_code(path):
+    return LANGUAGES.get(os.path.splitext(path)[1].lower(), '') in CODE_LANGUAGES
+
+
+def changed_files(worktree, base_sha, head_sha):
+    """Paths changed between two commits, or None when base_sha is no longer reachable (force-push, gc)."""
+    result = subprocess.run(
+        ['git', 'diff', '--name-only', '-z', base_sha, head_sha],
+        cwd=worktree, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        return None
+    return [path for path in result.stdout.split('\0') if path]
+
+
+def dependency_closure(worktree, test_path, limit=500):
+    """Repo files a test reaches through its imports, followed transitively (bounded by `limit`)."""
+    seen = []
+    queue = imported_sources(test_path, worktree)
+    while queue and len(seen) < limit:
+        path = queue.pop(0)
+        if path in seen:
+            continue
+        seen.append(path)
+        queue.extend(p for p in imported_sources(path, worktree) if p not in seen)
+    return sorted(seen)
+
+
+def build_dependency_map(worktree, tests):
+    """
+    `tests` maps each generated test's path (relative to GENERATED_TESTS_DIR) to
+    (written_path, code). Returns the JSON stored on TestDependencyMap.tests.
+    """
+    return {
+        test_path: {'code': code, 'sources': dependency_closure(worktree, written_path)}
+        for test_path, (written_path, code) in tests.items()
+    }
+
+
+def select_tests(dependency_map, changed):
+    """Tests whose dependency closure touches any changed file."""
+    changed = set(changed)
+    return [test for test, entry in dependency_map.items() if changed.intersection(entry['sources'])]
+
+
+def uncovered_files(dependency_map, changed):
+    """Changed code files that no existing test depends on; the Planner writes new tests for these."""
+    covered = set()
+    for entry in dependency_map.values():
+        covered.update(entry['sources'])
+    return [path for path in changed if is_code(path) and path not in covered]
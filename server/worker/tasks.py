@@ -1,136 +1,615 @@
-import time
-import random
-from celery import shared_task
+import os
+import socket
+import tempfile
+from datetime import timedelta
+from celery import shared_task, chain
+from django.db import transaction
 from django.utils import timezone
-from projects.models import TestRun
-from .claude_client import Claude4Client # REAL CLIENT
+from projects.models import BatchRequest, PhaseTiming, ProjectRunStats, RunArtifact, TestRun, TestDependencyMap, RunCheckpoint
+from users.models import Subscription
+from .claude_client import Claude4Client, generate_diff_fixes_concurrently # REAL CLIENT
+from .batches import AGENTS, poll_submitted, queue_report, submit_pending
+from .artifacts import delete_orphaned_run_keys, get_artifact_store, record_run_artifact, run_artifact_key, save_run_artifact, save_run_artifact_file
+from .events import publish_run_event, publish_status
+from .metrics import flush_run_metrics, observe_github, run_context
+from .progress import StreamProgress
+from .routing import Route
+from .render import RENDER_CACHE_PREFIX, get_renderer
+from .tracing import span
+from .executor import TestExecutor, write_test_file, locate_failing_source
+from .indexer import RepoIndexer
+from .repo_cache import RepoMirrorCache
+from .selection import build_dependency_map, changed_files, select_tests, uncovered_files
+from .verifier import PatchVerifier, merge_accepted
+from .test_plan import iter_test_files
 import httpx # Used for GitHub API calls
 from django.conf import settings
 
 # --- GitHub Client Placeholder for Tokened Operations ---
 class GitHubClient:
     """Mock/Stub for a real GitHub API wrapper using the user's access token."""
-    def __init__(self, token):
+    def __init__(self, token, repo_cache=None):
         self.token = token
-        self.base_url = "https://api.github.com"
-        self.http_client = httpx.Client(headers={"Authorization": f"token {self.token}"})
+        self.base_url = settings.GITHUB_API_URL.rstrip('/')
+        self.http_client = httpx.Client(
+            headers={"Authorization": f"token {self.token}", "Accept": "application/vnd.github+json"},
+            timeout=30.0,
+        )
+        self.repo_cache = repo_cache or RepoMirrorCache()
+        self.worktree = None
+
+    def clone_repo(self, repo_url, project_id, run_id):
+        """
+        Materialises the repo for a run: incremental fetch into the project's cached bare mirror,
+        then a detached worktree for this run. Returns (worktree_path, commit_sha). [cite: 124]
+        """
+        print(f"GitHub: Syncing mirror and checking out {repo_url} securely...")
+        with observe_github('clone'):
+            self.worktree, commit_sha = self.repo_cache.checkout(project_id, repo_url, run_id, token=self.token)
+        return self.worktree, commit_sha
+
+    def checkout_commit(self, repo_url, project_id, run_id, commit_sha):
+        """Worktree of the run's pinned commit for later phases, fetching only when this host lacks it."""
+        with observe_github('checkout'):
+            self.worktree, _ = self.repo_cache.ensure_worktree(project_id, repo_url, run_id, commit_sha, token=self.token)
+        return self.worktree
+
+    def release(self, project_id, run_id):
+        """Drops this host's worktree for the run; the mirror stays cached for the next phase or run."""
+        self.repo_cache.remove_worktree(project_id, run_id)
+        self.worktree = None
 
-    def clone_repo(self, repo_url):
-        # In a real worker, this would execute a git subprocess with the token for auth [cite: 124]
-        print(f"GitHub: Cloning repo {repo_url} securely...")
-        time.sleep(random.uniform(2, 4)) 
-        # In a real system, you would check the exit code of the subprocess
-        return True
+    def cleanup(self, project_id, run_id):
+        """Drops the run's worktree (the mirror stays cached) and trims the cache to its disk budget."""
+        self.release(project_id, run_id)
+        evicted = self.repo_cache.evict()
+        if evicted:
+            print(f"GitHub: Evicted cached mirrors for projects {evicted}.")
+
+    def push_branch(self, repo_url, branch_name):
+        """Pushes the fix branch committed in the run worktree to the customer's repo."""
+        print(f"GitHub: Pushing {branch_name} to {repo_url}")
+        with observe_github('push'):
+            self.repo_cache.push(self.worktree, repo_url, branch_name, token=self.token)
 
     def create_pull_request(self, repo_owner, repo_name, branch_name, title, body):
-        # This simulates the final step of delivery [cite: 145]
+        """Opens the PR for the pushed fix branch against the repo's default branch [cite: 145]."""
         print(f"GitHub: Creating PR for {repo_owner}/{repo_name} from branch {branch_name}")
+        repo_api = f"{self.base_url}/repos/{repo_owner}/{repo_name}"
+
+        with observe_github('create_pull_request'):
+            repo = self.http_client.get(repo_api)
+            repo.raise_for_status()
+            response = self.http_client.post(f"{repo_api}/pulls", json={
+                'title': title,
+                'head': branch_name,
+                'base': repo.json()['default_branch'],
+                'body': body,
+            })
+            response.raise_for_status()
+        return response.json()['html_url']
         
-        # Mocking successful API call response
-        mock_pr_url = f"https://github.com/{repo_owner}/{repo_name}/pull/{random.randint(10, 99)}"
-        return mock_pr_url
-        
-    def analyze_repo_structure(self, repo_url):
-        # Placeholder for file scanning logic [cite: 31]
-        return "package.json: {react, tailwind, vite}, requirements.txt: {django, drf, celery}"
+    def analyze_repo_structure(self, project_id, commit_sha):
+        """
+        Indexes the checked-out tree (incrementally against the project's last indexed commit)
+        and returns (structure_summary, dependency_summary) for the Planner. [cite: 31]
+        """
+        indexer = RepoIndexer()
+        index = indexer.build(project_id, self.worktree, commit_sha)
+        return indexer.summarize(index), indexer.dependency_summary(index)
     
     def get_failing_file_content(self, file_path):
-        # Placeholder for reading code content
+        if self.worktree:
+            full_path = os.path.join(self.worktree, file_path)
+            if os.path.isfile(full_path):
+                with open(full_path, encoding='utf-8', errors='replace') as handle:
+                    return handle.read()
+        # Placeholder for files the simulated test results point at but the repo does not have
         return f"# Content of {file_path} with the simulated bug."
 
 
-@shared_task
-def run_autonomous_test(run_id):
+# --- Phase pipeline ---
+# run_autonomous_test is split into one Celery task per phase, chained together. Each phase writes
+# its outputs to a RunCheckpoint row, so a crashed run resumes from its last completed phase, and
+# each phase routes to the queue matching its workload (see CELERY_TASK_ROUTES in settings):
+#   io:  clone, deliver      llm: plan, fix, report      cpu: execute
+# Phases can land on different hosts, so each one re-materialises the run's pinned commit from
+# the host's mirror cache (cheap worktree add) and releases it when done.
+
+PHASE_STATUS = {
+    'clone': 'CLONING',
+    'plan': 'TESTING',
+    'execute': 'TESTING',
+    'fix': 'DEBUGGING',
+    'report': 'REPORTING',
+    'deliver': 'REPORTING',
+}
+
+
+def _set_status(run, status):
+    if run.status != status:
+        run.status = status
+        run.save(update_fields=['status'])
+        ProjectRunStats.run_status_changed(run)
+        publish_status(run)
+
+
+def _checkpoint(run, phase):
+    """Output of a completed phase (raises if the phase never completed)."""
+    return RunCheckpoint.objects.get(run=run, phase=phase, completed_at__isnull=False).data
+
+
+def _run_phase(run_id, phase, work):
     """
-    The main asynchronous task that executes the 3-Agent autonomous remediation process,
-    integrated with the Claude 4.0 client.
+    Shared wrapper for every phase task: skips phases already checkpointed (so re-delivered or
+    resumed chains are idempotent), records attempts, stores `work(run)`'s result as the phase
+    checkpoint, and marks the run FAILED (stopping the chain) if the phase raises. Every attempt
+    gets a PhaseTiming row and a trace span, the parent of its Claude/GitHub call spans.
     """
     try:
-        run = TestRun.objects.get(id=run_id)
-        user = run.project.user
-        repo_url = run.project.github_url
-        repo_name = repo_url.split('/')[-1]
-        repo_owner = user.github_username or "unknown-owner"
-        
-        # Initialize Clients (Real Anthropic API interaction)
-        claude_client = Claude4Client()
-        github_client = GitHubClient(user.github_access_token)
+        run = TestRun.objects.select_related('project__user').get(id=run_id)
+    except TestRun.DoesNotExist:
+        print(f"Error: TestRun with ID {run_id} not found.")
+        return
 
-        # --- Phase 1: Agent 1 (Testing Agent - The Planner) [cite: 9, 122] ---
-        run.status = 'CLONING'
-        run.save(update_fields=['status'])
-        
-        # 1. Clone the repo and analyze structure
-        github_client.clone_repo(repo_url)
-        structure_summary = github_client.analyze_repo_structure(repo_url)
-        
-        # 2. Generate tests using Claude
-        run.status = 'TESTING'
-        run.save(update_fields=['status'])
-        
-        test_plan_code = claude_client.generate_test_plan(structure_summary, "requirements.txt content...")
-        # Placeholder: Save the test_plan_code to file for execution
-        print(f"Agent 1 Complete. Test plan generated (Code length: {len(test_plan_code)}).")
-
-        # 3. Execute tests (Simulated)
-        time.sleep(5) 
-        # Mock result: Determine if bugs were found
-        bugs_found = random.choice([0, 2, 5]) 
-        
-        # --- Phase 2: Agent 2 (Debugging Agent - The Fixer) [cite: 10, 129] ---
+    checkpoint, _ = RunCheckpoint.objects.get_or_create(run=run, phase=phase)
+    if checkpoint.completed_at is not None:
+        print(f"Run {run_id}: phase '{phase}' already completed, skipping.")
+        return
+
+    checkpoint.attempts += 1
+    checkpoint.started_at = timezone.now()
+    checkpoint.save(update_fields=['attempts', 'started_at'])
+    worker_host = socket.gethostname()
+    timing = PhaseTiming.objects.create(
+        run=run, phase=phase, attempt=checkpoint.attempts, worker_host=worker_host, started_at=checkpoint.started_at,
+    )
+    _set_status(run, PHASE_STATUS[phase])
+    publish_run_event(run.id, 'phase', {'phase': phase, 'state': 'started', 'attempt': checkpoint.attempts})
+
+    outcome = 'ERROR'
+    attributes = {
+        'applaude.run_id': str(run.id), 'applaude.project_id': str(run.project_id), 'applaude.phase': phase,
+        'applaude.attempt': checkpoint.attempts, 'host.name': worker_host,
+    }
+    try:
+        # Claude and GitHub calls made by the phase are attributed to this run/project (worker/metrics.py)
+        with run_context(run.id, run.project_id), span(f'phase.{phase}', attributes, run_id=run.id):
+            checkpoint.data = work(run) or {}
+        outcome = 'OK'
+    except Exception as e:
+        _set_status(run, 'FAILED')
+        print(f"Critical error during run {run_id} (phase '{phase}'): {e}")
+        raise
+    finally:
+        flush_run_metrics(run.id)
+        timing.outcome = outcome
+        timing.completed_at = timezone.now()
+        timing.duration_seconds = (timing.completed_at - timing.started_at).total_seconds()
+        timing.save(update_fields=['outcome', 'completed_at', 'duration_seconds'])
+
+    checkpoint.completed_at = timezone.now()
+    checkpoint.save(update_fields=['data', 'completed_at'])
+    publish_run_event(run.id, 'phase', {'phase': phase, 'state': 'completed'})
+
+
+def _github(run):
+    return GitHubClient(run.project.user.github_access_token)
+
+
+def _claude(run):
+    """Claude client routing by the run owner's plan (worker/routing.py)."""
+    return Claude4Client(plan=_plan(run))
+
+
+def _plan(run):
+    return Subscription.objects.filter(user_id=run.project.user_id).values_list('plan', flat=True).first()
+
+
+# --- Phase 1a: Clone & analyse [cite: 9, 122] ---
+@shared_task
+def clone_phase(run_id):
+    def work(run):
+        github_client = _github(run)
+        project = run.project
+
+        # 1. Clone the repo (cached mirror + per-run worktree) and analyze structure
+        worktree, commit_sha = github_client.clone_repo(project.github_url, project.id, run.id)
+        try:
+            if project.local_path != github_client.repo_cache.mirror_path(project.id):
+                project.local_path = github_client.repo_cache.mirror_path(project.id)
+                project.save(update_fields=['local_path'])
+            run.commit_sha = commit_sha
+            run.save(update_fields=['commit_sha'])
+            print(f"Checked out {commit_sha[:8]} into {worktree}.")
+            structure_summary, dependency_summary = github_client.analyze_repo_structure(project.id, commit_sha)
+        finally:
+            github_client.release(project.id, run.id)
+
+        return {'structure_summary': structure_summary, 'dependency_summary': dependency_summary}
+
+    _run_phase(run_id, 'clone', work)
+
+
+# --- Phase 1b: Agent 1 (Testing Agent - The Planner) ---
+@shared_task
+def plan_phase(run_id):
+    def work(run):
+        analysis = _checkpoint(run, 'clone')
+        github_client = _github(run)
+        claude_client = _claude(run)
+        worktree = github_client.checkout_commit(run.project.github_url, run.project.id, run.id, run.commit_sha)
+        try:
+            # Change-aware selection: reuse the previous suite and only run tests the diff can affect
+            previous_map = None
+            if not run.full_run:
+                previous_map = TestDependencyMap.objects.filter(
+                    project=run.project, run__run_type=run.run_type
+                ).exclude(run=run).first()
+            changed = changed_files(worktree, previous_map.commit_sha, run.commit_sha) if previous_map else None
+
+            suite = {} # test path -> code
+            focus_files = None
+            if changed is not None:
+                for test_path in select_tests(previous_map.tests, changed):
+                    suite[test_path] = previous_map.tests[test_path]['code']
+                focus_files = uncovered_files(previous_map.tests, changed)
+                print(f"Selection: {len(changed)} files changed since {previous_map.commit_sha[:8]}; "
+                      f"re-running {len(suite)} of {len(previous_map.tests)} tests, {len(focus_files)} files need new tests.")
+
+            # 2. Generate tests using Claude, streamed so progress is visible while it writes. With
+            # TEST_EXECUTE_WHILE_PLANNING (off by default: it runs tests on this 'llm' worker) each
+            # finished file starts executing right away; execute_phase only runs what hasn't been run here
+            executed = None
+            streamed = []
+            if changed is None or focus_files:
+                progress = StreamProgress(run.id)
+                with tempfile.TemporaryDirectory(prefix='applaude-logs-') as log_dir:
+                    with TestExecutor(worktree, log_dir=log_dir).run_incrementally() as early:
+                        for test_path, test_code in iter_test_files(progress.track(claude_client.generate_test_plan_stream(
+                            analysis['structure_summary'], analysis['dependency_summary'], focus_files
+                        ))):
+                            suite[test_path] = test_code
+                            print(f"Test file ready: {test_path} ({len(test_code)} chars).")
+                            publish_run_event(run.id, 'test_file', {'path': test_path})
+                            if settings.TEST_EXECUTE_WHILE_PLANNING:
+                                early.submit(write_test_file(worktree, test_path, test_code))
+                                streamed.append(test_path)
+                        print(f"Agent 1 Complete. Test plan generated (Code length: {len(progress.text)}, files: {len(suite)}).")
+                        if streamed:
+                            executed = {'paths': streamed, 'results': early.results()}
+                    for log_name in sorted(os.listdir(log_dir)):
+                        save_run_artifact_file(run, f"logs/{log_name}", os.path.join(log_dir, log_name))
+        finally:
+            github_client.release(run.project.id, run.id)
+
+        for test_path, test_code in suite.items():
+            save_run_artifact(run, f"tests/{test_path}", test_code)
+
+        carried = {} if changed is None else {k: v for k, v in previous_map.tests.items() if k not in suite}
+        return {'suite': suite, 'carried': carried, 'executed': executed}
+
+    _run_phase(run_id, 'plan', work)
+
+
+# --- Phase 1c: Execute the generated suite ---
+@shared_task
+def execute_phase(run_id):
+    def work(run):
+        plan = _checkpoint(run, 'plan')
+        github_client = _github(run)
+        worktree = github_client.checkout_commit(run.project.github_url, run.project.id, run.id, run.commit_sha)
+        try:
+            written = {path: (write_test_file(worktree, path, code), code) for path, code in plan['suite'].items()}
+
+            # 3. Execute the suite, sharded across this worker's cores; raw runner logs go to the artifact store.
+            # Files the plan phase already ran while the Planner was streaming are not run again
+            executed = plan.get('executed') or {'paths': [], 'results': None}
+            remaining = [written_path for path, (written_path, _) in written.items() if path not in executed['paths']]
+            with tempfile.TemporaryDirectory(prefix='applaude-logs-') as log_dir:
+                results = TestExecutor(worktree, log_dir=log_dir).run(remaining)
+                for log_name in sorted(os.listdir(log_dir)):
+                    save_run_artifact_file(run, f"logs/{log_name}", os.path.join(log_dir, log_name))
+            if executed['results']:
+                for key in ('passed', 'failed', 'skipped'):
+                    results[key] += executed['results'][key]
+                results['failures'] = sorted(
+                    results['failures'] + executed['results']['failures'], key=lambda f: (f['file'], f['test']),
+                )
+            print(f"Tests: {results['passed']} passed, {results['failed']} failed, {results['skipped']} skipped.")
+            publish_run_event(run.id, 'tests', {key: results[key] for key in ('passed', 'failed', 'skipped')})
+
+            # Record this run's suite and its dependencies; unaffected tests carry over from the previous map
+            TestDependencyMap.objects.update_or_create(
+                run=run,
+                defaults={
+                    'project': run.project,
+                    'commit_sha': run.commit_sha,
+                    'tests': {**plan['carried'], **build_dependency_map(worktree, written)},
+                },
+            )
+
+            # Resolve what the Fixer needs while the tree is checked out
+            bugs = []
+            for failure in results['failures']:
+                failing_file = locate_failing_source(failure, worktree)
+                bugs.append({
+                    'file_path': failing_file,
+                    'error_log': f"{failure['file']}::{failure['test']}\n{failure['traceback']}",
+                    'file_content': github_client.get_failing_file_content(failing_file),
+                    'test_path': failure['file'],
+                    'test_name': failure['test'],
+                    'test_node': failure['node'],
+                    'test_code': github_client.get_failing_file_content(failure['file']),
+                })
+        finally:
+            github_client.release(run.project.id, run.id)
+
+        return {
+            'counts': {key: results[key] for key in ('passed', 'failed', 'skipped')},
+            'bugs': bugs,
+        }
+
+    _run_phase(run_id, 'execute', work)
+
+
+# --- Phase 2: Agent 2 (Debugging Agent - The Fixer) [cite: 10, 129] ---
+@shared_task
+def fix_phase(run_id):
+    def work(run):
+        bugs = _checkpoint(run, 'execute')['bugs']
         run_logs = ""
         fixed_diffs = []
-        if bugs_found > 0:
-            run.status = 'DEBUGGING'
-            run.save(update_fields=['status'])
-            
-            for i in range(bugs_found):
-                failing_file = "checkout.py" if i % 2 == 0 else "components/Cart.jsx"
-                error_log = f"ERROR: 500 Server Error on {failing_file}. Traceback shows TypeError."
-                
-                # Get code content (placeholder)
-                failed_code = github_client.get_failing_file_content(failing_file)
-
-                # Get the code fix from Claude [cite: 135]
-                corrected_code = claude_client.generate_diff_fix(error_log, failed_code)
-                
-                # Placeholder: Apply the corrected_code content to the local file, calculate diff
-                # Placeholder: Re-run test to verify fix [cite: 137]
-                
-                fixed_diffs.append(f"Fix #{i+1} on {failing_file}: ...")
-                run_logs += f"Bug #{i+1} fixed in {failing_file}.\n"
-                time.sleep(2) 
-
-        # --- Phase 3: Agent 3 (Reporting Agent - The Scribe) [cite: 11, 138] ---
-        run.status = 'REPORTING'
-        run.save(update_fields=['status'])
-        
-        report_content = claude_client.generate_report(run_logs + "\n" + "\n".join(fixed_diffs))
-        # Placeholder: Convert report_content to PDF and save (e.g., to Digital Ocean Spaces/S3)
-        print("Agent 3 Complete. Report Generated.")
-        
-        # --- Phase 4: Delivery [cite: 142] ---
-        pr_url = github_client.create_pull_request(
-            repo_owner, 
-            repo_name, 
-            f"applaude-fixes-{run_id[:6]}",
-            f"Applaude Autonomous Fix: {bugs_found} Bugs Remedied",
-            report_content[:1000] # Use part of the report content as PR body
+        accepted = []
+        if not bugs:
+            return {'run_logs': run_logs, 'fixed_diffs': fixed_diffs, 'accepted': accepted}
+
+        github_client = _github(run)
+        claude_client = _claude(run)
+
+        # Get the code fixes from Claude, concurrently and in bug order [cite: 135]. The repo summary is
+        # the same for every call, so it rides in the prompt-cached prefix.
+        analysis = _checkpoint(run, 'clone')
+        repo_context = f"{analysis['structure_summary']}\n\n{analysis['dependency_summary']}"
+        fixes = generate_diff_fixes_concurrently(
+            bugs, concurrency=settings.CLAUDE_MAX_CONCURRENCY, repo_context=repo_context, plan=claude_client.plan,
         )
+
+        # Verify every candidate in its own worktree, in parallel, retrying with the new error [cite: 137]
+        github_client.checkout_commit(run.project.github_url, run.project.id, run.id, run.commit_sha)
+        try:
+            verifier = PatchVerifier(
+                github_client.repo_cache, run.project.id, run.id, run.commit_sha, claude_client, repo_context=repo_context,
+            )
+            verdicts = verifier.verify_all(bugs, fixes)
+        finally:
+            github_client.release(run.project.id, run.id)
+
+        for i, (bug, verdict) in enumerate(zip(bugs, verdicts)):
+            attempts = "; ".join(verdict['log'])
+            if not verdict['accepted']:
+                run_logs += f"Bug #{i+1} in {bug['file_path']} could not be fixed ({attempts}).\n"
+                continue
+            accepted.append([verdict['diff'], f"Applaude: fix {bug['test_path']}::{bug['test_name']} in {bug['file_path']}"])
+            fixed_diffs.append(f"Fix #{i+1} on {bug['file_path']}:\n{verdict['diff']}")
+            run_logs += f"Bug #{i+1} fixed in {bug['file_path']} ({attempts}).\n"
+            save_run_artifact(run, f"fixes/{i+1}.diff", verdict['diff'], 'text/x-diff; charset=utf-8')
+
+        save_run_artifact(run, 'fix-log.txt', run_logs)
+        return {'run_logs': run_logs, 'fixed_diffs': fixed_diffs, 'accepted': accepted}
+
+    _run_phase(run_id, 'fix', work)
+
+
+# --- Phase 3: Agent 3 (Reporting Agent - The Scribe) [cite: 11, 138] ---
+@shared_task
+def report_phase(run_id):
+    def work(run):
+        fixes = _checkpoint(run, 'fix')
+        if settings.CLAUDE_BATCH_REPORTS:
+            # Offline: the report is attached by poll_message_batches when its batch ends
+            params, route = _claude(run).report_batch_request(fixes['run_logs'], len(fixes['fixed_diffs']), fixes['fixed_diffs'])
+            queue_report(run, params, route)
+            print("Agent 3: Report queued for the next message batch.")
+            return {'report': None, 'batched': True}
+        report_content = _claude(run).generate_report(fixes['run_logs'], len(fixes['fixed_diffs']), fixes['fixed_diffs'])
+        _attach_report(run, report_content)
+        print("Agent 3 Complete. Report Generated.")
+        return {'report': report_content}
+
+    _run_phase(run_id, 'report', work)
+
+
+def _attach_report(run, report_content):
+    save_run_artifact(run, 'report.md', report_content, 'text/markdown; charset=utf-8')
+
+    # Announced and rendered only once the artifact row is committed (batch results are attached
+    # inside a transaction); the renderer would otherwise find no report.md and give up.
+    # PDF conversion runs on the render queue, alongside delivery rather than before it
+    def dispatch():
+        publish_run_event(run.id, 'artifact', {'name': 'report.md'})
+        render_report_pdf.delay(str(run.id))
+    transaction.on_commit(dispatch)
+
+
+# --- Phase 4: Delivery [cite: 142] ---
+@shared_task
+def deliver_phase(run_id):
+    def work(run):
+        accepted = _checkpoint(run, 'fix')['accepted']
+        report_content = _checkpoint(run, 'report')['report']
+        if report_content is None: # Batched report, still being generated
+            report_content = "\n".join(
+                ["Verified fixes:", ""] + [f"- {message}" for _, message in accepted] +
+                ["", f"The full report will be available at /api/v1/runs/{run.id}/report.pdf."]
+            )
+        project = run.project
+        repo_name = project.github_url.rstrip('/').split('/')[-1].removesuffix('.git')
+        repo_owner = project.user.github_username or "unknown-owner"
+        branch_name = f"applaude-fixes-{str(run.id)[:6]}"
+
+        # Merge the verified patches onto the fix branch and push it
+        github_client = _github(run)
+        worktree = github_client.checkout_commit(project.github_url, project.id, run.id, run.commit_sha)
+        try:
+            merged = merge_accepted(worktree, branch_name, accepted)
+            if len(merged) < len(accepted):
+                print(f"{len(accepted) - len(merged)} verified fixes conflicted with others and were left out.")
+            if merged:
+                github_client.push_branch(project.github_url, branch_name)
+        finally:
+            github_client.cleanup(project.id, run.id)
+
+        # GitHub refuses a PR without commits, so a run with nothing merged has no PR
+        pr_url = None
+        if merged:
+            pr_url = github_client.create_pull_request(
+                repo_owner, 
+                repo_name, 
+                branch_name,
+                f"Applaude Autonomous Fix: {len(merged)} Bugs Remedied",
+                report_content[:1000] # Use part of the report content as PR body
+            )
         
         # Final update
         run.pr_url = pr_url
-        run.report_url = f"/api/v1/runs/{run_id}/report.pdf" 
+        run.report_url = f"/api/v1/runs/{run.id}/report.pdf" 
+        first_completion = run.completed_at is None # A redelivered deliver phase must not count twice
+        run.bugs_fixed = len(merged)
         run.status = 'COMPLETE'
         run.completed_at = timezone.now()
         run.save()
+        if first_completion:
+            ProjectRunStats.run_completed(run)
+        publish_status(run, pr_url=pr_url, report_url=run.report_url)
         
-        print(f"Run {run_id} Complete. PR: {pr_url}")
+        print(f"Run {run.id} Complete. PR: {pr_url}")
+        return {'pr_url': pr_url, 'merged': len(merged)}
 
-    except TestRun.DoesNotExist:
-        print(f"Error: TestRun with ID {run_id} not found.")
+    _run_phase(run_id, 'deliver', work)
+
+
+# --- Report rendering: off the pipeline, on its own 'render' worker pool ---
+@shared_task(bind=True, max_retries=3, default_retry_delay=30)
+def render_report_pdf(self, run_id):
+    """
+    Renders the run's markdown report into the artifact store as report.pdf (what
+    run.report_url serves). Dispatched by report_phase; the PR is delivered without waiting on it.
+    """
+    try:
+        run = TestRun.objects.select_related('project').get(id=run_id)
+        source = run.artifacts.get(name='report.md')
+    except (TestRun.DoesNotExist, RunArtifact.DoesNotExist):
+        print(f"Run {run_id}: no report to render.")
+        return
+
+    markdown_text = b''.join(get_artifact_store().get_object(Key=source.key)['Body']).decode('utf-8')
+    key = run_artifact_key(run.id, 'report.pdf')
+    try:
+        result = get_renderer().render_artifact(markdown_text, f"Test report: {run.project.name}", key)
     except Exception as e:
-        if 'run' in locals():
-            run.status = 'FAILED'
-            run.save(update_fields=['status'])
-        print(f"Critical error during run {run_id}: {e}")
+        print(f"Rendering the report of run {run_id} failed: {e}")
+        raise self.retry(exc=e)
+    record_run_artifact(run, 'report.pdf', key, result, 'application/pdf')
+    publish_run_event(run.id, 'artifact', {'name': 'report.pdf'})
+
+
+# --- Message Batches mode (CLAUDE_BATCH_REPORTS, worker/batches.py) ---
+@shared_task
+def submit_message_batches():
+    """Periodic (CELERY_BEAT_SCHEDULE): submits the queued report requests as one batch."""
+    return submit_pending()
+
+
+@shared_task
+def poll_message_batches():
+    """
+    Periodic (CELERY_BEAT_SCHEDULE): attaches the reports of ended batches to their runs. A
+    report that failed every batch attempt is generated directly instead.
+    """
+    return poll_submitted(
+        on_result=lambda request, text: _attach_report(request.run, text),
+        on_failure=lambda request: generate_report_directly.delay(request.id),
+    )
+
+
+@shared_task
+def generate_report_directly(batch_request_id):
+    """Fallback for a report the Message Batches API failed to produce: the same request, made synchronously."""
+    request = BatchRequest.objects.select_related('run__project').get(id=batch_request_id)
+    if request.status == 'SUCCEEDED':
+        return
+    params, run = request.params, request.run
+    with run_context(run.id, run.project_id):
+        report_content = _claude(run).call_api(
+            params['system'], params['messages'][0]['content'], max_tokens=params['max_tokens'],
+            agent=AGENTS[request.kind], route=Route(**request.route),
+        )
+    flush_run_metrics(run.id)
+    _attach_report(run, report_content)
+    BatchRequest.objects.filter(pk=request.pk).update(status='SUCCEEDED', completed_at=timezone.now())
+    print(f"Run {run.id}: report generated directly after {request.attempts} failed batch attempts.")
+
+
+PHASES = (
+    ('clone', clone_phase),
+    ('plan', plan_phase),
+    ('execute', execute_phase),
+    ('fix', fix_phase),
+    ('report', report_phase),
+    ('deliver', deliver_phase),
+)
+
+
+@shared_task
+def run_autonomous_test(run_id):
+    """
+    The main entry point for the 3-Agent autonomous remediation process, integrated with the
+    Claude 4.0 client. Dispatches the chain of phase tasks starting at the first phase without
+    a completed checkpoint, so calling it again on a failed run resumes where it stopped.
+    """
+    done = set(
+        RunCheckpoint.objects.filter(run_id=run_id, completed_at__isnull=False).values_list('phase', flat=True)
+    )
+    remaining = [task.si(run_id) for phase, task in PHASES if phase not in done]
+    if not remaining:
+        print(f"Run {run_id} has no phases left to run.")
+        return
+    chain(*remaining).apply_async()
+
+
+@shared_task
+def refund_unqueued_runs():
+    """
+    Periodic sweeper (CELERY_BEAT_SCHEDULE): runs still QUEUED without a Celery task id after
+    RUN_ENQUEUE_GRACE_SECONDS never reached the broker (e.g. the API process died between
+    reserving the quota and enqueueing). They are failed and their run is refunded.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.RUN_ENQUEUE_GRACE_SECONDS)
+    stale = TestRun.objects.filter(
+        status='QUEUED', celery_task_id__isnull=True, quota_refunded=False,
+        started_at__lt=cutoff, checkpoints__isnull=True,
+    ).select_related('project')
+    refunded = sum(run.fail_and_refund() for run in stale)
+    if refunded:
+        print(f"Refunded {refunded} runs that never reached the queue.")
+    return refunded
+
+
+@shared_task
+def collect_artifact_garbage():
+    """
+    Periodic sweeper (CELERY_BEAT_SCHEDULE): drops the store keys of runs that no longer exist and
+    render-cache entries older than ARTIFACT_RENDER_CACHE_DAYS, then the blobs no key refers to any more.
+    """
+    keys = delete_orphaned_run_keys()
+    store = get_artifact_store()
+    cutoff = (timezone.now() - timedelta(days=settings.ARTIFACT_RENDER_CACHE_DAYS)).isoformat()
+    for key in list(store.iter_keys(Prefix=f"{RENDER_CACHE_PREFIX}/")):
+        if store.head_object(Key=key)['LastModified'] < cutoff:
+            store.delete_object(Key=key)
+            keys += 1
+    blobs = store.collect_garbage(grace_seconds=settings.ARTIFACT_GC_GRACE_SECONDS)
+    if keys or blobs:
+        print(f"Artifact GC: removed {keys} orphaned keys and {blobs} unreferenced blobs.")
+    return {'keys': keys, 'blobs': blobs}
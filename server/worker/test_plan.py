@@ -0,0 +1,79 @@
+import re
+
+# Opening fence with optional language tag, e.g. ```python or ```ts
+FENCE_RE = re.compile(r'^```\s*([\w+-]*)\s*$')
+# First-line path comment the Planner is asked to emit: "# tests/test_x.py" or "// e2e/login.spec.ts"
+PATH_COMMENT_RE = re.compile(r'^\s*(?:#|//)\s*([\w./-]+\.(?:py|js|jsx|ts|tsx))\s*$')
+
+DEFAULT_EXTENSIONS = {
+    'python': 'py', 'py': 'py',
+    'javascript': 'js', 'js': 'js', 'jsx': 'jsx',
+    'typescript': 'ts', 'ts': 'ts', 'tsx': 'tsx',
+}
+
+
+def _file_from_block(language, lines, index):
+    """
+    Names a finished code block from its path comment, falling back to a numbered file. Model
+    output decides the path, so absolute paths and `..` segments are never taken from it.
+    """
+    if lines:
+        match = PATH_COMMENT_RE.match(lines[0])
+        path = match.group(1) if match else ''
+        while path.startswith('./'):
+            path = path[2:]
+        if path and not path.startswith('/') and '..' not in path.split('/'):
+            return path, "\n".join(lines[1:]) + "\n"
+
+    extension = DEFAULT_EXTENSIONS.get(language.lower(), 'py')
+    if extension == 'py':
+        path = f"tests/test_generated_{index}.py"
+    else:
+        path = f"e2e/generated_{index}.spec.{extension}"
+    return path, "\n".join(lines) + "\n"
+
+
+def iter_test_files(deltas):
+    """
+    Consumes the Planner's output as a stream of text deltas and yields (path, code)
+    for every fenced code block as soon as its closing fence arrives, so test files
+    can be written and scheduled before the rest of the suite has been generated.
+    """
+    buffer = ""
+    language = None # None while outside a code block
+    lines = []
+    index = 0
+
+    def _consume(line):
+        nonlocal language, lines, index
+        if language is None:
+            match = FENCE_RE.match(line.strip())
+            if match:
+                language, lines = match.group(1), []
+            return None
+        if line.strip() == '```':
+            index += 1
+            finished = _file_from_block(language, lines, index)
+            language, lines = None, []
+            return finished
+        lines.append(line)
+        return None
+
+    for delta in deltas:
+        buffer += delta
+        while "\n" in buffer:
+            line, buffer = buffer.split("\n", 1)
+            finished = _consume(line)
+            if finished:
+                yield finished
+
+    # Output may end without a trailing newline after the last fence
+    if buffer:
+        finished = _consume(buffer)
+        if finished:
+            yield finished
+
+
+def split_test_files(text):
+    """Non-streaming helper: every (path, code) test file in a complete Planner response."""
+    return list(iter_test_files([text]))
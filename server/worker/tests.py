@@ -0,0 +1,133 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from projects.models import BatchRequest, Project, RunArtifact, TestRun
+from . import artifacts
+from .batches import poll_submitted, queue_report, submit_pending
+from .mock_upstreams import MockConfig, make_server
+from .repo_cache import RepoMirrorCache
+from .routing import Route
+from .tasks import _attach_report
+
+
+def _git(*args, cwd=None):
+    return subprocess.run(
+        ['git', '-c', 'user.name=Test', '-c', 'user.email=test@example.com', *args],
+        cwd=cwd, check=True, capture_output=True, text=True,
+    ).stdout.strip()
+
+
+class RepoMirrorCacheTests(SimpleTestCase):
+    """Runs against a local bare repository served over file://."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        source = os.path.join(self.tmp, 'source')
+        _git('init', '--quiet', source)
+        with open(os.path.join(source, 'app.py'), 'w') as handle:
+            handle.write("print('hello')\n")
+        _git('add', 'app.py', cwd=source)
+        _git('commit', '--quiet', '-m', 'initial', cwd=source)
+        self.head = _git('rev-parse', 'HEAD', cwd=source)
+        self.remote = os.path.join(self.tmp, 'remote.git')
+        _git('clone', '--bare', '--quiet', source, self.remote)
+        self.repo_url = f"file://{self.remote}"
+        self.cache = RepoMirrorCache(root=os.path.join(self.tmp, 'cache'), max_bytes=0)
+
+    def test_checkout_is_idempotent(self):
+        path, sha = self.cache.checkout('p1', self.repo_url, 'run-1')
+        again = self.cache.checkout('p1', self.repo_url, 'run-1')
+
+        self.assertEqual((path, sha), again)
+        self.assertEqual(sha, self.head)
+        self.assertTrue(os.path.isfile(os.path.join(path, 'app.py')))
+
+    def test_second_run_reuses_the_mirror(self):
+        self.cache.checkout('p1', self.repo_url, 'run-1')
+        mirror = self.cache.mirror_path('p1')
+        inode = os.stat(mirror).st_ino
+
+        path, sha = self.cache.checkout('p1', self.repo_url, 'run-2')
+
+        self.assertEqual(os.stat(mirror).st_ino, inode)
+        self.assertEqual(sha, self.head)
+        self.assertNotEqual(path, self.cache.worktree_path('p1', 'run-1'))
+
+    def test_evict_skips_projects_with_active_worktrees(self):
+        self.cache.checkout('busy', self.repo_url, 'run-1')
+        self.cache.checkout('idle', self.repo_url, 'run-2')
+        self.cache.remove_worktree('idle', 'run-2')
+
+        evicted = self.cache.evict()
+
+        self.assertEqual(evicted, ['idle'])
+        self.assertTrue(os.path.isdir(self.cache.mirror_path('busy')))
+        self.assertFalse(os.path.exists(self.cache.mirror_path('idle')))
+
+
+class MessageBatchTests(TestCase):
+    """Batch mode end to end against the local stand-in (worker/mock_upstreams.py), with batches ending at once."""
+
+    def setUp(self):
+        self.upstream = make_server('127.0.0.1', 0, MockConfig(claude_median=0, claude_p99=0, batch_seconds=0))
+        threading.Thread(target=self.upstream.serve_forever, daemon=True).start()
+        self.addCleanup(self.upstream.server_close)
+        self.addCleanup(self.upstream.shutdown)
+        host, port = self.upstream.server_address
+        settings_override = override_settings(CLAUDE_API_BASE_URL=f"http://{host}:{port}", CLAUDE_API_KEY='test-key')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir, ignore_errors=True)
+        previous_store, artifacts._store = artifacts._store, artifacts.LocalArtifactStore(root=store_dir)
+        self.addCleanup(setattr, artifacts, '_store', previous_store)
+
+        user = get_user_model().objects.create_user(username="batches", email="batches@example.com", password=None)
+        project = Project.objects.create(user=user, name="project", github_url="https://github.com/example/project")
+        self.run = TestRun.objects.create(project=project, status='COMPLETE')
+
+    def test_report_is_submitted_polled_and_settled(self):
+        route = Route(model='claude-test', fallback='claude-test', reason='test', task='scribe', prompt_tokens=10, plan='FREE')
+        params = {
+            'model': 'claude-test', 'max_tokens': 3000,
+            'system': [{'type': 'text', 'text': "You are the **Reporting Agent (The Scribe)**."}],
+            'messages': [{'role': 'user', 'content': "Run logs: 1 bug fixed."}],
+        }
+        request = queue_report(self.run, params, route)
+        self.assertEqual(queue_report(self.run, params, route).pk, request.pk) # Idempotent per run
+
+        self.assertEqual(submit_pending(), 1)
+        request.refresh_from_db()
+        self.assertEqual(request.status, 'SUBMITTED')
+        self.assertTrue(request.batch_id)
+
+        failures = []
+        with self.captureOnCommitCallbacks() as dispatched: # render_report_pdf is not run here
+            settled = poll_submitted(
+                on_result=lambda request, text: _attach_report(request.run, text), on_failure=failures.append,
+            )
+
+        self.assertEqual(settled, 1)
+        self.assertEqual(failures, [])
+        self.assertEqual(len(dispatched), 1)
+        request.refresh_from_db()
+        self.assertEqual(request.status, 'SUCCEEDED')
+        self.assertEqual(request.attempts, 1)
+        report = RunArtifact.objects.get(run=self.run, name='report.md')
+        body = b''.join(artifacts.get_artifact_store().get_object(Key=report.key)['Body']).decode()
+        self.assertTrue(body.startswith("# Applaude Autonomous Remediation Report"))
+        self.run.refresh_from_db()
+        self.assertGreater(self.run.input_tokens, 0)
+        self.assertGreater(self.run.output_tokens, 0)
+
+        # Settled once: a second poll finds nothing left to do
+        self.assertEqual(poll_submitted(on_result=lambda request, text: self.fail("settled twice"), on_failure=failures.append), 0)
+        self.assertEqual(BatchRequest.objects.filter(status='SUBMITTED').count(), 0)
@@ -0,0 +1,92 @@
+import contextlib
+import os
+import socket
+import uuid
+
+from django.conf import settings
+
+try:
+    from opentelemetry import trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+except ImportError: # Optional while TRACING_ENABLED is off
+    trace = None
+
+# Tracer of this process. Prefork pool children each build their own, as the exporter's
+# background thread does not survive the fork.
+_tracer = None
+_tracer_pid = None
+
+
+def get_tracer():
+    """The process tracer, or None while tracing is disabled."""
+    global _tracer, _tracer_pid
+    if not settings.TRACING_ENABLED:
+        return None
+    if trace is None:
+        raise RuntimeError("TRACING_ENABLED is set but the opentelemetry-sdk package is not installed.")
+    if _tracer_pid != os.getpid():
+        host = socket.gethostname()
+        provider = TracerProvider(resource=Resource.create({
+            'service.name': settings.TRACING_SERVICE_NAME, 'host.name': host,
+        }))
+        # One JSON span per line, one file per process so concurrent writers never interleave
+        os.makedirs(settings.TRACING_EXPORT_DIR, exist_ok=True)
+        path = os.path.join(settings.TRACING_EXPORT_DIR, f"spans-{host}-{os.getpid()}.jsonl")
+        exporter = ConsoleSpanExporter(
+            out=open(path, 'a', buffering=1), formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+        _tracer = provider.get_tracer('applaude.worker')
+        _tracer_pid = os.getpid()
+    return _tracer
+
+
+def _clean(attributes):
+    return {key: value for key, value in (attributes or {}).items() if value is not None}
+
+
+def _run_parent(run_id):
+    """
+    Context whose (virtual) parent span is the run itself: the trace id is the run's UUID, so
+    the phases of a run share one trace even though they execute in different worker processes.
+    """
+    run_uuid = uuid.UUID(str(run_id))
+    parent = trace.SpanContext(
+        trace_id=run_uuid.int, span_id=run_uuid.int & 0xFFFFFFFFFFFFFFFF,
+        is_remote=True, trace_flags=trace.TraceFlags(trace.TraceFlags.SAMPLED),
+    )
+    return trace.set_span_in_context(trace.NonRecordingSpan(parent))
+
+
+@contextlib.contextmanager
+def span(name, attributes=None, run_id=None):
+    """
+    Span around the block, nested under the current span, or the root of the run's trace when
+    `run_id` is given. Exceptions are recorded on the span and re-raised.
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        yield None
+        return
+    context = _run_parent(run_id) if run_id else None
+    with tracer.start_as_current_span(name, context=context, attributes=_clean(attributes)) as current:
+        yield current
+
+
+def start_span(name, attributes=None):
+    """Child span of the current span, for calls that don't fit a with-block; close with end_span()."""
+    tracer = get_tracer()
+    if tracer is None:
+        return None
+    return tracer.start_span(name, attributes=_clean(attributes))
+
+
+def end_span(current, attributes=None, error=None):
+    if current is None:
+        return
+    current.set_attributes(_clean(attributes))
+    if error:
+        current.set_status(trace.Status(trace.StatusCode.ERROR, str(error) if error is not True else None))
+    current.end()
@@ -0,0 +1,174 @@
+import os
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .executor import TestExecutor, write_test_file
+
+DIFF_FENCE_RE = re.compile(r'```(?:diff|patch)?\s*\n(.*?)```', re.S)
+# Header lines naming a file a diff touches (`git apply` honours all of them)
+DIFF_PATH_RE = re.compile(r'^(?:--- |\+\+\+ |rename from |rename to |copy from |copy to )(.+)$', re.M)
+DIFF_GIT_RE = re.compile(r'^diff --git (\S+) (\S+)$', re.M)
+GIT_IDENTITY = ['-c', 'user.name=Applaude', '-c', 'user.email=bot@applaude.pro']
+
+
+def extract_diff(text):
+    """The Fixer is told to return a bare unified diff, but tolerate a fenced one."""
+    match = DIFF_FENCE_RE.search(text)
+    diff = match.group(1) if match else text
+    return diff if diff.endswith('\n') else diff + '\n'
+
+
+def _diff_paths(diff):
+    """Repo-relative paths a unified diff creates, modifies, renames or deletes."""
+    raw = DIFF_PATH_RE.findall(diff)
+    for old, new in DIFF_GIT_RE.findall(diff):
+        raw += [old, new]
+    paths = set()
+    for path in raw:
+        path = path.split('\t', 1)[0].strip().strip('"')
+        if path == '/dev/null':
+            continue
+        if path[:2] in ('a/', 'b/'):
+            path = path[2:]
+        paths.add(path)
+    return paths
+
+
+def unsafe_diff_paths(diff):
+    """
+    Paths in the diff a fix may not touch: anything outside the repo, VCS metadata and the
+    generated tests the fix is judged by. A diff that names no file at all is rejected too.
+    """
+    paths = _diff_paths(diff)
+    if not paths:
+        return ['<no files>']
+    unsafe = []
+    for path in sorted(paths):
+        parts = path.replace('\\', '/').split('/')
+        if (os.path.isabs(path) or '..' in parts or parts[0] in ('.git', settings.GENERATED_TESTS_DIR)):
+            unsafe.append(path)
+    return unsafe
+
+
+def _git(worktree, *args, stdin=None):
+    return subprocess.run(
+        ['git', *GIT_IDENTITY, *args], cwd=worktree, input=stdin,
+        capture_output=True, text=True, timeout=settings.GIT_COMMAND_TIMEOUT,
+    )
+
+
+def _discard_changes(worktree):
+    """Back to the checked-out commit: tracked edits reverted, files a patch created removed."""
+    _git(worktree, 'reset', '--hard', '--quiet')
+    _git(worktree, 'clean', '-fdx', '--quiet')
+
+
+class PatchVerifier:
+    """
+    Verifies Fixer diffs, each in its own worktree of the run's commit.
+
+    For every bug: apply the diff, re-run only that bug's failing test, and on failure send the
+    new error back to the Fixer for another diff, up to FIX_VERIFY_MAX_ATTEMPTS. Bugs are verified
+    concurrently (FIX_VERIFY_CONCURRENCY); worktrees share the project's mirror so each is cheap.
+    """
+
+    def __init__(self, repo_cache, project_id, run_id, commit_sha, claude_client, max_attempts=None, concurrency=None,
+                 repo_context=None):
+        self.repo_cache = repo_cache
+        self.project_id = project_id
+        self.run_id = run_id
+        self.commit_sha = commit_sha
+        self.claude_client = claude_client
+        self.max_attempts = max_attempts or settings.FIX_VERIFY_MAX_ATTEMPTS
+        self.concurrency = concurrency or settings.FIX_VERIFY_CONCURRENCY
+        self.repo_context = repo_context # Same cached prefix as the first round of Fixer calls
+
+    def _failing_target(self, bug):
+        # Re-run just the failing test when we know it (its pytest node id, class included), else the whole file
+        if bug['test_name'] and bug['test_path'].endswith('.py'):
+            return bug.get('test_node') or f"{bug['test_path']}::{bug['test_name']}"
+        return bug['test_path']
+
+    def verify(self, index, bug, candidate):
+        """Returns {'accepted', 'diff', 'attempts', 'log'} for one bug."""
+        worktree_id = f"{self.run_id}-verify-{index}"
+        worktree, _ = self.repo_cache.add_worktree(self.project_id, worktree_id, self.commit_sha)
+        log = []
+        try:
+            # The generated test lives only in the run worktree, so bring it along
+            test_rel = os.path.relpath(bug['test_path'], settings.GENERATED_TESTS_DIR)
+            write_test_file(worktree, test_rel, bug['test_code'])
+            executor = TestExecutor(worktree, workers=1)
+
+            for attempt in range(1, self.max_attempts + 1):
+                if isinstance(candidate, Exception):
+                    log.append(f"attempt {attempt}: no diff ({candidate})")
+                    return {'accepted': False, 'diff': None, 'attempts': attempt, 'log': log}
+
+                diff = extract_diff(candidate)
+                unsafe = unsafe_diff_paths(diff)
+                applied = None if unsafe else _git(worktree, 'apply', '--whitespace=nowarn', '-', stdin=diff)
+                if unsafe:
+                    error = (
+                        "The previous patch was refused: it may only change the application's source files, "
+                        f"not {', '.join(unsafe)}."
+                    )
+                elif applied.returncode != 0:
+                    error = f"The previous patch did not apply cleanly:\n{applied.stderr}"
+                else:
+                    # Always judged by the original test, whatever the patch did to the worktree
+                    write_test_file(worktree, test_rel, bug['test_code'])
+                    result = executor.run([self._failing_target(bug)])
+                    # Verified only if the test actually ran and passed: a node id pytest can't
+                    # find, or a runner that crashed, also reports no failures
+                    if result['exit_code'] == 0 and result['passed'] and not result['failures']:
+                        log.append(f"attempt {attempt}: verified")
+                        return {'accepted': True, 'diff': diff, 'attempts': attempt, 'log': log}
+                    details = result['failures'][0]['traceback'] if result['failures'] else (
+                        f"The test runner exited with code {result['exit_code']} without running the test."
+                    )
+                    error = f"The previous patch did not fix the test:\n{details}"
+                    _discard_changes(worktree)
+                    # The clean also removed the (untracked) generated test
+                    write_test_file(worktree, test_rel, bug['test_code'])
+                log.append(f"attempt {attempt}: rejected")
+
+                if attempt < self.max_attempts:
+                    try:
+                        candidate = self.claude_client.generate_diff_fix(
+                            f"{bug['error_log']}\n\n{error}", bug['file_content'], bug['file_path'], self.repo_context,
+                            escalation=attempt, # The last patch failed verification: escalate to the strong model
+                        )
+                    except Exception as e:
+                        candidate = e
+            return {'accepted': False, 'diff': None, 'attempts': self.max_attempts, 'log': log}
+        finally:
+            self.repo_cache.remove_worktree(self.project_id, worktree_id)
+
+    def verify_all(self, bugs, candidates):
+        """Verifies every (bug, first diff) pair concurrently; results are in bug order."""
+        if not bugs:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(bugs))) as pool:
+            return list(pool.map(self.verify, range(len(bugs)), bugs, candidates))
+
+
+def merge_accepted(worktree, branch, fixes):
+    """
+    Creates `branch` in the run worktree and commits each accepted fix onto it, applied 3-way so
+    independent fixes to the same file still merge. `fixes` is a list of (diff, commit message);
+    returns the diffs that merged.
+    """
+    _git(worktree, 'checkout', '--quiet', '-B', branch)
+    merged = []
+    for diff, message in fixes:
+        if _git(worktree, 'apply', '--3way', '--index', '-', stdin=diff).returncode == 0:
+            _git(worktree, 'commit', '--quiet', '-m', message)
+            merged.append(diff)
+        else:
+            # Drop any half-applied hunks/conflict markers; earlier fixes are already committed
+            _discard_changes(worktree)
+    return merged
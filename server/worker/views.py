@@ -0,0 +1,139 @@
+import hmac
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Aggregate, Avg, Count, FloatField, Max, Q, Sum
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import BasePermission, IsAdminUser
+
+from projects.models import ModelRoutingDecision, PhaseTiming, RunCheckpoint
+from .metrics import render_prometheus
+from .response_cache import get_response_cache
+
+
+class ClaudeCacheStatsView(APIView):
+    """
+    Exposes the Claude response cache hit/miss counters (aggregated across all workers).
+    Staff-only: /api/v1/metrics/claude-cache/
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        cache = get_response_cache()
+        if cache is None:
+            return Response({"enabled": False})
+        return Response({"enabled": True, **cache.stats()})
+
+
+class HasMetricsToken(BasePermission):
+    """`Authorization: Bearer <METRICS_TOKEN>`; the endpoint is closed while no token is configured."""
+
+    def has_permission(self, request, view):
+        expected = f"Bearer {settings.METRICS_TOKEN}"
+        return bool(settings.METRICS_TOKEN) and hmac.compare_digest(request.headers.get('Authorization', ''), expected)
+
+
+class PrometheusMetricsView(APIView):
+    """
+    Claude/GitHub latency histograms, token, retry, cache and cost counters by agent and project,
+    in the Prometheus text format: /api/v1/metrics/prometheus/
+    Per-run totals live on TestRun instead, keeping the exported label sets bounded.
+    """
+    authentication_classes = () # Scrapers present METRICS_TOKEN, not a user JWT
+    permission_classes = (HasMetricsToken,)
+
+    def get(self, request):
+        return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class Percentile(Aggregate):
+    """PostgreSQL's continuous percentile, e.g. Percentile('duration_seconds', 0.95)."""
+    function = 'PERCENTILE_CONT'
+    template = '%(function)s(%(fraction)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+    output_field = FloatField()
+
+    def __init__(self, expression, fraction, **extra):
+        super().__init__(expression, fraction=float(fraction), **extra)
+
+
+def _window_days(request):
+    """The ?days= window of the stats views, clamped to 1..PHASE_STATS_MAX_DAYS; raises ValueError on junk."""
+    days = int(request.query_params.get('days', settings.PHASE_STATS_DEFAULT_DAYS))
+    return min(max(days, 1), settings.PHASE_STATS_MAX_DAYS)
+
+
+class PhaseTimingStatsView(APIView):
+    """
+    Per-phase latency across runs (successful attempts) plus failed attempt counts, from
+    PhaseTiming. Staff-only: /api/v1/metrics/phases/?days=7
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        try:
+            days = _window_days(request)
+        except ValueError:
+            return Response({"detail": "days must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        since = timezone.now() - timedelta(days=days)
+
+        ok = Q(outcome='OK')
+        rows = {
+            row['phase']: row
+            for row in PhaseTiming.objects.filter(started_at__gte=since, completed_at__isnull=False)
+            .values('phase')
+            .annotate(
+                attempts=Count('id'),
+                failures=Count('id', filter=Q(outcome='ERROR')),
+                p50=Percentile('duration_seconds', 0.5, filter=ok),
+                p95=Percentile('duration_seconds', 0.95, filter=ok),
+                p99=Percentile('duration_seconds', 0.99, filter=ok),
+                mean=Avg('duration_seconds', filter=ok),
+                max=Max('duration_seconds', filter=ok),
+            )
+        }
+        # Pipeline order, phases without data included
+        phases = [
+            rows.get(phase, {'phase': phase, 'attempts': 0, 'failures': 0, 'p50': None, 'p95': None, 'p99': None, 'mean': None, 'max': None})
+            for phase, _ in RunCheckpoint.PHASE_CHOICES
+        ]
+        return Response({"since": since, "days": days, "phases": phases})
+
+
+class ModelRoutingStatsView(APIView):
+    """
+    How the model router's choices perform, per agent, task and serving model: call volume,
+    fallbacks, escalations, errors, latency percentiles, prompt size and spend. Staff-only,
+    for tuning the routing thresholds: /api/v1/metrics/routing/?days=7
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        try:
+            days = _window_days(request)
+        except ValueError:
+            return Response({"detail": "days must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        since = timezone.now() - timedelta(days=days)
+
+        answered = Q(outcome='OK')
+        rows = (
+            ModelRoutingDecision.objects.filter(created_at__gte=since)
+            .values('agent', 'task', 'model')
+            .annotate(
+                calls=Count('id'),
+                cache_hits=Count('id', filter=Q(outcome='CACHE_HIT')),
+                errors=Count('id', filter=Q(outcome='ERROR')),
+                fallbacks=Count('id', filter=Q(fell_back=True)),
+                escalated=Count('id', filter=Q(escalation__gt=0)),
+                p50_seconds=Percentile('latency_seconds', 0.5, filter=answered),
+                p95_seconds=Percentile('latency_seconds', 0.95, filter=answered),
+                mean_prompt_tokens=Avg('prompt_tokens'),
+                mean_output_tokens=Avg('output_tokens', filter=answered),
+                cost_usd=Sum('cost_usd'),
+            )
+            .order_by('agent', 'task', 'model')
+        )
+        return Response({"since": since, "days": days, "routes": list(rows)})